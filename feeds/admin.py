@@ -1,10 +1,156 @@
+import uuid
+
+from django.conf import settings
 from django.contrib import admin
-from django.db.models import Count
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 
 from feeds import models
 
+CURSOR_VAR = 'cursor'
+
+
+def get_estimated_count(queryset):
+    """
+    Returns the number of rows in an unfiltered queryset's table as estimated by the database's statistics, which costs nothing to look up,
+    or None if there's no estimate.
+
+    Only PostgreSQL and MySQL keep one, and estimates below FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD are ignored, since those tables are cheap
+    enough to count.
+    """
+    query = queryset.query
+    if query.where or query.distinct or query.is_sliced:
+        return None
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [connection.ops.quote_name(table)])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < settings.FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Takes the count of an unfiltered list from the database's statistics rather than counting every row.
+    """
+
+    estimated = False
+    # Whether the count was cut short by set_limited_count().
+    limited = False
+
+    @cached_property
+    def count(self):
+        estimate = get_estimated_count(self.object_list)
+        if estimate is None:
+            return super().count
+        self.estimated = True
+        return estimate
+
+    def set_limited_count(self, limit):
+        """
+        For lists that don't need an exact count, sets the count to the estimated one, or if there's no estimate, to the number of rows counted
+        up to `limit`, so that counting costs no more than reading `limit` rows. Sets `limited` if there are more rows than that.
+        """
+        estimate = get_estimated_count(self.object_list)
+        if estimate is not None:
+            self.estimated = True
+            self.count = estimate
+        else:
+            count = self.object_list.order_by()[:limit + 1].count()
+            self.limited = count > limit
+            self.count = min(count, limit)
+        return self.count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages through a list in its default order, newest first, by primary key rather than by offset, so that every page costs the same as the
+    first one, however far in it is. Each page links to the next through the last primary key it shows.
+
+    Sorting by a column falls back to numbered pages.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.cursor = int(request.GET.get(CURSOR_VAR, ''))
+        except ValueError:
+            self.cursor = None
+        self.keyset = False
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def get_results(self, request):
+        if ORDER_VAR in self.params or self.show_all:
+            super().get_results(request)
+            return
+
+        # Only the keyset query is run, rather than the parent's page query, and the count is estimated or limited.
+        queryset = self.queryset.order_by('-pk')
+        if self.cursor is not None:
+            queryset = queryset.filter(pk__lt=self.cursor)
+        results = list(queryset[:self.list_per_page + 1])
+        if len(results) > self.list_per_page:
+            results = results[:self.list_per_page]
+            self.next_cursor = results[-1].pk
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.keyset = self.multi_page = self.cursor is not None or self.next_cursor is not None
+        if self.multi_page:
+            self.result_count = paginator.set_limited_count(settings.FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD)
+        else:
+            # The whole list is on this page, so there's nothing to count.
+            self.result_count = paginator.count = len(results)
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = results
+        self.can_show_all = self.result_count <= self.list_max_show_all
+        self.paginator = paginator
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR])
+
+    @property
+    def next_page_url(self):
+        if self.next_cursor is None:
+            return None
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+
+class ScalableChangeListMixin:
+    """
+    Keeps a model's change list fast however large its table grows, with keyset pagination in the default newest-first order and estimated
+    counts.
+    """
+
+    show_full_result_count = False
+
+    ordering = ('-pk',)
+
+    paginator = EstimatedCountPaginator
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
 
 class SourceAdmin(admin.ModelAdmin):
 
@@ -22,6 +168,7 @@ class SourceAdmin(admin.ModelAdmin):
         'posts_link',
         'last_created',
         'lucene_index_actual',
+        'index_target_status',
         'uuid',
     )
 
@@ -34,7 +181,8 @@ class SourceAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related('chunking_options').annotate(posts_count=Count('posts'))
+        # Read the count from the stats table, rather than counting every source's posts on each page load.
+        return qs.select_related('stats').annotate(posts_count=Coalesce(F('stats__post_count'), 0))
 
     def lookup_allowed(self, lookup, value, request=None):
         return True
@@ -50,10 +198,19 @@ class SourceAdmin(admin.ModelAdmin):
 
     posts_link.short_description = 'posts'
 
+    def index_target_status(self, obj=None):
+        if not obj or not obj.id:
+            return ''
+        try:
+            job = obj.index_target_propagation
+        except models.IndexTargetPropagation.DoesNotExist:
+            return 'Up to date'
+        return f'Updating posts after ID {job.last_post_id}'
+
+    index_target_status.short_description = 'index target propagation'
 
-class PostAdmin(admin.ModelAdmin):
 
-    show_full_result_count = False
+class PostAdmin(ScalableChangeListMixin, admin.ModelAdmin):
 
     raw_id_fields = ('source',)
 
@@ -65,10 +222,11 @@ class PostAdmin(admin.ModelAdmin):
         # 'source',
     )
 
-    search_fields = (
-        'title',
-        'uuid',
-    )
+    list_select_related = ('source',)
+
+    search_fields = ('title',)
+
+    search_help_text = 'Searches titles, or finds a post by its UUID.'
 
     readonly_fields = (
         'enclosures_link',
@@ -85,26 +243,53 @@ class PostAdmin(admin.ModelAdmin):
     def lookup_allowed(self, lookup, value, request=None):
         return True
 
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        # Correlated subqueries are only run for the rows on the page, using the foreign key indexes.
+        return qs.annotate(
+            enclosures_count=Subquery(
+                models.Enclosure.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('pk')).values('count')
+            ),
+            media_content_count=Subquery(
+                models.MediaContent.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('pk')).values('count')
+            ),
+        )
+
+    def get_search_fields(self, request):
+        # Substring searches are served by the trigram index on PostgreSQL. Elsewhere, only match title prefixes.
+        if connections[self.model.objects.db].vendor == 'postgresql':
+            return self.search_fields
+        return tuple(f'^{field}' for field in self.search_fields)
+
+    def get_search_results(self, request, queryset, search_term):
+        try:
+            value = uuid.UUID(search_term.strip())
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(uuid=value), False
+
     def enclosures_link(self, obj=None):
         if not obj or not obj.id:
             return ''
-        qs = obj.enclosures.all()
-        return mark_safe(f'<a href="/admin/feeds/enclosure/?post__id={obj.id}" target="_blank">{qs.count()} Enclosures</a>')
+        count = getattr(obj, 'enclosures_count', None)
+        if count is None:
+            count = obj.enclosures.count()
+        return mark_safe(f'<a href="/admin/feeds/enclosure/?post__id={obj.id}" target="_blank">{count} Enclosures</a>')
 
     enclosures_link.short_description = 'enclosures'
 
     def media_content_link(self, obj=None):
         if not obj or not obj.id:
             return ''
-        qs = obj.media_content.all()
-        return mark_safe(f'<a href="/admin/feeds/mediacontent/?post__id={obj.id}" target="_blank">{qs.count()} Media Content</a>')
+        count = getattr(obj, 'media_content_count', None)
+        if count is None:
+            count = obj.media_content.count()
+        return mark_safe(f'<a href="/admin/feeds/mediacontent/?post__id={obj.id}" target="_blank">{count} Media Content</a>')
 
     media_content_link.short_description = 'media content'
 
 
-class EnclosureAdmin(admin.ModelAdmin):
-
-    show_full_result_count = False
+class EnclosureAdmin(ScalableChangeListMixin, admin.ModelAdmin):
 
     raw_id_fields = ('post',)
 
@@ -114,7 +299,7 @@ class EnclosureAdmin(admin.ModelAdmin):
         return True
 
 
-class MediaContentAdmin(admin.ModelAdmin):
+class MediaContentAdmin(ScalableChangeListMixin, admin.ModelAdmin):
 
     raw_id_fields = ('post',)
 
@@ -0,0 +1,169 @@
+"""
+Moves expired posts out of the working tables into compressed archive files, and back.
+
+Each archive file holds gzipped JSON lines, one per post, with the post's enclosures and media content alongside it. Every chunk of posts is
+written as a complete gzip member before the chunk is deleted, so an interrupted run loses nothing.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import settings as _settings # pylint: disable=unused-import
+from .models import Enclosure, MediaContent, Post, Source
+from .utils import NullOutput, rebuild_source_stats
+
+logger = logging.getLogger(__name__)
+
+
+def get_archive_dir(archive_dir=None):
+    archive_dir = archive_dir or settings.FEEDS_ARCHIVE_DIR
+    if not archive_dir:
+        raise ImproperlyConfigured('Set FEEDS_ARCHIVE_DIR to the directory archived posts are written to.')
+    return archive_dir
+
+
+def get_expired_posts(source, now=None):
+    """
+    Returns the posts of a source that fall outside its retention policy, or None if it keeps all its posts.
+    """
+    max_posts, max_age_days = source.get_retention()
+    expired = Q()
+    if max_age_days:
+        expired |= Q(created__lt=(now or timezone.now()) - timedelta(days=max_age_days))
+    if max_posts:
+        # Everything older than the oldest post kept, in the same newest first order the limit is applied in.
+        oldest_kept = Post.objects.filter(source=source).order_by('-created', '-pk').values('created', 'pk')[max_posts - 1:max_posts].first()
+        if oldest_kept:
+            expired |= Q(created__lt=oldest_kept['created']) | Q(created=oldest_kept['created'], pk__lt=oldest_kept['pk'])
+    if not expired:
+        return None
+    return Post.objects.filter(Q(source=source) & expired)
+
+
+def serialize_posts(posts):
+    """
+    Returns one JSON-compatible record per post, holding the post and its attachments in the format of Django's python serializer.
+    """
+    post_ids = [p.pk for p in posts]
+    enclosures = {}
+    for enclosure in Enclosure.objects.filter(post_id__in=post_ids).order_by('pk'):
+        enclosures.setdefault(enclosure.post_id, []).append(enclosure)
+    media_content = {}
+    for media in MediaContent.objects.filter(post_id__in=post_ids).order_by('pk'):
+        media_content.setdefault(media.post_id, []).append(media)
+    for p in posts:
+        # The body has already been read from the old column, if that's where it was, so don't write it twice.
+        p.legacy_body = None
+    return [{
+        'post': serializers.serialize('python', [p])[0],
+        'enclosures': serializers.serialize('python', enclosures.get(p.pk, [])),
+        'media_content': serializers.serialize('python', media_content.get(p.pk, [])),
+    } for p in posts]
+
+
+def archive_source(source, archive_dir=None, chunk_size=None, now=None, output=NullOutput()):
+    """
+    Archives and deletes the posts of a source that fall outside its retention policy, a chunk at a time.
+
+    Returns the number of posts archived.
+    """
+    expired = get_expired_posts(source, now=now)
+    if expired is None:
+        return 0
+    chunk_size = chunk_size or settings.FEEDS_ARCHIVE_CHUNK_SIZE
+    now = now or timezone.now()
+    path = None
+    total = 0
+    while True:
+        posts = list(expired.with_body().order_by('created', 'pk')[:chunk_size])
+        if not posts:
+            break
+        if path is None:
+            directory = os.path.join(get_archive_dir(archive_dir), str(source.pk))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{now:%Y%m%dT%H%M%S}.jsonl.gz")
+        with gzip.open(path, 'at', encoding='utf-8') as fout:
+            for record in serialize_posts(posts):
+                fout.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+            fout.flush()
+            os.fsync(fout.fileno())
+        with transaction.atomic():
+            Post.objects.filter(pk__in=[p.pk for p in posts]).delete()
+            newest = max(p.created for p in posts)
+            Source.objects.filter(pk=source.pk).filter(Q(archived_until__isnull=True) | Q(archived_until__lt=newest)).update(archived_until=newest)
+            if not source.archived_until or source.archived_until < newest:
+                source.archived_until = newest
+                source.take_snapshot(['archived_until'])
+        total += len(posts)
+
+    if total:
+        rebuild_source_stats(Source.objects.filter(pk=source.pk))
+        logger.info('Archived %d posts of source %s to %s.', total, source, path)
+        output.write(f'Archived {total} posts of {source} to {path}.')
+    return total
+
+
+def archive_posts(sources=None, archive_dir=None, chunk_size=None, output=NullOutput()):
+    """
+    Archives the expired posts of the given sources, or of all sources.
+
+    Returns the number of posts archived.
+    """
+    if sources is None:
+        sources = Source.objects.all()
+    now = timezone.now()
+    total = 0
+    for source in sources.order_by('pk').iterator():
+        total += archive_source(source, archive_dir=archive_dir, chunk_size=chunk_size, now=now, output=output)
+    return total
+
+
+def read_archive(path):
+    """
+    Yields the records of an archive file.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as fin:
+        for line in fin:
+            if line.strip():
+                yield json.loads(line)
+
+
+def restore_archive(path, output=NullOutput()):
+    """
+    Restores the posts of an archive file. Posts that exist again, e.g. because they were imported since, are skipped.
+
+    Returns the number of posts restored.
+    """
+    restored = 0
+    skipped = 0
+    source_ids = set()
+    with transaction.atomic():
+        for record in read_archive(path):
+            post = next(serializers.deserialize('python', [record['post']])).object
+            if not Source.objects.filter(pk=post.source_id).exists() or Post.objects.for_guid(post.source, post.guid).exists():
+                skipped += 1
+                continue
+            if Post.objects.filter(pk=post.pk).exists():
+                post.pk = None
+            post.save_base(raw=True)
+            for attachment in serializers.deserialize('python', record['enclosures'] + record['media_content']):
+                attachment.object.pk = None
+                attachment.object.post_id = post.pk
+                attachment.object.save_base(raw=True)
+            source_ids.add(post.source_id)
+            restored += 1
+
+    if source_ids:
+        rebuild_source_stats(Source.objects.filter(pk__in=source_ids))
+    output.write(f'Restored {restored} posts from {path}, skipped {skipped}.')
+    return restored
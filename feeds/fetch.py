@@ -0,0 +1,361 @@
+"""
+Network stage for polling feeds.
+
+Requests are prepared on the calling thread, because picking a proxy touches the database, and are then performed concurrently by an asyncio
+event loop that hands each blocking `requests` call to a worker thread. The responses are processed afterwards, one source at a time, by
+`feeds.utils.read_feed`, so none of the database work ever leaves the calling thread.
+"""
+import asyncio
+import contextlib
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from . import settings as _settings # pylint: disable=unused-import
+
+logger = logging.getLogger(__name__)
+
+
+def get_host(url):
+    """
+    Returns the lower-cased hostname of a URL, or an empty string if it has none.
+    """
+    return (urlparse(url).hostname or '').lower()
+
+
+class SessionPool:
+    """
+    Keeps one requests.Session per host, so that repeated requests to a host reuse its kept-alive connections and TLS sessions instead of
+    opening a new connection, with a fresh handshake, every time.
+
+    Meant to be shared by every request in a polling run and closed at the end of it.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, keep_alive=None):
+        self.pool_connections = pool_connections or settings.FEEDS_HTTP_POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or settings.FEEDS_HTTP_POOL_MAXSIZE
+        self.keep_alive = settings.FEEDS_HTTP_KEEP_ALIVE if keep_alive is None else keep_alive
+        self.requests = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_session(self, url):
+        host = get_host(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if not self.keep_alive:
+                    session.headers['Connection'] = 'close'
+                self._sessions[host] = session
+            self.requests += 1
+        return session
+
+    def get(self, url, **kwargs):
+        return self.get_session(url).get(url, **kwargs)
+
+    def stats(self):
+        """
+        Returns the number of hosts and requests seen, the connections opened to serve them, and how many requests reused an open connection.
+
+        Each reused connection is a TCP handshake, and for HTTPS a TLS handshake, that was saved.
+        """
+        connections = 0
+        connection_requests = 0
+        with self._lock:
+            hosts = len(self._sessions)
+            requests_made = self.requests
+            adapters = {id(adapter): adapter for session in self._sessions.values() for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in manager.pools.keys():
+                    pool = manager.pools.get(key)
+                    if pool is None:
+                        continue
+                    connections += pool.num_connections
+                    connection_requests += pool.num_requests
+        return {
+            'hosts': hosts,
+            'requests': requests_made,
+            'connections': connections,
+            'reused': max(connection_requests - connections, 0),
+        }
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.close()
+
+
+class FetchLimitExceeded(Exception):
+    """
+    Raised when a response body is larger than allowed or takes too long to download.
+    """
+
+
+def abort_response(response):
+    """
+    Cuts the connection a streamed response is being read from, so that a read blocked on it, even in another thread, returns at once.
+
+    Closing the socket isn't enough, as that doesn't wake up a thread blocked reading it. Responses without a socket of their own are closed.
+    """
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if isinstance(sock, socket.socket):
+        with contextlib.suppress(OSError):
+            # Called on the plain socket, so an SSL socket's state isn't touched while another thread reads it.
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    else:
+        response.close()
+
+
+def download(response, max_bytes, deadline=None):
+    """
+    Reads a streamed response's body in chunks, keeping at most `max_bytes` of it in memory and giving up once the monotonic clock passes
+    `deadline`.
+
+    A server trickling its body can keep a single read of a chunk blocked for much longer than the deadline, so the connection is cut from a
+    timer when the deadline passes, rather than only checked between chunks.
+
+    Only successful responses are read in full. Of any other response we only ever look at the start, e.g. to recognise a Cloudflare block page,
+    so their bodies are silently truncated to FEEDS_SNIFF_BYTES.
+
+    The body is left on the response, so `content` and `text` work as usual.
+    """
+    success = 200 <= response.status_code < 300
+    if not success:
+        max_bytes = min(max_bytes, settings.FEEDS_SNIFF_BYTES)
+
+    content_length = response.headers.get('Content-Length', '')
+    if success and content_length.isdigit() and int(content_length) > max_bytes:
+        raise FetchLimitExceeded(f'Feed is larger than the maximum size of {max_bytes} bytes.')
+
+    expired = threading.Event()
+    timer = None
+    if deadline is not None:
+
+        def _expire():
+            expired.set()
+            abort_response(response)
+
+        timer = threading.Timer(max(deadline - time.monotonic(), 0), _expire)
+        timer.daemon = True
+        timer.start()
+
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.iter_content(chunk_size=settings.FEEDS_DOWNLOAD_CHUNK_SIZE):
+            if expired.is_set() or (deadline is not None and time.monotonic() > deadline):
+                expired.set()
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                if success:
+                    raise FetchLimitExceeded(f'Feed is larger than the maximum size of {max_bytes} bytes.')
+                break
+    except Exception: # pylint: disable=broad-exception-caught
+        # Cutting the connection makes the read fail in whatever way the transport fails on a truncated body.
+        if not expired.is_set():
+            raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if expired.is_set():
+        raise FetchLimitExceeded(f'Feed took longer than {settings.FEEDS_FETCH_DEADLINE} seconds to download.')
+
+    response._content = b''.join(chunks)[:max_bytes]
+    return response
+
+
+def http_get(url, session_pool=None, max_bytes=None, **kwargs):
+    """
+    Performs a GET through the session pool when one is given, or through a one-off connection otherwise.
+
+    The body is streamed and limited to `max_bytes`, defaulting to FEEDS_MAX_BODY_SIZE, and to FEEDS_FETCH_DEADLINE seconds in total. Both
+    limits raise FetchLimitExceeded.
+    """
+    deadline = time.monotonic() + settings.FEEDS_FETCH_DEADLINE if settings.FEEDS_FETCH_DEADLINE else None
+    kwargs['stream'] = True
+    if session_pool is None:
+        response = requests.get(url, **kwargs) # pylint: disable=missing-timeout
+    else:
+        response = session_pool.get(url, **kwargs)
+    try:
+        return download(response, max_bytes or settings.FEEDS_MAX_BODY_SIZE, deadline=deadline)
+    finally:
+        response.close()
+
+
+class HostState:
+    """
+    Politeness state for a single host.
+    """
+
+    def __init__(self, limit, delay):
+        # Allowed number of concurrent requests. Kept as a float so that it can be halved and grown smoothly.
+        self.limit = float(limit)
+        # Seconds to wait between starting two requests.
+        self.delay = delay
+        self.in_flight = 0
+        self.next_start = 0.
+        self.condition = asyncio.Condition()
+
+
+class HostScheduler:
+    """
+    Enforces per-host limits on concurrent fetches, so that a batch of feeds served by the same host doesn't hammer it or get us blocked.
+
+    Each host may have at most a limited number of requests in flight, started at least a minimum delay apart. Both adapt to how the host is
+    coping, using additive-increase/multiplicative-decrease: every fast, successful response raises the host's limit by one, up to
+    FEEDS_HOST_MAX_CONCURRENCY, and relaxes its delay, while a 429 or 503, a response slower than FEEDS_HOST_SLOW_LATENCY seconds, or a failed
+    request halves the limit and doubles the delay.
+    """
+
+    BACKOFF_STATUS_CODES = (429, 503)
+
+    def __init__(self, concurrency=None, max_concurrency=None, min_delay=None, max_delay=None, slow_latency=None): # pylint: disable=too-many-positional-arguments
+        self.concurrency = concurrency or settings.FEEDS_HOST_CONCURRENCY
+        self.max_concurrency = max(max_concurrency or settings.FEEDS_HOST_MAX_CONCURRENCY, self.concurrency)
+        self.min_delay = settings.FEEDS_HOST_MIN_DELAY if min_delay is None else min_delay
+        self.max_delay = settings.FEEDS_HOST_MAX_DELAY if max_delay is None else max_delay
+        self.slow_latency = slow_latency or settings.FEEDS_HOST_SLOW_LATENCY
+        self.hosts = {}
+
+    def get_state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.concurrency, self.min_delay)
+        return self.hosts[host]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host):
+        """
+        Waits until the host can take another request, and holds one of its slots for the duration of the block.
+        """
+        state = self.get_state(host)
+        async with state.condition:
+            while True:
+                now = time.monotonic()
+                if state.in_flight >= max(int(state.limit), 1):
+                    await state.condition.wait()
+                elif now < state.next_start:
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(state.condition.wait(), state.next_start - now)
+                else:
+                    break
+            state.in_flight += 1
+            state.next_start = now + state.delay
+        try:
+            yield state
+        finally:
+            async with state.condition:
+                state.in_flight -= 1
+                state.condition.notify_all()
+
+    def record(self, host, latency, response=None):
+        """
+        Adapts the host's limits to the outcome of a request. A missing response means the request failed.
+        """
+        state = self.get_state(host)
+        status_code = response.status_code if response is not None else None
+        if response is None or status_code in self.BACKOFF_STATUS_CODES or latency > self.slow_latency:
+            state.limit = max(state.limit / 2, 1.)
+            state.delay = min(max(state.delay * 2, 1.), self.max_delay)
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            if retry_after and retry_after.strip().isdigit():
+                state.next_start = max(state.next_start, time.monotonic() + min(int(retry_after), self.max_delay))
+            logger.info('Backing off %s after %s in %.1fs: limit %.1f, delay %.1fs.', host, status_code or 'an error', latency, state.limit, state.delay)
+        else:
+            state.limit = min(state.limit + 1, self.max_concurrency)
+            state.delay = max(state.delay / 2, self.min_delay)
+
+
+class FeedFetch:
+    """
+    A prepared request for a single feed URL and, once performed, its response or the error raised while fetching it.
+    """
+
+    def __init__(self, source_feed, url, headers, proxies=None, proxy=None, page=None, page_key=None): # pylint: disable=too-many-positional-arguments
+        self.source_feed = source_feed
+        self.url = url
+        self.headers = headers
+        self.proxies = proxies or {}
+        self.proxy = proxy
+        self.page = page
+        self.page_key = page_key
+        self.response = None
+        self.error = None
+        # The FeedParse of the response's body, when it's parsed in a worker process.
+        self.parsed = None
+
+    def __repr__(self):
+        return f'<FeedFetch {self.url}>'
+
+    def perform(self, session_pool=None):
+        logger.info("Fetching %s.", self.url)
+        try:
+            self.response = http_get(
+                self.url,
+                session_pool,
+                max_bytes=self.source_feed.max_body_size,
+                headers=self.headers,
+                allow_redirects=False,
+                timeout=20,
+                proxies=self.proxies,
+            )
+        except Exception as exc:
+            self.error = exc
+        return self
+
+
+async def _fetch_all(fetches, concurrency, session_pool, scheduler):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='feeds-fetch') as executor:
+
+        async def _fetch(fetch):
+            host = get_host(fetch.url)
+            # Wait for the host before taking a global slot, so requests queued behind a busy host don't hold up other hosts.
+            async with scheduler.slot(host):
+                async with semaphore:
+                    start = time.monotonic()
+                    await loop.run_in_executor(executor, fetch.perform, session_pool)
+                    scheduler.record(host, time.monotonic() - start, fetch.response)
+
+        await asyncio.gather(*(_fetch(fetch) for fetch in fetches))
+
+
+def fetch_feeds(fetches, concurrency=None, session_pool=None, scheduler=None):
+    """
+    Performs all the given FeedFetch requests, running at most `concurrency` of them at once, through `session_pool` if given.
+
+    Per-host limits are enforced by `scheduler`, or by a fresh HostScheduler.
+
+    Blocks until every request has either a response or an error.
+    """
+    fetches = list(fetches)
+    if not fetches:
+        return fetches
+    concurrency = max(int(concurrency or settings.FEEDS_FETCH_CONCURRENCY), 1)
+    logger.info("Fetching %d feeds with a concurrency of %d.", len(fetches), concurrency)
+    asyncio.run(_fetch_all(fetches, concurrency, session_pool, scheduler or HostScheduler()))
+    return fetches
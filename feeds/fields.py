@@ -0,0 +1,155 @@
+"""
+Custom model fields.
+"""
+import functools
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+
+from . import settings as _settings # pylint: disable=unused-import
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The first byte of every stored value names the codec it was written with, so values written under different settings can be read side by side.
+RAW = 0
+ZLIB = 1
+ZSTD = 2
+ZSTD_DICT = 3
+
+
+def get_codec():
+    """
+    Returns the codec new values are compressed with, per FEEDS_BODY_COMPRESSION.
+    """
+    codec = settings.FEEDS_BODY_COMPRESSION
+    if codec == 'auto':
+        codec = 'zstd' if zstandard else 'zlib'
+    if codec == 'zstd' and not zstandard:
+        raise ImproperlyConfigured('FEEDS_BODY_COMPRESSION is "zstd" but the zstandard package is not installed.')
+    if codec not in ('zstd', 'zlib', None):
+        raise ImproperlyConfigured(f'Unknown FEEDS_BODY_COMPRESSION: {codec!r}')
+    return codec
+
+
+@functools.lru_cache(maxsize=None)
+def load_zstd_dictionary(path):
+    with open(path, 'rb') as fin:
+        return zstandard.ZstdCompressionDict(fin.read())
+
+
+def get_zstd_dictionary():
+    """
+    Returns the shared dictionary named by FEEDS_BODY_COMPRESSION_DICTIONARY, if any.
+    """
+    path = settings.FEEDS_BODY_COMPRESSION_DICTIONARY
+    if not path:
+        return None
+    return load_zstd_dictionary(path)
+
+
+def get_zstd_dictionaries():
+    """
+    Returns the dictionaries stored values may have been compressed with, FEEDS_BODY_COMPRESSION_DICTIONARY and those in
+    FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES, by their IDs.
+    """
+    paths = [settings.FEEDS_BODY_COMPRESSION_DICTIONARY] + list(settings.FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES or [])
+    dictionaries = {}
+    for path in filter(None, paths):
+        dictionary = load_zstd_dictionary(path)
+        dictionaries.setdefault(dictionary.dict_id(), dictionary)
+    return dictionaries
+
+
+def get_value_zstd_dictionary(data):
+    """
+    Returns the dictionary a zstd frame was compressed with, found by the dictionary ID in its header.
+
+    Frames compressed with a dictionary that has no ID, i.e. one that wasn't trained, are read with FEEDS_BODY_COMPRESSION_DICTIONARY.
+    """
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    if not dict_id:
+        dictionary = get_zstd_dictionary()
+        if dictionary is None:
+            raise ImproperlyConfigured('Reading text compressed with a dictionary requires FEEDS_BODY_COMPRESSION_DICTIONARY.')
+        return dictionary
+    dictionary = get_zstd_dictionaries().get(dict_id)
+    if dictionary is None:
+        raise ImproperlyConfigured(
+            f'Reading text compressed with zstd dictionary {dict_id} requires it to be FEEDS_BODY_COMPRESSION_DICTIONARY or listed in '
+            'FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES.'
+        )
+    return dictionary
+
+
+def compress_text(text):
+    """
+    Encodes and compresses a string, prefixed with the byte naming its codec.
+
+    Values too short to be worth compressing, or that don't get any smaller, are stored as plain UTF-8.
+    """
+    data = text.encode('utf-8')
+    codec = get_codec()
+    if codec is None or len(data) < settings.FEEDS_BODY_COMPRESSION_MIN_LENGTH:
+        return bytes([RAW]) + data
+    level = settings.FEEDS_BODY_COMPRESSION_LEVEL
+    if codec == 'zstd':
+        dictionary = get_zstd_dictionary()
+        kwargs = {'level': level} if level is not None else {}
+        # The dictionary's ID is written in the frame, so the value can still be read after the dictionary is replaced.
+        compressor = zstandard.ZstdCompressor(dict_data=dictionary, write_dict_id=True, **kwargs)
+        compressed = bytes([ZSTD_DICT if dictionary else ZSTD]) + compressor.compress(data)
+    else:
+        compressed = bytes([ZLIB]) + zlib.compress(data, -1 if level is None else level)
+    if len(compressed) > len(data):
+        return bytes([RAW]) + data
+    return compressed
+
+
+def decompress_text(value):
+    """
+    Reverses compress_text().
+    """
+    value = bytes(value)
+    if not value:
+        return ''
+    codec, data = value[0], value[1:]
+    if codec == RAW:
+        return data.decode('utf-8')
+    if codec == ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if codec in (ZSTD, ZSTD_DICT):
+        if not zstandard:
+            raise ImproperlyConfigured('Reading zstd-compressed text requires the zstandard package.')
+        dictionary = get_value_zstd_dictionary(data) if codec == ZSTD_DICT else None
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data).decode('utf-8')
+    raise ValueError(f'Unknown compression codec: {codec}')
+
+
+class CompressedTextField(models.TextField):
+    """
+    A text field stored compressed in a binary column.
+
+    Values are compressed when written and decompressed when read, so in Python the field behaves like any other TextField. Only exact
+    lookups make sense against the stored bytes.
+    """
+
+    description = 'Compressed text'
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None:
+            return None
+        return connection.Database.Binary(compress_text(value))
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decompress_text(value)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from feeds.archive import archive_posts
+from feeds.models import Source
+
+
+class Command(BaseCommand):
+    help = 'Moves posts outside their retention policy to archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', default='', help='Comma-separated list of source IDs to archive. Defaults to all sources.')
+        parser.add_argument('--archive-dir', default=None, help='Directory to write archives to. Defaults to FEEDS_ARCHIVE_DIR.')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Number of posts archived per transaction. Defaults to FEEDS_ARCHIVE_CHUNK_SIZE.')
+
+    def handle(self, *args, **options):
+
+        sources = Source.objects.all()
+        source_ids = [int(_) for _ in options['sources'].split(',') if _.isdigit()]
+        if source_ids:
+            sources = sources.filter(id__in=source_ids)
+
+        total = archive_posts(sources, archive_dir=options['archive_dir'], chunk_size=options['chunk_size'], output=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} posts.'))
@@ -0,0 +1,74 @@
+import json
+import os
+import time
+
+import feedparser
+
+from django.core.management.base import BaseCommand, CommandError
+
+from feeds.sanitizer import SanitizerEngine, configure_feedparser, get_available_backends
+from feeds.utils import get_xml_entry_body
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'testdata')
+
+
+def read_bodies(path):
+    """
+    Returns the entry bodies of an XML or JSON feed file, as they are before sanitize_html().
+    """
+    with open(path, 'rb') as fin:
+        content = fin.read()
+    if path.endswith('.json'):
+        items = json.loads(content).get('items', [])
+        return [item.get('content_html') or item.get('content_text') or '' for item in items]
+    if path.endswith(('.xml', '.rss')):
+        configure_feedparser()
+        return [get_xml_entry_body(e) for e in feedparser.parse(content).entries]
+    return []
+
+
+class Command(BaseCommand):
+    help = 'Compares the speed of the sanitizer backends on the entries of the test feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Feed files to read entries from. Defaults to those in feeds/testdata.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times each body is sanitized.')
+        parser.add_argument('--backends', default='', help='Comma-separated list of backends to compare. Defaults to all those installed.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [os.path.join(TESTDATA_DIR, name) for name in sorted(os.listdir(TESTDATA_DIR))]
+        bodies = [body for path in paths for body in read_bodies(path)]
+        if not bodies:
+            raise CommandError('No entries found.')
+        backends = [_ for _ in options['backends'].split(',') if _] or get_available_backends()
+        repeat = max(options['repeat'], 1)
+
+        plain_text = SanitizerEngine(backend=backends[0], cache=None).backend.plain_text
+        plain = sum(1 for body in bodies if not body or plain_text.match(body))
+        self.stdout.write(f'{len(bodies)} entries, {sum(len(body) for body in bodies)} characters, {plain} without markup, sanitized {repeat} times.')
+        self.stdout.write(f"{'backend':10} {'backend only':>14} {'engine':>14} {'per entry':>12} {'differences':>12}")
+
+        reference = None
+        for name in backends:
+            # Uncached, so every entry is sanitized each time.
+            engine = SanitizerEngine(backend=name, cache=None)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for body in bodies:
+                    engine.clean(body)
+            backend_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for body in bodies:
+                    engine.sanitize(body)
+            engine_time = time.perf_counter() - start
+
+            outputs = [engine.sanitize(body) for body in bodies]
+            if reference is None:
+                reference = outputs
+            differences = sum(1 for output, expected in zip(outputs, reference) if output != expected)
+            self.stdout.write(
+                f'{name:10} {backend_time * 1000:12.1f}ms {engine_time * 1000:12.1f}ms {engine_time / (repeat * len(bodies)) * 1e6:10.1f}us {differences:12}'
+            )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from feeds.fields import zstandard
+from feeds.models import Post
+from feeds.utils import compress_post_bodies
+
+
+class Command(BaseCommand):
+    help = 'Moves uncompressed post bodies into compressed storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of posts to update per query.')
+        parser.add_argument('--recompress', action='store_true', default=False, help='Rewrite all bodies with the current compression settings.')
+        parser.add_argument(
+            '--train-dictionary',
+            default=None,
+            metavar='PATH',
+            help='Instead of compressing, train a zstd dictionary on a sample of bodies and write it to PATH, for use as FEEDS_BODY_COMPRESSION_DICTIONARY.'
+        )
+        parser.add_argument('--dictionary-size', type=int, default=112640, help='Size of the trained dictionary in bytes.')
+        parser.add_argument('--samples', type=int, default=10000, help='Number of recent bodies to train the dictionary on.')
+
+    def handle(self, *args, **options):
+
+        if options['train_dictionary']:
+            if not zstandard:
+                raise CommandError('Training a dictionary requires the zstandard package.')
+            samples = [p.body.encode('utf-8') for p in Post.objects.with_body().order_by('-pk')[:options['samples']] if p.body]
+            dictionary = zstandard.train_dictionary(options['dictionary_size'], samples)
+            with open(options['train_dictionary'], 'wb') as fout:
+                fout.write(dictionary.as_bytes())
+            self.stdout.write(
+                self.style.SUCCESS(f"Trained dictionary {dictionary.dict_id()} on {len(samples)} bodies and wrote it to {options['train_dictionary']}.")
+            )
+            self.stdout.write(
+                'To replace a dictionary, add its path to FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES until compressbodies --recompress has run.'
+            )
+            return
+
+        total = compress_post_bodies(chunk_size=options['chunk_size'], recompress=options['recompress'], output=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {total} posts.'))
@@ -20,4 +20,5 @@ class Command(BaseCommand):
         with open(feed_path, 'r', encoding='utf-8') as fin:
             feed_body = fin.read()
             import_feed(source, feed_body=feed_body, content_type="xml", output=self.stdout)
+        source.save()
         self.stdout.write(self.style.SUCCESS('Finished'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from feeds.utils import propagate_index_targets
+
+
+class Command(BaseCommand):
+    help = "Copies changed source index targets to the sources' posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-chunks', type=int, default=None, help='Stop after updating this many chunks of posts. Defaults to no limit.')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Number of posts to update per query. Defaults to FEEDS_INDEX_PROPAGATION_CHUNK_SIZE.')
+
+    def handle(self, *args, **options):
+
+        total = propagate_index_targets(max_chunks=options['max_chunks'], chunk_size=options['chunk_size'], output=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {total} posts.'))
@@ -9,8 +9,12 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--sources', default='')
-        parser.add_argument('--force', default=False, action='store_true', help='If given, overrides any last-checked timestamps and forces a refresh.')
+        parser.add_argument(
+            '--force', default=False, action='store_true', help='If given, overrides any last-checked timestamps and forces a refresh of every entry.'
+        )
         parser.add_argument('--only-stalled', default=False, action='store_true', help='If given, only refreshes stalled and disables those that are bad.')
+        parser.add_argument('--concurrency', type=int, default=None, help='Maximum number of feeds to download at once. Defaults to FEEDS_FETCH_CONCURRENCY.')
+        parser.add_argument('--parse-workers', type=int, default=None, help='Number of processes to parse feeds in. Defaults to FEEDS_PARSE_WORKERS.')
 
     def handle(self, *args, **options):
 
@@ -19,6 +23,14 @@ class Command(BaseCommand):
         if source_ids:
             sources = Source.objects.filter(id__in=source_ids)
 
-        update_feeds(30, self.stdout, sources=sources, force=options['force'], only_stalled=options['only_stalled'])
+        update_feeds(
+            30,
+            self.stdout,
+            sources=sources,
+            force=options['force'],
+            only_stalled=options['only_stalled'],
+            concurrency=options['concurrency'],
+            parse_workers=options['parse_workers'],
+        )
 
         self.stdout.write(self.style.SUCCESS('Finished'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from feeds.archive import restore_archive
+
+
+class Command(BaseCommand):
+    help = 'Restores posts from archive files written by archiveposts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Archive files to restore.')
+
+    def handle(self, *args, **options):
+
+        total = 0
+        for path in options['paths']:
+            total += restore_archive(path, output=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Restored {total} posts.'))
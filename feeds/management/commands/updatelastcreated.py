@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, OuterRef, Subquery
+
+from feeds.models import Post, Source
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the cached date of the most recent post of each source'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', default='', help='Comma-separated list of source IDs to update. Defaults to all sources.')
+
+    def handle(self, *args, **options):
+
+        sources = Source.objects.all()
+        source_ids = [int(_) for _ in options['sources'].split(',') if _.isdigit()]
+        if source_ids:
+            sources = sources.filter(id__in=source_ids)
+
+        newest = Post.objects.filter(source=OuterRef('pk')).order_by().values('source').annotate(newest=Max('created')).values('newest')
+        count = sources.update(last_created=Subquery(newest))
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {count} sources.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from feeds.utils import rebuild_source_stats
+from feeds.models import Source
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the post statistics of each source'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', default='', help='Comma-separated list of source IDs to update. Defaults to all sources.')
+
+    def handle(self, *args, **options):
+
+        sources = Source.objects.all()
+        source_ids = [int(_) for _ in options['sources'].split(',') if _.isdigit()]
+        if source_ids:
+            sources = sources.filter(id__in=source_ids)
+
+        count = rebuild_source_stats(sources)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {count} sources.'))
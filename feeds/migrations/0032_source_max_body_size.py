@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0031_post_created_on_post_updated_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='max_body_size',
+            field=models.PositiveIntegerField(blank=True, help_text='Largest feed, in bytes, that will be downloaded. Defaults to the FEEDS_MAX_BODY_SIZE setting.', null=True),
+        ),
+    ]
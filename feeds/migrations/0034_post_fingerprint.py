@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0033_source_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, help_text='Digest of the feed entry the post was last imported from.', max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0034_post_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexTargetPropagation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.BooleanField(help_text='The index target being copied to the posts.')),
+                ('last_post_id', models.PositiveBigIntegerField(default=0, help_text='Primary key of the last post updated.')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('source', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='index_target_propagation', to='feeds.source')),
+            ],
+        ),
+    ]
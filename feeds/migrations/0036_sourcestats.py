@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:45
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+
+def populate_source_stats(apps, schema_editor):
+    Post = apps.get_model('feeds', 'Post')
+    Source = apps.get_model('feeds', 'Source')
+    SourceStats = apps.get_model('feeds', 'SourceStats')
+    cutoff = timezone.now() - timedelta(days=30)
+    aggregates = {
+        row['source']: row
+        for row in Post.objects.order_by().values('source').annotate(
+            post_count=Count('pk'),
+            newest_created=Max('created'),
+            oldest_created=Min('created'),
+            recent_post_count=Count('pk', filter=Q(created__gte=cutoff)),
+        )
+    }
+    stats = []
+    for source_id in Source.objects.values_list('pk', flat=True):
+        row = aggregates.get(source_id, {})
+        stats.append(
+            SourceStats(
+                source_id=source_id,
+                post_count=row.get('post_count', 0),
+                newest_created=row.get('newest_created'),
+                oldest_created=row.get('oldest_created'),
+                recent_post_count=row.get('recent_post_count', 0),
+            )
+        )
+    SourceStats.objects.bulk_create(stats, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0035_indextargetpropagation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceStats',
+            fields=[
+                (
+                    'source',
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='feeds.source'
+                    )
+                ),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('newest_created', models.DateTimeField(blank=True, db_index=True, help_text='Created date of the newest post.', null=True)),
+                ('oldest_created', models.DateTimeField(blank=True, help_text='Created date of the oldest post.', null=True)),
+                ('recent_post_count', models.PositiveIntegerField(default=0, help_text='Number of posts created in the last FEEDS_STATS_RECENT_DAYS days.')),
+                ('updated', models.DateTimeField(auto_now=True, help_text='When the stats were last changed. The recent post count is as of then.')),
+            ],
+            options={
+                'verbose_name_plural': 'source stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['source', 'created'], name='feeds_post_source__098d6a_idx'),
+        ),
+        migrations.RunPython(populate_source_stats, reverse_code=migrations.RunPython.noop),
+    ]
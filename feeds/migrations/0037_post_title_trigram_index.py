@@ -0,0 +1,42 @@
+import logging
+
+from django.db import DatabaseError, migrations
+
+logger = logging.getLogger(__name__)
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Indexes post titles for the admin's case-insensitive substring search, which Django runs as UPPER(title::text) LIKE UPPER(...).
+
+    Only PostgreSQL supports trigram indexes, and creating the pg_trgm extension needs privileges the database user may not have, in which case
+    the index is skipped.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError as exc:
+        logger.warning('Unable to create the pg_trgm extension, so post titles will not be trigram indexed: %s', exc)
+        return
+    schema_editor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS feeds_post_title_trgm ON feeds_post USING gin (UPPER(title::text) gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS feeds_post_title_trgm')
+
+
+class Migration(migrations.Migration):
+
+    # Building the index concurrently, so as not to block writes to a large table, can't be done in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('feeds', '0036_sourcestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, reverse_code=drop_trigram_index),
+    ]
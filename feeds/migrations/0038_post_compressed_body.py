@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+import feeds.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0037_post_title_trigram_index'),
+    ]
+
+    operations = [
+        # Keep existing bodies where they are, in the "body" column, under a new field name. They're moved to the compressed column by
+        # the compressbodies command, or whenever a post is next saved.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AlterField(
+                    model_name='post',
+                    name='body',
+                    field=models.TextField(null=True),
+                ),
+            ],
+            state_operations=[
+                migrations.RenameField(
+                    model_name='post',
+                    old_name='body',
+                    new_name='legacy_body',
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='legacy_body',
+                    field=models.TextField(blank=True, db_column='body', editable=False, help_text='Uncompressed body of posts saved before bodies were compressed.', null=True),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='body',
+            field=feeds.fields.CompressedTextField(db_column='body_data', null=True),
+        ),
+    ]
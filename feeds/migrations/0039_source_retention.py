@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0038_post_compressed_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Created date of the newest archived post. Older entries are not imported again.', null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='retention_max_age_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Archive posts older than this many days. Blank uses FEEDS_RETENTION_MAX_AGE_DAYS. 0 keeps all posts.', null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='retention_max_posts',
+            field=models.PositiveIntegerField(blank=True, help_text='Archive all but this many of the newest posts. Blank uses FEEDS_RETENTION_MAX_POSTS. 0 keeps all posts.', null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:57
+
+import hashlib
+import uuid
+
+from django.db import migrations, models
+
+
+def populate_guid_hashes(apps, schema_editor):
+    Post = apps.get_model('feeds', 'Post')
+    last_id = 0
+    while True:
+        posts = list(Post.objects.filter(pk__gt=last_id, guid__isnull=False).order_by('pk').only('pk', 'source_id', 'guid')[:1000])
+        if not posts:
+            break
+        for post in posts:
+            post.guid_hash = uuid.UUID(bytes=hashlib.blake2b(f'{post.source_id}:{post.guid}'.encode('utf-8'), digest_size=16).digest())
+        Post.objects.bulk_update(posts, ['guid_hash'])
+        last_id = posts[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0039_source_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='guid_hash',
+            field=models.UUIDField(blank=True, editable=False, help_text='Digest of the source and GUID, which posts are looked up by.', null=True),
+        ),
+        migrations.RunPython(populate_guid_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='post',
+            constraint=models.UniqueConstraint(fields=('guid_hash',), name='unique_post_guid_hash'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='post',
+            name='unique_source_guid',
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='guid',
+            field=models.CharField(blank=True, max_length=2000, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:59
+
+import hashlib
+import uuid
+
+from django.db import migrations, models
+
+
+def populate_slug_hashes(apps, schema_editor):
+    Post = apps.get_model('feeds', 'Post')
+    last_id = 0
+    while True:
+        posts = list(Post.objects.filter(pk__gt=last_id, slug__isnull=False).order_by('pk').only('pk', 'source_id', 'slug')[:1000])
+        if not posts:
+            break
+        for post in posts:
+            post.slug_hash = uuid.UUID(bytes=hashlib.blake2b(f'{post.source_id}:{post.slug}'.encode('utf-8'), digest_size=16, person=b'slug').digest())
+        Post.objects.bulk_update(posts, ['slug_hash'])
+        last_id = posts[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0040_post_guid_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='slug_hash',
+            field=models.UUIDField(blank=True, editable=False, help_text='Digest of the source and slug, which must be unique.', null=True),
+        ),
+        migrations.RunPython(populate_slug_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='post',
+            constraint=models.UniqueConstraint(fields=('slug_hash',), name='unique_post_slug_hash'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='post',
+            name='unique_source_slug',
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(blank=True, db_index=False, max_length=2000, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0041_post_slug_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='xml_parser',
+            field=models.CharField(
+                blank=True,
+                choices=[('fast', 'Fast'), ('feedparser', 'feedparser')],
+                help_text='The parser that last read the feed. Feeds that needed feedparser keep using it until this is cleared.',
+                max_length=20,
+                null=True
+            ),
+        ),
+    ]
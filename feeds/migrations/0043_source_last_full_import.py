@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0042_source_xml_parser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='last_full_import',
+            field=models.DateTimeField(
+                blank=True, editable=False, help_text='When every entry of the feed was last imported, rather than only the newest.', null=True
+            ),
+        ),
+    ]
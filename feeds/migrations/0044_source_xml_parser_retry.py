@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0043_source_last_full_import'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='source',
+            name='xml_parser',
+            field=models.CharField(blank=True, choices=[('fast', 'Fast'), ('feedparser', 'feedparser')], help_text='The parser that last read the feed. Feeds that needed feedparser keep using it until their next full import.', max_length=20, null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import logging
 import uuid
 import re
@@ -8,17 +9,46 @@ from django.core.exceptions import ValidationError
 from django.conf import settings
 #from django.contrib.postgres.indexes import GinIndex
 from django.db import models
-from django.db.models import Max
 from django.utils.text import slugify
 from django.utils import timezone
 
 from . import settings as _settings # pylint: disable=unused-import
+from .fields import CompressedTextField
 
 logger = logging.getLogger(__name__)
 
 utc = datetime.timezone.utc
 
 
+def get_guid_hash(source_id, guid):
+    """
+    Returns the fixed-width digest posts are looked up by, in place of their source and full GUID.
+    """
+    if guid is None:
+        return None
+    return uuid.UUID(bytes=hashlib.blake2b(f'{source_id}:{guid}'.encode('utf-8'), digest_size=16).digest())
+
+
+def get_slug_hash(source_id, slug):
+    """
+    Returns the fixed-width digest the uniqueness of post slugs within a source is enforced on.
+    """
+    if slug is None:
+        return None
+    return uuid.UUID(bytes=hashlib.blake2b(f'{source_id}:{slug}'.encode('utf-8'), digest_size=16, person=b'slug').digest())
+
+
+def get_slug_candidate(slug, attempt):
+    """
+    Returns the slug to try for a post on the given attempt: the slug itself first, then the slug suffixed with "-2", "-3" and so on, truncated to
+    leave room for the suffix.
+    """
+    if attempt == 1:
+        return slug
+    suffix = f'-{attempt}'
+    return slug[:settings.FEEDS_POST_SLUG_MAXLENGTH - len(suffix)] + suffix
+
+
 def validate_regex(value):
     try:
         re.compile(value)
@@ -26,13 +56,69 @@ def validate_regex(value):
         raise ValidationError(f"Invalid regular expression: {exc}") from exc
 
 
+class DirtyFieldsMixin:
+    """
+    Remembers the field values an instance was loaded with, so that changed fields can be found without reading the row again.
+
+    Saving an instance loaded from the database only writes the fields that changed, and skips the query altogether when none did. Changes
+    made behind the instance's back, e.g. by QuerySet.update(), aren't seen until it's refreshed.
+    """
+
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.take_snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.take_snapshot(fields)
+
+    def take_snapshot(self, fields=None):
+        """
+        Records the current values of the given fields, or of all loaded fields, as the stored ones.
+        """
+        if self._loaded_values is None:
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if fields is not None and field.name not in fields and field.attname not in fields:
+                continue
+            # Deferred fields are missing from the instance's dict until they're loaded.
+            if field.attname in self.__dict__:
+                self._loaded_values[field.attname] = getattr(self, field.attname)
+
+    def get_dirty_fields(self):
+        """
+        Returns the set of field attnames changed since the instance was loaded or last saved.
+        """
+        loaded = self._loaded_values or {}
+        dirty = set()
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if field.attname not in loaded or loaded[field.attname] != getattr(self, field.attname):
+                dirty.add(field.attname)
+        return dirty
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and self._loaded_values is not None and not args and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+        self.take_snapshot()
+
+
 class SourceManager(models.Manager):
 
     def get_by_natural_key(self, slug):
         return self.get(slug=slug)
 
 
-class Source(models.Model):
+class Source(DirtyFieldsMixin, models.Model):
 
     objects = SourceManager()
 
@@ -52,6 +138,7 @@ class Source(models.Model):
     last_modified = models.CharField(max_length=255, blank=True, null=True) # just pass this back and forward between server and me , no need to parse
 
     last_result = models.CharField(max_length=255, blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, editable=False, help_text='SHA-256 digest of the last feed body imported.')
     interval = models.PositiveIntegerField(default=400)
     last_success = models.DateTimeField(null=True, default=timezone.make_aware(datetime.datetime(1900, 1, 1)))
     last_change = models.DateTimeField(null=True, default=timezone.make_aware(datetime.datetime(1900, 1, 1)))
@@ -69,6 +156,28 @@ class Source(models.Model):
 
     last_created = models.DateTimeField(blank=True, null=True, editable=False, help_text='Datetime of most recent post.')
 
+    retention_max_posts = models.PositiveIntegerField(
+        blank=True, null=True, help_text='Archive all but this many of the newest posts. Blank uses FEEDS_RETENTION_MAX_POSTS. 0 keeps all posts.'
+    )
+    retention_max_age_days = models.PositiveIntegerField(
+        blank=True, null=True, help_text='Archive posts older than this many days. Blank uses FEEDS_RETENTION_MAX_AGE_DAYS. 0 keeps all posts.'
+    )
+    archived_until = models.DateTimeField(
+        blank=True, null=True, editable=False, help_text='Created date of the newest archived post. Older entries are not imported again.'
+    )
+
+    xml_parser = models.CharField(
+        max_length=20,
+        blank=True,
+        null=True,
+        choices=[('fast', 'Fast'), ('feedparser', 'feedparser')],
+        help_text='The parser that last read the feed. Feeds that needed feedparser keep using it until their next full import.'
+    )
+
+    last_full_import = models.DateTimeField(
+        blank=True, null=True, editable=False, help_text='When every entry of the feed was last imported, rather than only the newest.'
+    )
+
     uuid = models.UUIDField(
         default=uuid.uuid4,
         editable=False,
@@ -113,6 +222,12 @@ class Source(models.Model):
 
     archive_to_s3 = models.BooleanField(default=False, help_text='If set, uploads all post media files to the pre-configured S3 bucket.')
 
+    max_body_size = models.PositiveIntegerField(
+        blank=True, null=True, help_text='Largest feed, in bytes, that will be downloaded. Defaults to the FEEDS_MAX_BODY_SIZE setting.'
+    )
+
+    _pending_stats = None
+
     class Meta:
         indexes = [
             models.Index(fields=['lucene_index_target', 'lucene_index_actual']),
@@ -182,31 +297,191 @@ class Source(models.Model):
         return css
 
     def save(self, *args, **kwargs):
-        old = None
-        if self.pk:
-            old = type(self).objects.get(pk=self.pk)
         if not self.slug:
             self.slug = slugify((self.name or '').strip())
+        target_changed = not self._state.adding and 'lucene_index_target' in self.get_dirty_fields()
         super().save(*args, **kwargs)
 
-        # Propagate index target to this source's posts.
-        if old and old.lucene_index_target != self.lucene_index_target:
-            self.posts.update(lucene_index_target=self.lucene_index_target)
+        # Queue the index target for propagation to this source's posts. Large sources have too many posts to update while saving, so the
+        # posts are updated in chunks by propagate_index_targets().
+        if target_changed:
+            IndexTargetPropagation.objects.update_or_create(source=self, defaults={'target': self.lucene_index_target, 'last_post_id': 0})
+
+    def note_post_created(self, created, new=False):
+        """
+        Records the created date of a post being imported, and whether the post is new.
+
+        Advances last_created if the date is newer, to be written when the source is next saved, and collects the changes to the source's
+        stats that import_feed() applies once the feed is imported.
+
+        Only ever moves forwards, so it can run ahead of the posts if one is later backdated or deleted. The updatelastcreated and
+        updatesourcestats commands recompute everything from scratch.
+        """
+        if not created:
+            return
+        if self.last_created is None or created > self.last_created:
+            self.last_created = created
+        if self._pending_stats is None:
+            self._pending_stats = {'new_posts': 0, 'newest_created': created, 'oldest_created': created}
+        self._pending_stats['new_posts'] += int(new)
+        self._pending_stats['newest_created'] = max(self._pending_stats['newest_created'], created)
+        self._pending_stats['oldest_created'] = min(self._pending_stats['oldest_created'], created)
+
+    def pop_pending_stats(self):
+        """
+        Returns the stats changes collected by note_post_created() since the last call, if any, and forgets them.
+        """
+        pending, self._pending_stats = self._pending_stats, None
+        return pending
+
+    def get_retention(self):
+        """
+        Returns the maximum number of posts and the maximum age in days of posts kept for this source. None means no limit.
+        """
+        max_posts = self.retention_max_posts if self.retention_max_posts is not None else settings.FEEDS_RETENTION_MAX_POSTS
+        max_age_days = self.retention_max_age_days if self.retention_max_age_days is not None else settings.FEEDS_RETENTION_MAX_AGE_DAYS
+        return max_posts or None, max_age_days or None
+
+    def needs_full_import(self, now=None):
+        """
+        Returns true if the next import should read every entry of the feed, rather than stop at the already imported ones.
+        """
+        if not settings.FEEDS_INCREMENTAL_KNOWN_ENTRIES or not self.last_full_import:
+            return True
+        return self.last_full_import <= (now or timezone.now()) - datetime.timedelta(hours=settings.FEEDS_FULL_IMPORT_INTERVAL_HOURS)
+
+    def is_archived(self, created):
+        """
+        Returns true if a post created at this date would already have been archived, so shouldn't be imported again.
+        """
+        return bool(self.archived_until and created and created <= self.archived_until)
+
+
+class SourceStats(models.Model):
+    """
+    Statistics about a source's posts, kept up to date as feeds are imported so that they can be read without scanning the posts.
+    """
 
-        agg = self.posts.all().aggregate(Max('created'))
-        if agg:
-            self.last_created = agg['created__max']
-            type(self).objects.filter(id=self.id).update(last_created=self.last_created)
+    source = models.OneToOneField(Source, on_delete=models.CASCADE, primary_key=True, related_name='stats')
 
+    post_count = models.PositiveIntegerField(default=0)
 
-class PostManager(models.Manager):
+    newest_created = models.DateTimeField(blank=True, null=True, db_index=True, help_text='Created date of the newest post.')
+
+    oldest_created = models.DateTimeField(blank=True, null=True, help_text='Created date of the oldest post.')
+
+    recent_post_count = models.PositiveIntegerField(default=0, help_text='Number of posts created in the last FEEDS_STATS_RECENT_DAYS days.')
+
+    updated = models.DateTimeField(auto_now=True, help_text='When the stats were last changed. The recent post count is as of then.')
+
+    class Meta:
+        verbose_name_plural = 'source stats'
+
+    def __str__(self):
+        return f"{self.source}: {self.post_count} posts"
 
-    def get_by_natural_key(self, guid, *args):
-        source = Source.objects.get_by_natural_key(*args)
-        return self.get(guid=guid, source=source)
 
+class IndexTargetPropagation(models.Model):
+    """
+    Progress of copying a source's lucene_index_target to its posts.
+
+    Posts are updated in order of primary key, so the last one updated is all that's needed to resume. The record is deleted once every post
+    has been updated.
+    """
+
+    source = models.OneToOneField(Source, on_delete=models.CASCADE, related_name='index_target_propagation')
+
+    target = models.BooleanField(help_text='The index target being copied to the posts.')
+
+    last_post_id = models.PositiveBigIntegerField(default=0, help_text='Primary key of the last post updated.')
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.source}: index target {self.target} from post {self.last_post_id}"
 
-class Post(models.Model):
+
+class PostQuerySet(models.QuerySet):
+
+    def with_body(self):
+        """
+        Loads the body along with the rest of each post, for callers about to read it, rather than with a query per post on first access.
+        """
+        return self.defer(None)
+
+    def for_guid(self, source, guid):
+        """
+        Filters on a post's GUID through its indexed digest. The full GUID is compared too, to rule out a hash collision.
+        """
+        return self.filter(guid_hash=get_guid_hash(source.pk, guid), guid=guid)
+
+    def for_guids(self, source, guids):
+        """
+        Filters on any of the given GUIDs of a source, through their indexed digests. Callers should check the GUID of each post returned.
+        """
+        return self.filter(guid_hash__in=[get_guid_hash(source.pk, guid) for guid in guids])
+
+
+class PostManager(models.Manager.from_queryset(PostQuerySet)):
+
+    def get_queryset(self):
+        # The body is by far the largest column, and most queries, e.g. listings, imports and related lookups, never read it.
+        return super().get_queryset().defer('body', 'legacy_body')
+
+    def get_by_natural_key(self, guid, *args):
+        source = Source.objects.get_by_natural_key(*args)
+        return self.for_guid(source, guid).get()
+
+    def allocate_slugs(self, source, posts, max_attempts=10):
+        """
+        Gives each of the given new posts of a source a slug no other post of the source has, suffixing "-2", "-3" and so on to slugs that are
+        taken. Posts earlier in the list get the lower suffixes, so the same entries always end up with the same slugs.
+
+        Fills in the posts' other save defaults first. Checks all posts still in conflict with one query per attempt. A post still in conflict
+        after `max_attempts` is suffixed with part of its GUID's digest instead.
+        """
+        for p in posts:
+            p.apply_save_defaults()
+        bases = {id(p): p.slug for p in posts}
+        pending = list(posts)
+        claimed = set()
+        attempt = 1
+        while pending and attempt <= max_attempts:
+            candidates = {id(p): get_slug_candidate(bases[id(p)], attempt) for p in pending}
+            hashes = {get_slug_hash(source.pk, slug) for slug in candidates.values()}
+            taken = set()
+            for i in range(0, len(hashes), 500):
+                taken.update(self.filter(slug_hash__in=list(hashes)[i:i + 500]).values_list('slug_hash', flat=True))
+            conflicts = []
+            for p in pending:
+                slug = candidates[id(p)]
+                slug_hash = get_slug_hash(source.pk, slug)
+                if slug_hash in taken or slug_hash in claimed:
+                    conflicts.append(p)
+                    continue
+                p.slug, p.slug_hash = slug, slug_hash
+                claimed.add(slug_hash)
+            pending = conflicts
+            attempt += 1
+        for p in pending:
+            suffix = '-' + get_guid_hash(source.pk, p.guid or p.title or '').hex[:12]
+            p.slug = bases[id(p)][:settings.FEEDS_POST_SLUG_MAXLENGTH - len(suffix)] + suffix
+            p.slug_hash = get_slug_hash(source.pk, p.slug)
+            logger.warning('Gave post %s the slug %s after %d conflicting attempts.', p.guid, p.slug, max_attempts)
+
+    def load_bodies(self, posts):
+        """
+        Loads the deferred bodies of the given posts in one query per batch.
+        """
+        pending = {p.pk: p for p in posts if 'body' in p.get_deferred_fields()}
+        pks = list(pending)
+        for i in range(0, len(pks), 500):
+            for pk, body, legacy_body in self.model._base_manager.filter(pk__in=pks[i:i + 500]).values_list('pk', 'body', 'legacy_body'):
+                pending[pk].body = legacy_body if body is None else body
+                pending[pk].take_snapshot(['body'])
+
+
+class Post(DirtyFieldsMixin, models.Model):
 
     # an entry in a feed
 
@@ -214,18 +489,24 @@ class Post(models.Model):
 
     source = models.ForeignKey(Source, on_delete=models.CASCADE, related_name='posts')
     title = models.TextField(blank=True)
-    slug = models.SlugField(max_length=2000, blank=True, null=True) # Note, may be limited due to OS filename.
-    body = models.TextField()
+    slug = models.SlugField(max_length=2000, blank=True, null=True, db_index=False) # Note, may be limited due to OS filename.
+    slug_hash = models.UUIDField(blank=True, null=True, editable=False, help_text='Digest of the source and slug, which must be unique.')
+    body = CompressedTextField(null=True, db_column='body_data')
+    legacy_body = models.TextField(
+        blank=True, null=True, editable=False, db_column='body', help_text='Uncompressed body of posts saved before bodies were compressed.'
+    )
     has_bad_body_escaping = models.BooleanField(null=True, db_index=True, default=None)
     link = models.CharField(max_length=2000, blank=True, null=True)
     found = models.DateTimeField(auto_now_add=True)
     created = models.DateTimeField(db_index=True, auto_now_add=True)
     created_on = models.DateTimeField(blank=True, null=True, editable=False)
     updated_on = models.DateTimeField(blank=True, null=True, editable=False)
-    guid = models.CharField(max_length=2000, blank=True, null=True, db_index=True)
+    guid = models.CharField(max_length=2000, blank=True, null=True)
+    guid_hash = models.UUIDField(blank=True, null=True, editable=False, help_text='Digest of the source and GUID, which posts are looked up by.')
     author = models.CharField(max_length=2000, blank=True, null=True)
     index = models.IntegerField(db_index=True)
     image_url = models.CharField(max_length=2000, blank=True, null=True)
+    fingerprint = models.CharField(max_length=32, blank=True, null=True, editable=False, help_text='Digest of the feed entry the post was last imported from.')
 
     subtitle_href = models.URLField(max_length=1000, blank=True, null=True)
     subtitle_lang = models.CharField(max_length=50, blank=True, null=True)
@@ -247,12 +528,13 @@ class Post(models.Model):
     class Meta:
         ordering = ["index"]
         constraints = [
-            models.UniqueConstraint(fields=['source', 'slug'], name='unique_source_slug'),
-            models.UniqueConstraint(fields=['source', 'guid'], name='unique_source_guid'),
+            models.UniqueConstraint(fields=['slug_hash'], name='unique_post_slug_hash'),
+            models.UniqueConstraint(fields=['guid_hash'], name='unique_post_guid_hash'),
         ]
         indexes = [
             models.Index(fields=['lucene_index_target', 'lucene_index_actual']),
             models.Index(fields=['created']),
+            models.Index(fields=['source', 'created']),
             # GinIndex(fields=['body']),
         ]
 
@@ -277,11 +559,28 @@ class Post(models.Model):
     def recast_link(self):
         return "/post/%d/" % self.id
 
-    def save(self, *args, **kwargs):
-        old = None
-        if self.pk:
-            old = type(self).objects.get(pk=self.pk)
-
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.fall_back_to_legacy_body()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is not None and 'body' in fields and 'legacy_body' not in fields:
+            fields = [*fields, 'legacy_body']
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.fall_back_to_legacy_body()
+
+    def fall_back_to_legacy_body(self):
+        # Posts not yet converted by the compressbodies command still have their body in the old, uncompressed column.
+        if 'body' in self.__dict__ and self.body is None and self.__dict__.get('legacy_body') is not None:
+            self.body = self.legacy_body
+            self.take_snapshot(['body'])
+
+    def apply_save_defaults(self):
+        """
+        Fills in the fields save() maintains itself. Called directly for posts written with bulk_create() or bulk_update(), which bypass save().
+        """
         now = timezone.now()
         if not self.pk and self.created_on is None:
             self.created_on = now
@@ -290,12 +589,25 @@ class Post(models.Model):
         # Inherit index target from source.
         if not self.pk:
             self.lucene_index_target = self.source.lucene_index_target
-        elif old and old.body != self.body and self.has_bad_body_escaping == old.has_bad_body_escaping:
-            self.has_bad_body_escaping = None
+        else:
+            dirty = self.get_dirty_fields()
+            if 'body' in dirty and 'has_bad_body_escaping' not in dirty:
+                self.has_bad_body_escaping = None
+            if 'body' in dirty:
+                # The body is now stored compressed, so drop any old uncompressed copy.
+                self.legacy_body = None
+
+        self.guid_hash = get_guid_hash(self.source_id, self.guid)
 
         if not self.slug:
             self.slug = slugify((self.title or '').strip())
         self.slug = self.slug[:settings.FEEDS_POST_SLUG_MAXLENGTH]
+        self.slug_hash = get_slug_hash(self.source_id, self.slug)
+
+    def save(self, *args, **kwargs):
+        # Leave updated_on alone when there's nothing else to write.
+        if self._state.adding or self.get_dirty_fields():
+            self.apply_save_defaults()
         super().save(*args, **kwargs)
 
 
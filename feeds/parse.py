@@ -0,0 +1,99 @@
+"""
+Parse stage for polling feeds.
+
+Parsing a feed and sanitizing its entries is CPU bound and holds the GIL, so when a polling run is given more than one parse worker, the feeds
+it downloaded are parsed in a pool of processes while the calling process imports those already parsed. A worker is sent the response body
+and the field values of its source, and sends back plain entry records and the source fields parsing changed. It never touches the database:
+the posts are looked up and written by `feeds.utils.read_feed` in the calling process, as they are without a pool.
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+
+from . import settings as _settings # pylint: disable=unused-import
+from .models import Source
+
+logger = logging.getLogger(__name__)
+
+NOT_SET = object()
+
+
+def run_parse(func, source_values, *args):
+    """
+    Calls `func` with a copy of a source built from its field values and the given arguments, in a worker process.
+
+    Returns the value returned and the source fields the call changed.
+    """
+    source_feed = Source(**source_values)
+    source_feed.take_snapshot()
+    value = func(source_feed, *args)
+    return value, {name: getattr(source_feed, name) for name in source_feed.get_dirty_fields()}
+
+
+class FeedParse:
+    """
+    A feed body being parsed by a worker process, for a source.
+
+    Only the fields the parse changed are copied back, so it mustn't set any the calling process changes while waiting for it.
+    """
+
+    def __init__(self, future):
+        self.future = future
+
+    def get(self, source_feed, default=NOT_SET):
+        """
+        Waits for the parse to finish, copies the fields it changed onto the source and returns its result.
+
+        If the parse failed, e.g. because it raised or its worker died, the error is logged and `default` is returned if it's given, so the
+        caller can parse the feed itself. Otherwise the error is raised again here.
+        """
+        try:
+            value, changes = self.future.result()
+        except Exception: # pylint: disable=broad-exception-caught
+            if default is NOT_SET:
+                raise
+            logger.exception('Parsing the feed of source %s in a worker failed.', source_feed)
+            return default
+        for name, change in changes.items():
+            setattr(source_feed, name, change)
+        return value
+
+
+class ParsePool:
+    """
+    A pool of up to `workers` processes feeds are parsed in. With one worker or fewer, there's no pool and submit() returns None, leaving the
+    feeds to be parsed in the calling process.
+
+    Workers are started fresh rather than forked, so they don't share the calling process's database connections, and set Django up before
+    anything else is sent to them.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = int(workers if workers is not None else settings.FEEDS_PARSE_WORKERS)
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, func, source_feed, *args):
+        """
+        Starts calling `func(source_feed, *args)` in a worker, and returns the FeedParse for its result.
+        """
+        if self.workers <= 1:
+            return None
+        if self._executor is None:
+            logger.info('Starting %d parse workers.', self.workers)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        source_values = {field.attname: getattr(source_feed, field.attname) for field in Source._meta.concrete_fields}
+        return FeedParse(self._executor.submit(run_parse, func, source_values, *args))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
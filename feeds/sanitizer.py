@@ -0,0 +1,353 @@
+"""
+Sanitizing of the HTML in feed entries.
+
+Entry bodies are sanitized by a SanitizerEngine, built once per process from the settings around one of the BACKENDS. Text without any markup
+is returned as is, and everything else is cleaned by the backend.
+
+Feed entries rarely change between polls, but their HTML used to be sanitized again every time they were read. Sanitized HTML is cached
+under a digest of the raw HTML and of everything else the result depends on, such as the allowed tags and attributes: first in a bounded
+in-process LRU, and, if FEEDS_SANITIZE_CACHE_ALIAS names one of the project's caches, in that cache too, so it's shared between processes
+and survives between runs.
+"""
+import functools
+import hashlib
+import html
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+import bleach
+import feedparser
+from feedparser.sanitizer import _HTMLSanitizer
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import settings as _settings # pylint: disable=unused-import
+
+try:
+    import nh3
+except ImportError:
+    nh3 = None
+
+logger = logging.getLogger(__name__)
+
+# Attributes feedparser's sanitizer allows that we don't.
+FEEDPARSER_REMOVED_ATTRIBUTES = ["align", "valign", "hspace"]
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    # Named functions, such as a bleach attribute filter, are keyed by their dotted path, which is the same in every process. Lambdas and
+    # nested functions have no unique path.
+    qualname = getattr(value, '__qualname__', None)
+    if callable(value) and qualname and '<' not in qualname:
+        return f'{value.__module__}.{qualname}'
+    raise TypeError(f'{value!r} has no stable cache key')
+
+
+def _local_json_default(value):
+    try:
+        return _json_default(value)
+    except TypeError:
+        return repr(value)
+
+
+class SanitizeCache:
+    """
+    Sanitized HTML, by a digest of the raw HTML and the configuration it was sanitized with.
+
+    The in-process LRU holds at most `max_size` results and `max_chars` characters of them, so a few huge bodies can't fill memory. Results
+    longer than `max_chars` are only kept in the persistent cache.
+
+    Counts the lookups answered by the in-process LRU (`hits`), by the persistent cache (`persistent_hits`) and by neither (`misses`).
+    """
+
+    key_prefix = 'feeds:sanitize:'
+
+    def __init__(self, max_size=None, cache_alias=None, timeout=None, max_chars=None):
+        self._max_size = max_size
+        self._max_chars = max_chars
+        self._cache_alias = cache_alias
+        self._timeout = timeout
+        self._lru = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return settings.FEEDS_SANITIZE_CACHE_SIZE if self._max_size is None else self._max_size
+
+    @property
+    def max_chars(self):
+        return settings.FEEDS_SANITIZE_CACHE_MAX_CHARS if self._max_chars is None else self._max_chars
+
+    @property
+    def persistent_cache(self):
+        alias = self._cache_alias or settings.FEEDS_SANITIZE_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def get_key(self, parts, local=False):
+        """
+        Returns the digest `parts` are cached under, or None if they hold something that can't be keyed the same way in every process.
+
+        With `local`, anything else is keyed by its repr(), which only identifies it within this process.
+        """
+        try:
+            data = json.dumps(parts, sort_keys=True, default=_local_json_default if local else _json_default)
+        except TypeError:
+            return None
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+    def sanitize(self, parts, func, persistent=True):
+        """
+        Returns the cached result for `parts`, or calls `func` and caches what it returns.
+
+        `parts` must hold the raw HTML and everything else the result depends on, and be serializable as JSON, with sets and named functions
+        allowed. Anything else is keyed by its repr(), so pass `persistent=False` to keep its results out of the persistent cache.
+        """
+        persistent_cache = self.persistent_cache if persistent else None
+        if not self.max_size and not persistent_cache:
+            with self._lock:
+                self.misses += 1
+            return func()
+
+        key = self.get_key(parts, local=True)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+
+        value = None
+        if persistent_cache is not None:
+            value = persistent_cache.get(self.key_prefix + key)
+        if value is None:
+            value = func()
+            with self._lock:
+                self.misses += 1
+            if persistent_cache is not None:
+                persistent_cache.set(self.key_prefix + key, value, settings.FEEDS_SANITIZE_CACHE_TIMEOUT if self._timeout is None else self._timeout)
+        else:
+            with self._lock:
+                self.persistent_hits += 1
+
+        if self.max_size and len(value) <= self.max_chars:
+            with self._lock:
+                if key in self._lru:
+                    self._chars -= len(self._lru[key])
+                self._lru[key] = value
+                self._chars += len(value)
+                while len(self._lru) > self.max_size or self._chars > self.max_chars:
+                    _key, evicted = self._lru.popitem(last=False)
+                    self._chars -= len(evicted)
+        return value
+
+    def stats(self):
+        """
+        Returns the lookup counts, and the number of results in the in-process LRU and their total length.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'persistent_hits': self.persistent_hits, 'misses': self.misses, 'size': len(self._lru), 'chars': self._chars}
+
+    def clear(self):
+        """
+        Empties the in-process LRU and resets the counts. The persistent cache is left alone.
+        """
+        with self._lock:
+            self._lru.clear()
+            self._chars = 0
+            self.hits = self.persistent_hits = self.misses = 0
+
+
+# Shared by everything sanitized in the process.
+sanitize_cache = SanitizeCache()
+
+
+def get_feedparser_config():
+    """
+    Returns a digest of the configuration of feedparser's sanitizer, as changed by configure_feedparser().
+    """
+    return sanitize_cache.get_key(['feedparser', feedparser.__version__, _HTMLSanitizer.acceptable_elements, _HTMLSanitizer.acceptable_attributes])
+
+
+@functools.lru_cache(maxsize=None)
+def configure_feedparser():
+    """
+    Removes the attributes we don't allow from feedparser's sanitizer, once per process, and returns get_feedparser_config().
+    """
+    for name in FEEDPARSER_REMOVED_ATTRIBUTES:
+        _HTMLSanitizer.acceptable_attributes.discard(name)
+    return get_feedparser_config()
+
+
+def unescape_double_escaped_html(html_content):
+    """
+    Detect and fix double-escaped HTML tags.
+
+    Some feeds send content with tags already escaped like '&lt;p&gt;' instead of '<p>'.
+    This function detects common escaped tag patterns and unescapes them.
+    """
+    if not html_content:
+        return html_content
+
+    # Check for common escaped tag patterns (opening AND closing tags)
+    escaped_patterns = [
+        '&lt;p', '&lt;a ', '&lt;br', '&lt;div', '&lt;span', '&lt;img', '&lt;em', '&lt;strong', '&lt;b&gt;', '&lt;i&gt;', '&lt;ul', '&lt;ol', '&lt;li',
+        '&lt;blockquote', '&lt;/'
+    ]
+
+    needs_unescape = any(pattern in html_content for pattern in escaped_patterns)
+
+    if needs_unescape:
+        logger.debug('Detected double-escaped HTML, unescaping')
+        return html.unescape(html_content)
+
+    return html_content
+
+
+class SanitizerBackend:
+    """
+    Cleans HTML down to a set of allowed tags and attributes.
+
+    Backends build whatever they need once, when they're created, and are then reused for every document.
+    """
+
+    name = None
+    version = None
+    # Text that clean() returns unchanged, so that doesn't need cleaning at all.
+    plain_text = None
+
+    def __init__(self, tags, attributes):
+        self.tags = tags
+        self.attributes = attributes
+
+    def clean(self, html_content):
+        raise NotImplementedError
+
+
+class BleachBackend(SanitizerBackend):
+    """
+    Sanitizes with bleach. Tags that aren't allowed are escaped.
+    """
+
+    name = 'bleach'
+    version = bleach.__version__
+    # html5lib turns carriage returns into newlines, drops NULs and replaces other control characters.
+    plain_text = re.compile(r'[^<>&\r\x00-\x08\x0b-\x1f\ud800-\udfff]*\Z')
+
+    def __init__(self, tags, attributes):
+        super().__init__(tags, attributes)
+        # Cleaners aren't thread-safe, so each thread gets its own.
+        self._local = threading.local()
+
+    def clean(self, html_content):
+        cleaner = getattr(self._local, 'cleaner', None)
+        if cleaner is None:
+            cleaner = self._local.cleaner = bleach.sanitizer.Cleaner(tags=self.tags, attributes=self.attributes)
+        return cleaner.clean(html_content)
+
+
+class Nh3Backend(SanitizerBackend):
+    """
+    Sanitizes with nh3, the Python binding of the Rust ammonia library, if it's installed. Much faster than bleach, but tags that aren't
+    allowed are removed rather than escaped, so the output isn't the same.
+    """
+
+    name = 'nh3'
+    version = getattr(nh3, '__version__', None)
+    # Non-breaking spaces are written as &nbsp;.
+    plain_text = re.compile(r'[^<>&\r\x00-\x08\x0b-\x1f\xa0\ud800-\udfff]*\Z')
+
+    def __init__(self, tags, attributes):
+        super().__init__(tags, attributes)
+        if nh3 is None:
+            raise ImproperlyConfigured('FEEDS_SANITIZER_BACKEND is "nh3" but the nh3 package is not installed.')
+        if not isinstance(attributes, dict):
+            raise ImproperlyConfigured('The nh3 sanitizer backend needs FEEDS_ALLOWED_ATTRIBUTES to be a dict of attribute names by tag.')
+        self.cleaner = nh3.Cleaner(
+            tags=set(tags),
+            attributes={
+                tag: set(names)
+                for tag, names in attributes.items()
+            },
+            link_rel=None,
+            url_schemes=set(bleach.sanitizer.ALLOWED_PROTOCOLS),
+        )
+
+    def clean(self, html_content):
+        return self.cleaner.clean(html_content)
+
+
+BACKENDS = {backend.name: backend for backend in (BleachBackend, Nh3Backend)}
+
+
+def get_available_backends():
+    """
+    Returns the names of the backends that can be used here.
+    """
+    return [name for name in BACKENDS if name != 'nh3' or nh3 is not None]
+
+
+class SanitizerEngine:
+    """
+    Sanitizes the HTML of entries to the allowed tags and attributes, with a backend built once and reused.
+
+    Text without markup is returned as is, without involving the backend or the cache.
+    """
+
+    def __init__(self, backend=None, tags=None, attributes=None, cache=sanitize_cache):
+        backend = backend or settings.FEEDS_SANITIZER_BACKEND
+        if backend not in BACKENDS:
+            raise ImproperlyConfigured(f'Unknown FEEDS_SANITIZER_BACKEND: {backend!r}')
+        tags = settings.FEEDS_ALLOWED_TAGS if tags is None else tags
+        attributes = settings.FEEDS_ALLOWED_ATTRIBUTES if attributes is None else attributes
+        self.backend = BACKENDS[backend](tags, attributes)
+        self.cache = cache
+        parts = [self.backend.name, self.backend.version, tags, attributes]
+        self.cache_key = sanitize_cache.get_key(parts)
+        # Results sanitized with something like a lambda attribute filter can't be told apart from another process's, so they're only
+        # cached in this one.
+        self.persistent = self.cache_key is not None
+        if not self.persistent:
+            self.cache_key = sanitize_cache.get_key(parts, local=True)
+
+    def clean(self, html_content):
+        # Fix double-escaped HTML before sanitizing
+        return self.backend.clean(unescape_double_escaped_html(html_content))
+
+    def sanitize(self, html_content):
+        if not html_content or self.backend.plain_text.match(html_content):
+            return html_content
+        if self.cache is None:
+            return self.clean(html_content)
+        return self.cache.sanitize([self.cache_key, html_content], lambda: self.clean(html_content), persistent=self.persistent)
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    Returns the process's SanitizerEngine, building it from the settings the first time.
+    """
+    global _engine
+    if _engine is None:
+        _engine = SanitizerEngine()
+    return _engine
+
+
+@receiver(setting_changed)
+def reset_engine(setting, **kwargs):
+    global _engine
+    if setting in ('FEEDS_SANITIZER_BACKEND', 'FEEDS_ALLOWED_TAGS', 'FEEDS_ALLOWED_ATTRIBUTES'):
+        _engine = None
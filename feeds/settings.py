@@ -22,3 +22,110 @@ default_allowed_attributes = {
 }
 
 FEEDS_ALLOWED_ATTRIBUTES = settings.FEEDS_ALLOWED_ATTRIBUTES = getattr(settings, 'FEEDS_ALLOWED_ATTRIBUTES', default_allowed_attributes)
+
+# Library entry bodies are sanitized with: "bleach", or "nh3" if the nh3 package is installed.
+FEEDS_SANITIZER_BACKEND = settings.FEEDS_SANITIZER_BACKEND = getattr(settings, 'FEEDS_SANITIZER_BACKEND', 'bleach')
+
+# Maximum number of feed requests update_feeds() will have in flight at once.
+FEEDS_FETCH_CONCURRENCY = settings.FEEDS_FETCH_CONCURRENCY = getattr(settings, 'FEEDS_FETCH_CONCURRENCY', 10)
+
+# Connection pooling for feed requests. Each host gets its own session holding up to FEEDS_HTTP_POOL_MAXSIZE kept-alive connections.
+FEEDS_HTTP_POOL_CONNECTIONS = settings.FEEDS_HTTP_POOL_CONNECTIONS = getattr(settings, 'FEEDS_HTTP_POOL_CONNECTIONS', 4)
+
+FEEDS_HTTP_POOL_MAXSIZE = settings.FEEDS_HTTP_POOL_MAXSIZE = getattr(settings, 'FEEDS_HTTP_POOL_MAXSIZE', 10)
+
+FEEDS_HTTP_KEEP_ALIVE = settings.FEEDS_HTTP_KEEP_ALIVE = getattr(settings, 'FEEDS_HTTP_KEEP_ALIVE', True)
+
+# Per-host politeness for concurrent fetches. Each host starts out allowed FEEDS_HOST_CONCURRENCY requests in flight, started at least
+# FEEDS_HOST_MIN_DELAY seconds apart. The limit grows towards FEEDS_HOST_MAX_CONCURRENCY while the host responds well, and is halved, with the
+# delay doubled up to FEEDS_HOST_MAX_DELAY, on a 429 or 503, a failed request, or a response slower than FEEDS_HOST_SLOW_LATENCY seconds.
+FEEDS_HOST_CONCURRENCY = settings.FEEDS_HOST_CONCURRENCY = getattr(settings, 'FEEDS_HOST_CONCURRENCY', 2)
+
+FEEDS_HOST_MAX_CONCURRENCY = settings.FEEDS_HOST_MAX_CONCURRENCY = getattr(settings, 'FEEDS_HOST_MAX_CONCURRENCY', 4)
+
+FEEDS_HOST_MIN_DELAY = settings.FEEDS_HOST_MIN_DELAY = getattr(settings, 'FEEDS_HOST_MIN_DELAY', 0.5)
+
+FEEDS_HOST_MAX_DELAY = settings.FEEDS_HOST_MAX_DELAY = getattr(settings, 'FEEDS_HOST_MAX_DELAY', 30)
+
+FEEDS_HOST_SLOW_LATENCY = settings.FEEDS_HOST_SLOW_LATENCY = getattr(settings, 'FEEDS_HOST_SLOW_LATENCY', 10)
+
+# Limits on downloading a feed. Bodies are streamed in FEEDS_DOWNLOAD_CHUNK_SIZE byte chunks, and a download fails once it grows past
+# FEEDS_MAX_BODY_SIZE bytes (overridable per source) or takes more than FEEDS_FETCH_DEADLINE seconds in total. Error pages are only read up to
+# FEEDS_SNIFF_BYTES, which is enough to recognise a Cloudflare block.
+FEEDS_MAX_BODY_SIZE = settings.FEEDS_MAX_BODY_SIZE = getattr(settings, 'FEEDS_MAX_BODY_SIZE', 50 * 1024 * 1024)
+
+FEEDS_FETCH_DEADLINE = settings.FEEDS_FETCH_DEADLINE = getattr(settings, 'FEEDS_FETCH_DEADLINE', 120)
+
+FEEDS_DOWNLOAD_CHUNK_SIZE = settings.FEEDS_DOWNLOAD_CHUNK_SIZE = getattr(settings, 'FEEDS_DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+
+FEEDS_SNIFF_BYTES = settings.FEEDS_SNIFF_BYTES = getattr(settings, 'FEEDS_SNIFF_BYTES', 64 * 1024)
+
+# Number of posts updated per query when propagating a source's lucene_index_target to its posts.
+FEEDS_INDEX_PROPAGATION_CHUNK_SIZE = settings.FEEDS_INDEX_PROPAGATION_CHUNK_SIZE = getattr(settings, 'FEEDS_INDEX_PROPAGATION_CHUNK_SIZE', 1000)
+
+# Maximum number of those chunks update_feeds() processes at the end of each run. Set to 0 to leave propagation to the propagateindextargets command.
+FEEDS_INDEX_PROPAGATION_CHUNKS_PER_RUN = settings.FEEDS_INDEX_PROPAGATION_CHUNKS_PER_RUN = getattr(settings, 'FEEDS_INDEX_PROPAGATION_CHUNKS_PER_RUN', 20)
+
+# Window, in days, of the recent post count kept in each source's stats.
+FEEDS_STATS_RECENT_DAYS = settings.FEEDS_STATS_RECENT_DAYS = getattr(settings, 'FEEDS_STATS_RECENT_DAYS', 30)
+
+# Admin change lists of tables estimated to hold more rows than this show the estimate instead of counting the rows. Lists paged by ID
+# that can't be estimated, e.g. filtered ones, are only counted up to this many rows.
+FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD = settings.FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD = getattr(settings, 'FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000)
+
+# Codec post bodies are compressed with: "zstd", "zlib", None to store them uncompressed, or "auto" for zstd if the zstandard package is
+# installed and zlib otherwise. Bodies already stored are read whatever codec they were written with.
+FEEDS_BODY_COMPRESSION = settings.FEEDS_BODY_COMPRESSION = getattr(settings, 'FEEDS_BODY_COMPRESSION', 'auto')
+
+# Compression level passed to the codec. None uses the codec's default.
+FEEDS_BODY_COMPRESSION_LEVEL = settings.FEEDS_BODY_COMPRESSION_LEVEL = getattr(settings, 'FEEDS_BODY_COMPRESSION_LEVEL', None)
+
+# Path to a zstd dictionary trained on existing bodies, e.g. with `manage.py compressbodies --train-dictionary`. Small bodies compress much
+# better with one. Must stay available for as long as bodies written with it are stored.
+FEEDS_BODY_COMPRESSION_DICTIONARY = settings.FEEDS_BODY_COMPRESSION_DICTIONARY = getattr(settings, 'FEEDS_BODY_COMPRESSION_DICTIONARY', None)
+
+# Paths to zstd dictionaries that used to be FEEDS_BODY_COMPRESSION_DICTIONARY, which bodies may still be compressed with. Bodies record the
+# ID of their dictionary, so each is read with the right one. Once `compressbodies --recompress` has rewritten every body with the current
+# dictionary, these can be removed.
+FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES = settings.FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES = getattr(
+    settings, 'FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES', []
+)
+
+# Bodies shorter than this many bytes are stored uncompressed.
+FEEDS_BODY_COMPRESSION_MIN_LENGTH = settings.FEEDS_BODY_COMPRESSION_MIN_LENGTH = getattr(settings, 'FEEDS_BODY_COMPRESSION_MIN_LENGTH', 64)
+
+# Default retention policy of sources that don't set their own. Older posts are moved to archive files by the archiveposts command.
+# Maximum number of each source's newest posts to keep. None keeps all.
+FEEDS_RETENTION_MAX_POSTS = settings.FEEDS_RETENTION_MAX_POSTS = getattr(settings, 'FEEDS_RETENTION_MAX_POSTS', None)
+
+# Maximum age in days of the posts to keep. None keeps all.
+FEEDS_RETENTION_MAX_AGE_DAYS = settings.FEEDS_RETENTION_MAX_AGE_DAYS = getattr(settings, 'FEEDS_RETENTION_MAX_AGE_DAYS', None)
+
+# Directory archived posts are written to, as gzipped JSON lines, one file per source per run.
+FEEDS_ARCHIVE_DIR = settings.FEEDS_ARCHIVE_DIR = getattr(settings, 'FEEDS_ARCHIVE_DIR', None)
+
+# Number of posts archived and deleted per transaction.
+FEEDS_ARCHIVE_CHUNK_SIZE = settings.FEEDS_ARCHIVE_CHUNK_SIZE = getattr(settings, 'FEEDS_ARCHIVE_CHUNK_SIZE', 500)
+
+# Parse well-formed UTF-8 RSS and Atom feeds with the streaming parser in feeds.xmlparser, and only fall back to feedparser for the rest.
+FEEDS_FAST_XML_PARSER = settings.FEEDS_FAST_XML_PARSER = getattr(settings, 'FEEDS_FAST_XML_PARSER', True)
+
+# Polls stop reading a feed's entries, newest first, after this many in a row that are already imported. 0 always reads every entry.
+FEEDS_INCREMENTAL_KNOWN_ENTRIES = settings.FEEDS_INCREMENTAL_KNOWN_ENTRIES = getattr(settings, 'FEEDS_INCREMENTAL_KNOWN_ENTRIES', 10)
+
+# Hours after which a source's next import reads all of its feed's entries again, picking up changes to older entries.
+FEEDS_FULL_IMPORT_INTERVAL_HOURS = settings.FEEDS_FULL_IMPORT_INTERVAL_HOURS = getattr(settings, 'FEEDS_FULL_IMPORT_INTERVAL_HOURS', 24)
+
+# Number of worker processes a polling run parses feeds in. 1 parses them in the polling process itself.
+FEEDS_PARSE_WORKERS = settings.FEEDS_PARSE_WORKERS = getattr(settings, 'FEEDS_PARSE_WORKERS', 1)
+
+# Number of sanitized HTML fragments kept in each process's in-memory cache. 0 turns it off.
+FEEDS_SANITIZE_CACHE_SIZE = settings.FEEDS_SANITIZE_CACHE_SIZE = getattr(settings, 'FEEDS_SANITIZE_CACHE_SIZE', 10000)
+
+# Total length, in characters, of the sanitized HTML kept in each process's in-memory cache. Longer fragments aren't kept in memory.
+FEEDS_SANITIZE_CACHE_MAX_CHARS = settings.FEEDS_SANITIZE_CACHE_MAX_CHARS = getattr(settings, 'FEEDS_SANITIZE_CACHE_MAX_CHARS', 20 * 1024 * 1024)
+
+# Name of a cache in CACHES that sanitized HTML is also kept in, shared between processes, and for how many seconds. None only uses memory.
+FEEDS_SANITIZE_CACHE_ALIAS = settings.FEEDS_SANITIZE_CACHE_ALIAS = getattr(settings, 'FEEDS_SANITIZE_CACHE_ALIAS', None)
+
+FEEDS_SANITIZE_CACHE_TIMEOUT = settings.FEEDS_SANITIZE_CACHE_TIMEOUT = getattr(settings, 'FEEDS_SANITIZE_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
@@ -1,11 +1,17 @@
 """
 Tests for feeds admin functionality.
 """
+from mock import patch
+
 from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 from feeds import models
-from feeds.admin import SourceAdmin, EnclosureAdmin, MediaContentAdmin
+from feeds.admin import SourceAdmin, EnclosureAdmin, MediaContentAdmin, PostAdmin
 
 
 class AdminImportTests(TestCase):
@@ -46,3 +52,103 @@ class AdminImportTests(TestCase):
         admin = MediaContentAdmin(models.MediaContent, site)
 
         self.assertTrue(admin.lookup_allowed('post__id', '123'))
+
+
+class ChangeListTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.source = models.Source.objects.create(name='test source', feed_url='http://example.com/feed', interval=0)
+        self.url = reverse('admin:feeds_post_changelist')
+
+    def _create_posts(self, count, start=0):
+        for i in range(start, start + count):
+            post = models.Post.objects.create(source=self.source, title=f'Post {i}', body='Body', guid=f'guid-{i}', index=i + 1)
+            models.Enclosure.objects.create(post=post, href=f'http://example.com/{i}.mp3', length=i, type='audio/mpeg')
+
+    def _get_titles(self, response):
+        return [str(post.title) for post in response.context['cl'].result_list]
+
+    @patch.object(PostAdmin, 'list_per_page', 2)
+    def test_keyset_pagination(self):
+        self._create_posts(5)
+
+        response = self.client.get(self.url)
+        self.assertEqual(self._get_titles(response), ['Post 4', 'Post 3'])
+        next_url = response.context['cl'].next_page_url
+        self.assertIn('cursor=', next_url)
+
+        response = self.client.get(self.url + next_url)
+        self.assertEqual(self._get_titles(response), ['Post 2', 'Post 1'])
+        response = self.client.get(self.url + response.context['cl'].next_page_url)
+        self.assertEqual(self._get_titles(response), ['Post 0'])
+        self.assertIsNone(response.context['cl'].next_page_url)
+
+        # Sorting by a column falls back to numbered pages.
+        response = self.client.get(self.url + '?o=1')
+        self.assertFalse(response.context['cl'].keyset)
+        self.assertEqual(self._get_titles(response), ['Post 0', 'Post 1'])
+
+    @patch.object(PostAdmin, 'list_per_page', 10)
+    def test_query_count_is_bounded(self):
+        self._create_posts(11)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        self._create_posts(30, start=11)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(self.url)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    @patch.object(PostAdmin, 'list_per_page', 2)
+    def test_estimated_count(self):
+        self._create_posts(3)
+        with patch('feeds.admin.get_estimated_count', return_value=20000000):
+            response = self.client.get(self.url)
+        self.assertTrue(response.context['cl'].paginator.estimated)
+        self.assertContains(response, '~20000000 posts')
+
+        # Filtered lists are counted.
+        response = self.client.get(self.url + '?q=Post')
+        self.assertFalse(response.context['cl'].paginator.estimated)
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    @patch.object(PostAdmin, 'list_per_page', 2)
+    def test_deep_pages_cost_the_same(self):
+        self._create_posts(20)
+
+        for query in ('', '?q=Post'):
+            with CaptureQueriesContext(connection) as first:
+                response = self.client.get(self.url + query)
+            cursor = models.Post.objects.get(guid='guid-2').pk
+            with CaptureQueriesContext(connection) as deep:
+                response = self.client.get(self.url + (query or '?') + f'&cursor={cursor}')
+            self.assertEqual(self._get_titles(response), ['Post 1', 'Post 0'])
+            self.assertEqual(len(first.captured_queries), len(deep.captured_queries))
+
+            post_queries = [q['sql'] for q in deep.captured_queries if 'FROM "feeds_post"' in q['sql']]
+            # The page and the count, which stops after FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD rows.
+            self.assertEqual(len(post_queries), 2)
+            self.assertFalse([sql for sql in post_queries if 'OFFSET' in sql or 'LIMIT' not in sql])
+
+        with self.settings(FEEDS_ADMIN_ESTIMATED_COUNT_THRESHOLD=5):
+            response = self.client.get(self.url + '?q=Post')
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertContains(response, '5+ posts')
+
+    def test_search_by_uuid(self):
+        self._create_posts(3)
+        post = models.Post.objects.get(guid='guid-1')
+
+        response = self.client.get(self.url, {'q': str(post.uuid)})
+
+        self.assertEqual(self._get_titles(response), ['Post 1'])
+
+    def test_change_form_uses_annotated_counts(self):
+        self._create_posts(1)
+        post = models.Post.objects.get()
+
+        response = self.client.get(reverse('admin:feeds_post_change', args=[post.pk]))
+
+        self.assertContains(response, '1 Enclosures')
+        self.assertContains(response, '0 Media Content')
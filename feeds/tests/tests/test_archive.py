@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from feeds.archive import archive_posts, get_expired_posts
+from feeds.models import Enclosure, MediaContent, Post, Source
+from feeds.utils import bulk_save_posts, parse_raw_html
+
+from .base import BaseTests
+
+
+class Tests(BaseTests):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        now = timezone.now()
+        for i in range(5):
+            post = Post.objects.create(source=self.source, title=f'Title {i}', body=f'Body {i}', guid=f'guid-{i}', index=i + 1)
+            Post.objects.filter(pk=post.pk).update(created=now - timedelta(days=10 - i))
+            Enclosure.objects.create(post=post, href=f'http://feed.com/{i}.mp3', length=i, type='audio/mpeg')
+            MediaContent.objects.create(post=post, url=f'http://feed.com/{i}.jpg', content_type='image/jpeg')
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def test_retention_policies(self):
+        self.assertIsNone(get_expired_posts(self.source))
+
+        with override_settings(FEEDS_RETENTION_MAX_POSTS=3):
+            self.assertEqual(sorted(get_expired_posts(self.source).values_list('guid', flat=True)), ['guid-0', 'guid-1'])
+
+            # Sources can override the global policy, or opt out of it.
+            self.source.retention_max_age_days = 8
+            self.source.retention_max_posts = 0
+            self.assertEqual(sorted(get_expired_posts(self.source).values_list('guid', flat=True)), ['guid-0', 'guid-1', 'guid-2'])
+            self.source.retention_max_age_days = 0
+            self.assertIsNone(get_expired_posts(self.source))
+
+    def test_archive_and_restore(self):
+        self.source.retention_max_posts = 2
+        self.source.save()
+        newest_archived = Post.objects.get(guid='guid-2').created
+
+        with override_settings(FEEDS_ARCHIVE_DIR=self.archive_dir):
+            self.assertEqual(archive_posts(chunk_size=2), 3)
+            self.assertEqual(archive_posts(chunk_size=2), 0)
+
+        self.assertEqual(sorted(Post.objects.values_list('guid', flat=True)), ['guid-3', 'guid-4'])
+        self.assertEqual(Enclosure.objects.count(), 2)
+        self.assertEqual(MediaContent.objects.count(), 2)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.stats.post_count, 2)
+        self.assertEqual(self.source.archived_until, newest_archived)
+
+        # Archived entries aren't imported again when they're still in the feed.
+        record = {'guid': 'guid-0', 'defaults': {'title': 'Title 0', 'created': self.source.archived_until}, 'updates': {'body': 'Body 0'}}
+        _saved, changed = bulk_save_posts(self.source, [record])
+        self.assertFalse(changed)
+        self.assertFalse(Post.objects.filter(guid='guid-0').exists())
+
+        path, = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(self.archive_dir) for name in names]
+        out = StringIO()
+        call_command('restoreposts', path, stdout=out)
+
+        self.assertIn('Restored 3 posts.', out.getvalue())
+        self.assertEqual(Post.objects.count(), 5)
+        post = Post.objects.get(guid='guid-0')
+        self.assertEqual(post.body, 'Body 0')
+        self.assertEqual(list(post.enclosures.values_list('href', flat=True)), ['http://feed.com/0.mp3'])
+        self.assertEqual(list(post.media_content.values_list('url', flat=True)), ['http://feed.com/0.jpg'])
+        self.source.stats.refresh_from_db()
+        self.assertEqual(self.source.stats.post_count, 5)
+
+        # Restoring twice doesn't duplicate anything.
+        call_command('restoreposts', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 5)
+
+    def test_archived_raw_html_items_are_not_imported_again(self):
+        self.source.html_item_class = 'div.episode'
+        self.source.html_item_title_class = 'h2'
+        self.source.html_item_link_class = 'a@href'
+        self.source.html_item_date_class = 'time'
+        self.source.archived_until = timezone.now() - timedelta(days=3)
+        self.source.save()
+        page = '''<html><body>
+<div class="episode"><h2>Old</h2><a href="http://feed.com/old.mp3">Listen</a><time>{old}</time></div>
+<div class="episode"><h2>New</h2><a href="http://feed.com/new.mp3">Listen</a><time>{new}</time></div>
+</body></html>'''.format(old=(timezone.now() - timedelta(days=5)).isoformat(), new=(timezone.now() - timedelta(days=1)).isoformat())
+
+        _ok, changed = parse_raw_html(self.source, page)
+
+        self.assertTrue(changed)
+        self.assertFalse(self.source.posts.filter(title='Old').exists())
+        self.assertEqual(self.source.posts.get(title='New').link, 'http://feed.com/new.mp3')
@@ -0,0 +1,334 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mock import Mock, patch
+import requests_mock
+
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from feeds.fetch import FeedFetch, FetchLimitExceeded, HostScheduler, SessionPool, download, fetch_feeds, http_get
+from feeds.models import Post, Source
+from feeds.parse import FeedParse, ParsePool
+from feeds.utils import import_feed, parse_raw_html, prepare_parse, read_feed, update_feeds
+
+from .base import BaseTests
+
+
+@requests_mock.Mocker()
+class Tests(BaseTests):
+
+    def test_update_feeds_fetches_concurrently(self, mock):
+        # Both requests must be in flight at the same time for either of them to get past the barrier.
+        barrier = threading.Barrier(2, timeout=5)
+        perform = FeedFetch.perform
+
+        def _perform(fetch, session_pool=None):
+            barrier.wait()
+            return perform(fetch, session_pool)
+
+        urls = ['http://feed1.com/', 'http://feed2.com/']
+        for i, url in enumerate(urls):
+            self._populate_mock(mock, status=200, test_file="rss_xhtml_body.xml", content_type="application/rss+xml", url=url)
+            Source.objects.create(name=f'test{i}', feed_url=url, interval=0)
+
+        with patch.object(FeedFetch, 'perform', _perform):
+            update_feeds(max_feeds=10, sources=Source.objects.all(), only_stalled=False, concurrency=2)
+
+        for src in Source.objects.all():
+            self.assertEqual(src.status_code, 200)
+            self.assertEqual(src.posts.count(), 1)
+
+    def test_update_feeds_parses_in_worker_processes(self, mock):
+        for name, test_file in (('local', 'podcast.xml'), ('pooled', 'podcast.xml'), ('pooled-rss', 'podcast_sample1.rss')):
+            url = f'http://{name}.com/'
+            self._populate_mock(mock, status=200, test_file=test_file, content_type="application/rss+xml", url=url)
+            Source.objects.create(name=name, feed_url=url, interval=0)
+
+        update_feeds(max_feeds=10, sources=Source.objects.filter(name='local'), only_stalled=False, parse_workers=1)
+        # Feeds are only parsed by the workers, which don't see the patch.
+        with patch('feeds.utils.parse_feed_document', side_effect=RuntimeError('parsed in process')):
+            update_feeds(max_feeds=10, sources=Source.objects.exclude(name='local'), only_stalled=False, parse_workers=2)
+
+        local = Source.objects.get(name='local')
+        pooled = Source.objects.get(name='pooled')
+        self.assertEqual((pooled.last_result, pooled.description, pooled.xml_parser), (local.last_result, local.description, local.xml_parser))
+        fields = ('guid', 'title', 'body', 'created', 'index', 'enclosures__href')
+        self.assertEqual(
+            list(local.posts.with_body().order_by('index').values_list(*fields)), list(pooled.posts.with_body().order_by('index').values_list(*fields))
+        )
+        self.assertTrue(Source.objects.get(name='pooled-rss').posts.exists())
+
+    def test_incremental_imports_read_the_same_entries_in_worker_processes(self, mock):
+        start = timezone.now().replace(microsecond=0) - timedelta(days=100)
+        items = [(f'guid-{i}', f'Episode {i}', start + timedelta(days=i)) for i in range(60)]
+
+        def _register(items):
+            entries = ''.join(
+                f'<item><title>{title}</title><description>{title}</description><guid>{guid}</guid>'
+                f'<pubDate>{date:%a, %d %b %Y %H:%M:%S} +0000</pubDate></item>' for guid, title, date in items[::-1]
+            )
+            content = f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Feed</title>{entries}</channel></rss>'
+            for name in ('local', 'pooled'):
+                mock.register_uri(
+                    'GET', f'http://{name}.com/', status_code=200, content=content.encode('utf-8'), headers={'Content-Type': 'application/rss+xml'}
+                )
+
+        _register(items)
+        for name in ('local', 'pooled'):
+            Source.objects.create(name=name, feed_url=f'http://{name}.com/', interval=0)
+        update_feeds(max_feeds=10, sources=Source.objects.all(), only_stalled=False, parse_workers=1)
+        # The newest entries' posts are backdated, so they're no longer among the most recently created.
+        Post.objects.filter(guid__in=[f'guid-{i}' for i in range(40, 60)]).update(created=start - timedelta(days=1000))
+
+        # A new entry, and an edit to an entry further down than the known entries an incremental import reads.
+        items[45] = ('guid-45', 'Episode 45 edited', items[45][2])
+        items.append(('guid-60', 'Episode 60', start + timedelta(days=60)))
+        _register(items)
+        update_feeds(max_feeds=10, sources=Source.objects.filter(name='local'), only_stalled=False, parse_workers=1)
+        update_feeds(max_feeds=10, sources=Source.objects.filter(name='pooled'), only_stalled=False, parse_workers=2)
+
+        local = Source.objects.get(name='local')
+        pooled = Source.objects.get(name='pooled')
+        self.assertEqual(local.posts.count(), 61)
+        self.assertEqual(Post.objects.with_body().get(source=local, guid='guid-45').body, 'Episode 45')
+        fields = ('guid', 'body', 'created', 'index')
+        self.assertEqual(
+            list(local.posts.with_body().order_by('guid').values_list(*fields)), list(pooled.posts.with_body().order_by('guid').values_list(*fields))
+        )
+
+    def test_feeds_are_not_prepared_for_parsing_without_a_pool(self, mock):
+        self._populate_mock(mock, status=200, test_file="podcast.xml", content_type="application/rss+xml")
+        src = Source.objects.create(name='test1', feed_url=self.BASE_URL, interval=0)
+        fetch, = fetch_feeds([FeedFetch(src, self.BASE_URL, headers={})])
+
+        with CaptureQueriesContext(connection) as queries, patch('feeds.utils.get_feed_type') as get_feed_type:
+            self.assertIsNone(prepare_parse(ParsePool(1), fetch))
+        self.assertEqual(queries.captured_queries, [])
+        get_feed_type.assert_not_called()
+
+    def test_failed_parse_workers_fall_back_to_parsing_in_process(self, mock):
+        future = Future()
+        future.set_exception(BrokenProcessPool('A worker died.'))
+        src = Source.objects.create(name='test1', feed_url=self.BASE_URL, interval=0)
+        with open(os.path.join(self.TEST_FILES_FOLDER, 'podcast.xml'), 'rb') as fin:
+            ok, changed = import_feed(src, fin.read(), 'application/rss+xml', parsed=FeedParse(future))
+        self.assertTrue(ok and changed)
+        self.assertTrue(src.posts.exists())
+
+        html_src = Source.objects.create(
+            name='test2',
+            feed_url=self.BASE_URL,
+            interval=0,
+            html_item_class='div.episode',
+            html_item_title_class='h2',
+            html_item_link_class='a@href',
+            html_item_date_class='time'
+        )
+        page = '<div class="episode"><h2>Episode</h2><a href="http://feed.com/1.mp3">Listen</a><time>2024-01-01T00:00:00Z</time></div>'
+        ok, changed = parse_raw_html(html_src, page, parsed=FeedParse(future))
+        self.assertTrue(ok and changed)
+        self.assertEqual(html_src.posts.get().title, 'Episode')
+
+        # Without a default, the error is raised.
+        with self.assertRaises(BrokenProcessPool):
+            FeedParse(future).get(src)
+
+    def test_fetch_feeds_records_errors(self, mock):
+        mock.register_uri('GET', self.BASE_URL, exc=ConnectionError('refused'))
+        src = Source.objects.create(name='test1', feed_url=self.BASE_URL, interval=0)
+
+        fetch, = fetch_feeds([FeedFetch(src, self.BASE_URL, headers={})])
+
+        self.assertIsNone(fetch.response)
+        self.assertIsInstance(fetch.error, ConnectionError)
+
+    def test_oversized_feed_is_rejected(self, mock):
+        self._populate_mock(mock, status=200, test_file="podcast.xml", content_type="application/rss+xml")
+        src = Source.objects.create(name='test1', feed_url=self.BASE_URL, interval=0, max_body_size=1024)
+
+        read_feed(src)
+
+        self.assertEqual(src.last_result, 'Feed is larger than the maximum size of 1024 bytes.')
+        self.assertEqual(src.posts.count(), 0)
+        self.assertEqual(src.interval, 120)
+
+    @override_settings(FEEDS_FETCH_DEADLINE=1e-9)
+    def test_slow_feed_is_abandoned(self, mock):
+        self._populate_mock(mock, status=200, test_file="podcast.xml", content_type="application/rss+xml")
+        src = Source.objects.create(name='test1', feed_url=self.BASE_URL, interval=0)
+
+        read_feed(src)
+
+        self.assertEqual(src.last_result, 'Feed took longer than 1e-09 seconds to download.')
+        self.assertEqual(src.posts.count(), 0)
+
+    @override_settings(FEEDS_SNIFF_BYTES=10)
+    def test_error_pages_are_truncated(self, mock):
+        self._populate_mock(mock, status=404, test_file="podcast.xml", content_type="application/rss+xml")
+
+        fetch, = fetch_feeds([FeedFetch(Source(feed_url=self.BASE_URL), self.BASE_URL, headers={})])
+
+        self.assertEqual(fetch.response.status_code, 404)
+        self.assertEqual(len(fetch.response.content), 10)
+
+
+class HostSchedulerTests(SimpleTestCase):
+
+    def test_limits_in_flight_requests_per_host(self):
+        scheduler = HostScheduler(concurrency=2, max_concurrency=2, min_delay=0)
+        in_flight = {'a.com': 0, 'b.com': 0}
+        peak = {'a.com': 0, 'b.com': 0}
+
+        async def _request(host):
+            async with scheduler.slot(host):
+                in_flight[host] += 1
+                peak[host] = max(peak[host], in_flight[host])
+                await asyncio.sleep(0.01)
+                in_flight[host] -= 1
+
+        async def _run():
+            await asyncio.gather(*(_request(host) for host in ['a.com', 'b.com'] * 5))
+
+        asyncio.run(_run())
+
+        self.assertEqual(peak, {'a.com': 2, 'b.com': 2})
+
+    def test_limits_adapt_to_host_responses(self):
+        scheduler = HostScheduler(concurrency=2, max_concurrency=4, min_delay=0.5, max_delay=30, slow_latency=10)
+        state = scheduler.get_state('a.com')
+
+        scheduler.record('a.com', 0.1, Mock(status_code=200, headers={}))
+        scheduler.record('a.com', 0.1, Mock(status_code=200, headers={}))
+        scheduler.record('a.com', 0.1, Mock(status_code=200, headers={}))
+        self.assertEqual(state.limit, 4)
+        self.assertEqual(state.delay, 0.5)
+
+        scheduler.record('a.com', 0.1, Mock(status_code=429, headers={}))
+        self.assertEqual(state.limit, 2)
+        self.assertEqual(state.delay, 1)
+
+        scheduler.record('a.com', 20, Mock(status_code=200, headers={}))
+        self.assertEqual(state.limit, 1)
+        self.assertEqual(state.delay, 2)
+
+        scheduler.record('a.com', 0.1, None)
+        self.assertEqual(state.limit, 1)
+        self.assertEqual(state.delay, 4)
+
+        scheduler.record('a.com', 0.1, Mock(status_code=503, headers={'Retry-After': '120'}))
+        self.assertEqual(state.delay, 8)
+        self.assertGreater(state.next_start - time.monotonic(), 25)
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        body = b'<rss></rss>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class _TrickleHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        body = b'<rss></rss>' * 100
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(len(body)):
+            try:
+                self.wfile.write(body[i:i + 1])
+                self.wfile.flush()
+            except OSError:
+                return
+            time.sleep(0.05)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class DownloadTests(SimpleTestCase):
+
+    @override_settings(FEEDS_FETCH_DEADLINE=0.5)
+    def test_deadline_interrupts_a_trickling_server(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _TrickleHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            start = time.monotonic()
+            with self.assertRaisesRegex(FetchLimitExceeded, 'longer than 0.5 seconds'):
+                # Every byte arrives well within the socket timeout, and the whole body fits in a single chunk.
+                http_get(f'http://127.0.0.1:{server.server_address[1]}/', timeout=5)
+            self.assertLess(time.monotonic() - start, 3)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @override_settings(FEEDS_FETCH_DEADLINE=0.2)
+    def test_deadline_interrupts_a_slow_iterator(self):
+        closed = threading.Event()
+
+        def _iter_content(chunk_size):
+            yield b'<rss>'
+            # Blocked inside a chunk until the response is closed.
+            if not closed.wait(5):
+                yield b'</rss>'
+            raise ConnectionError('closed')
+
+        response = Mock(status_code=200, headers={}, raw=None, iter_content=_iter_content)
+        response.close.side_effect = closed.set
+        start = time.monotonic()
+        with self.assertRaises(FetchLimitExceeded):
+            download(response, 1024, deadline=time.monotonic() + 0.2)
+        self.assertLess(time.monotonic() - start, 3)
+
+
+class SessionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused_per_host(self):
+        with SessionPool() as pool:
+            self.assertIs(pool.get_session(self.url + 'a'), pool.get_session(self.url + 'b'))
+            self.assertIsNot(pool.get_session(self.url), pool.get_session('http://localhost/'))
+
+            for i in range(3):
+                self.assertEqual(pool.get(f'{self.url}{i}', timeout=5).status_code, 200)
+
+            stats = pool.stats()
+        self.assertEqual(stats['requests'], 7)
+        self.assertEqual(stats['hosts'], 2)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 2)
+
+    def test_keep_alive_can_be_disabled(self):
+        with SessionPool(keep_alive=False) as pool:
+            response = pool.get(self.url, timeout=5)
+        self.assertEqual(response.request.headers['Connection'], 'close')
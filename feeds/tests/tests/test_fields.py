@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+
+from feeds.fields import RAW, ZLIB, ZSTD, ZSTD_DICT, compress_text, decompress_text, zstandard
+from feeds.models import Post, Source
+
+from .base import BaseTests
+
+BODY = '<p>The quick brown fox jumps over the lazy dog.</p>\n' * 40
+
+
+class CompressionTests(SimpleTestCase):
+
+    @override_settings(FEEDS_BODY_COMPRESSION='zlib')
+    def test_zlib_round_trip(self):
+        value = compress_text(BODY)
+        self.assertEqual(value[0], ZLIB)
+        self.assertLess(len(value), len(BODY) / 5)
+        self.assertEqual(decompress_text(value), BODY)
+
+    @override_settings(FEEDS_BODY_COMPRESSION='zlib', FEEDS_BODY_COMPRESSION_MIN_LENGTH=64)
+    def test_short_values_are_stored_raw(self):
+        value = compress_text('Short body')
+        self.assertEqual(value, bytes([RAW]) + b'Short body')
+        self.assertEqual(decompress_text(value), 'Short body')
+
+    @override_settings(FEEDS_BODY_COMPRESSION=None)
+    def test_compression_can_be_disabled(self):
+        self.assertEqual(compress_text(BODY)[0], RAW)
+        self.assertEqual(decompress_text(compress_text('')), '')
+
+    @skipUnless(zstandard, 'zstandard is not installed')
+    @override_settings(FEEDS_BODY_COMPRESSION='zstd')
+    def test_zstd_round_trip(self):
+        value = compress_text(BODY)
+        self.assertEqual(value[0], ZSTD)
+        self.assertEqual(decompress_text(value), BODY)
+
+        # Values written with another codec stay readable.
+        with override_settings(FEEDS_BODY_COMPRESSION='zlib'):
+            self.assertEqual(decompress_text(value), BODY)
+
+
+@override_settings(FEEDS_BODY_COMPRESSION='zlib')
+class Tests(BaseTests):
+
+    def test_body_is_stored_compressed(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        post = Post.objects.create(source=source, title='Test title', body=BODY, guid='guid-1', index=1)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT body_data FROM feeds_post WHERE id = %s', [post.pk])
+            stored, = cursor.fetchone()
+        self.assertLess(len(stored), len(BODY) / 5)
+        self.assertEqual(Post.objects.get(pk=post.pk).body, BODY)
+        self.assertEqual(Post.objects.with_body().get(pk=post.pk).body, BODY)
+
+    def test_uncompressed_bodies_are_converted(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        for i in range(3):
+            Post.objects.create(source=source, title=f'Title {i}', body='', guid=f'guid-{i}', index=i + 1)
+        # Posts saved before bodies were compressed.
+        Post.objects.update(body=None, legacy_body=BODY)
+
+        post = Post.objects.get(guid='guid-0')
+        self.assertEqual(post.body, BODY)
+        self.assertEqual(Post.objects.with_body().get(guid='guid-0').body, BODY)
+        posts = list(Post.objects.order_by('pk'))
+        Post.objects.load_bodies(posts)
+        self.assertEqual([p.body for p in posts], [BODY] * 3)
+        post.save()
+        self.assertEqual(Post.objects.filter(legacy_body__isnull=False).count(), 3)
+
+        post.body = BODY + 'edited'
+        post.save()
+        self.assertIsNone(Post.objects.with_body().get(guid='guid-0').legacy_body)
+
+        out = StringIO()
+        call_command('compressbodies', chunk_size=1, stdout=out)
+
+        self.assertIn('Updated 2 posts.', out.getvalue())
+        self.assertFalse(Post.objects.filter(legacy_body__isnull=False).exists())
+        self.assertEqual([p.body for p in Post.objects.with_body().order_by('pk')], [BODY + 'edited', BODY, BODY])
+
+    @skipUnless(zstandard, 'zstandard is not installed')
+    def test_bodies_stay_readable_when_the_dictionary_is_replaced(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        Post.objects.bulk_create([
+            Post(source=source, title=f'Title {i}', body=f'<p>Episode {i} of the show, about topic {i % 7}.</p>' * (i % 5 + 1), guid=f'guid-{i}', index=i + 1)
+            for i in range(500)
+        ])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        old_path = os.path.join(directory, 'old.dict')
+        new_path = os.path.join(directory, 'new.dict')
+
+        with override_settings(FEEDS_BODY_COMPRESSION='zstd'):
+            call_command('compressbodies', train_dictionary=old_path, dictionary_size=4096, stdout=StringIO())
+            with override_settings(FEEDS_BODY_COMPRESSION_DICTIONARY=old_path):
+                call_command('compressbodies', recompress=True, stdout=StringIO())
+                expected = {p.guid: p.body for p in Post.objects.with_body()}
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT body_data FROM feeds_post WHERE guid = %s', ['guid-499'])
+                    stored, = cursor.fetchone()
+                self.assertEqual(bytes(stored)[0], ZSTD_DICT)
+
+                # Retrained on other bodies, the new dictionary is a different one.
+                call_command('compressbodies', train_dictionary=new_path, dictionary_size=2048, samples=200, stdout=StringIO())
+        dict_ids = set()
+        for path in (old_path, new_path):
+            with open(path, 'rb') as fin:
+                dict_ids.add(zstandard.ZstdCompressionDict(fin.read()).dict_id())
+        self.assertEqual(len(dict_ids), 2)
+
+        with override_settings(FEEDS_BODY_COMPRESSION='zstd'):
+            with override_settings(FEEDS_BODY_COMPRESSION_DICTIONARY=new_path):
+                with self.assertRaises(ImproperlyConfigured):
+                    list(Post.objects.with_body())
+
+            with override_settings(FEEDS_BODY_COMPRESSION_DICTIONARY=new_path, FEEDS_BODY_COMPRESSION_PREVIOUS_DICTIONARIES=[old_path]):
+                self.assertEqual({p.guid: p.body for p in Post.objects.with_body()}, expected)
+                call_command('compressbodies', recompress=True, stdout=StringIO())
+
+            # Once recompressed, the old dictionary isn't needed any more.
+            with override_settings(FEEDS_BODY_COMPRESSION_DICTIONARY=new_path):
+                self.assertEqual({p.guid: p.body for p in Post.objects.with_body()}, expected)
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from mock import patch
 import requests_mock
 
 from django.utils import timezone
@@ -76,6 +77,31 @@ class Tests(BaseTests):
         self.assertEqual(src.interval, 70)
         self.assertTrue(src.live)
 
+    def test_unchanged_content_skips_import(self, mock):
+
+        self._populate_mock(mock, status=200, test_file="rss_xhtml_body.xml", content_type="application/xml+rss")
+
+        src = Source(name="test1", feed_url=self.BASE_URL, interval=0)
+        src.save()
+
+        read_feed(src)
+        self.assertEqual(src.posts.count(), 1)
+        self.assertEqual(src.interval, 60)
+        self.assertIsNotNone(src.content_hash)
+
+        # The same body again is recognised without being parsed.
+        with patch('feeds.utils.import_feed') as import_feed:
+            read_feed(src)
+        import_feed.assert_not_called()
+        self.assertEqual(src.status_code, 200)
+        self.assertEqual(src.last_result, "OK (content unchanged)")
+        self.assertEqual(src.interval, 80)
+
+        # Forcing a refresh always imports.
+        with patch('feeds.utils.import_feed', return_value=(True, False)) as import_feed:
+            read_feed(src, force=True)
+        import_feed.assert_called_once()
+
     def test_not_a_feed(self, mock):
 
         self._populate_mock(mock, status=200, test_file="spurious_text_file.txt", content_type="text/plain")
@@ -1,6 +1,13 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from feeds.models import Post, Source
+from feeds.models import IndexTargetPropagation, Post, Source, get_guid_hash
+from feeds.utils import propagate_index_targets
 
 from .base import BaseTests
 
@@ -45,3 +52,119 @@ class Tests(BaseTests):
 
         self.assertIsNone(post.created_on)
         self.assertIsNotNone(post.updated_on)
+
+    def test_post_save_only_writes_changed_fields(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        Post.objects.create(source=source, title='Test title', body='Test body', guid='guid-3', index=3, has_bad_body_escaping=True)
+        post = Post.objects.get(guid='guid-3')
+
+        with self.assertNumQueries(0):
+            post.save()
+
+        post.body = 'New body'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        sql, = [q['sql'] for q in queries.captured_queries]
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertNotIn('"title"', sql)
+        self.assertEqual(post.get_dirty_fields(), set())
+
+        post.refresh_from_db()
+        self.assertEqual(post.body, 'New body')
+        self.assertIsNone(post.has_bad_body_escaping)
+
+    def test_deferred_fields_are_not_dirty(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        Post.objects.create(source=source, title='Test title', body='Test body', guid='guid-4', index=4)
+        post = Post.objects.defer('body').get(guid='guid-4')
+
+        self.assertEqual(post.get_dirty_fields(), set())
+        self.assertEqual(post.body, 'Test body')
+        self.assertEqual(post.get_dirty_fields(), set())
+        post.title = 'Updated title'
+        self.assertEqual(post.get_dirty_fields(), {'title'})
+
+    def test_source_propagates_index_target(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        Post.objects.create(source=source, title='Test title', body='Test body', guid='guid-5', index=5)
+        source = Source.objects.get(pk=source.pk)
+
+        source.lucene_index_target = True
+        with CaptureQueriesContext(connection) as queries:
+            source.save()
+        self.assertFalse([q for q in queries.captured_queries if 'feeds_post' in q['sql']])
+        self.assertFalse(source.posts.get().lucene_index_target)
+
+        propagate_index_targets()
+
+        self.assertTrue(source.posts.get().lucene_index_target)
+        self.assertFalse(IndexTargetPropagation.objects.exists())
+
+    def test_index_target_propagation_resumes(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        for i in range(5):
+            Post.objects.create(source=source, title=f'Title {i}', body='Test body', guid=f'guid-p{i}', index=i + 1)
+        source.lucene_index_target = True
+        source.save()
+
+        self.assertEqual(propagate_index_targets(max_chunks=1, chunk_size=2), 2)
+        job = IndexTargetPropagation.objects.get()
+        self.assertEqual(source.posts.filter(lucene_index_target=True).count(), 2)
+        self.assertEqual(job.last_post_id, source.posts.filter(lucene_index_target=True).order_by('pk').last().pk)
+
+        # Toggling the target again restarts the job.
+        source.lucene_index_target = False
+        source.save()
+        job.refresh_from_db()
+        self.assertEqual((job.target, job.last_post_id), (False, 0))
+
+        call_command('propagateindextargets', chunk_size=2, stdout=StringIO())
+
+        self.assertFalse(source.posts.filter(lucene_index_target=True).exists())
+        self.assertFalse(IndexTargetPropagation.objects.exists())
+
+    def test_update_last_created_command(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        empty = Source.objects.create(name='empty source', feed_url=self.BASE_URL, interval=0)
+        post = Post.objects.create(source=source, title='Test title', body='Test body', guid='guid-6', index=6)
+        Source.objects.update(last_created=timezone.now() + timedelta(days=1))
+
+        call_command('updatelastcreated', stdout=StringIO())
+
+        source.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(source.last_created, post.created)
+        self.assertIsNone(empty.last_created)
+
+    def test_body_is_deferred_by_default(self):
+        source = Source.objects.create(name='test source', feed_url=self.BASE_URL, interval=0)
+        for i in range(3):
+            Post.objects.create(source=source, title=f'Title {i}', body=f'Body {i}', guid=f'guid-b{i}', index=i + 1)
+
+        posts = list(source.posts.order_by('index'))
+        self.assertTrue(all('body' in p.get_deferred_fields() for p in posts))
+        self.assertFalse(Post.objects.with_body().first().get_deferred_fields())
+
+        with self.assertNumQueries(1):
+            Post.objects.load_bodies(posts)
+        with self.assertNumQueries(0):
+            self.assertEqual([p.body for p in posts], ['Body 0', 'Body 1', 'Body 2'])
+        self.assertEqual(posts[0].get_dirty_fields(), set())
+
+    def test_posts_are_looked_up_by_guid_hash(self):
+        source = Source.objects.create(name='test source', slug='test-source', feed_url=self.BASE_URL, interval=0)
+        other = Source.objects.create(name='other source', feed_url=self.BASE_URL, interval=0)
+        guid = 'http://feed.com/' + 'x' * 1500
+        post = Post.objects.create(source=source, title='Test title', body='Test body', guid=guid, index=1)
+        other_post = Post.objects.create(source=other, title='Test title', body='Test body', guid=guid, index=1)
+
+        self.assertEqual(post.guid_hash, get_guid_hash(source.pk, guid))
+        self.assertNotEqual(post.guid_hash, other_post.guid_hash)
+        self.assertEqual(Post.objects.for_guid(source, guid).get(), post)
+        self.assertEqual(list(Post.objects.for_guids(other, [guid, 'missing'])), [other_post])
+        self.assertEqual(Post.objects.get_by_natural_key(guid, 'test-source'), post)
+
+        post.guid = 'guid-2'
+        post.save()
+        self.assertEqual(Post.objects.for_guid(source, 'guid-2').get(), post)
+        self.assertFalse(Post.objects.for_guid(source, guid).exists())
@@ -1,6 +1,14 @@
 import logging
+from io import StringIO
+from unittest import skipUnless
+
+from mock import patch
 import requests_mock
 
+from django.core.cache import cache
+from django.core.management import call_command
+
+from feeds.sanitizer import BleachBackend, SanitizeCache, SanitizerEngine, get_engine, nh3, sanitize_cache
 from feeds.utils import sanitize_html, unescape_double_escaped_html
 
 from .base import BaseTests
@@ -10,6 +18,10 @@ logger = logging.getLogger(__name__)
 #pylint: disable=line-too-long
 
 
+def allow_href(tag, name, value):
+    return name == 'href'
+
+
 @requests_mock.Mocker()
 class Tests(BaseTests):
 
@@ -70,3 +82,91 @@ class Tests(BaseTests):
         self.assertIn('<p>', result)
         self.assertIn('<strong>', result)
         self.assertNotIn('&lt;p&gt;', result)
+
+    def test_sanitize_html_is_cached(self, mock):
+        sanitize_cache.clear()
+        html = '<p onclick="x()">Hello <script>bad()</script></p>'
+        with patch.object(BleachBackend, 'clean', autospec=True, side_effect=BleachBackend.clean) as clean:
+            first = sanitize_html(html)
+            self.assertEqual(sanitize_html(html), first)
+            self.assertEqual(clean.call_count, 1)
+            # A change to the allowed tags is sanitized afresh.
+            with self.settings(FEEDS_ALLOWED_TAGS=['em']):
+                self.assertNotIn('<p>', sanitize_html(html))
+            self.assertEqual(clean.call_count, 2)
+        stats = sanitize_cache.stats()
+        self.assertEqual({key: stats[key] for key in ('hits', 'persistent_hits', 'misses', 'size')}, {'hits': 1, 'persistent_hits': 0, 'misses': 2, 'size': 2})
+
+    def test_sanitize_cache_tiers(self, mock):
+        cache.clear()
+        lru = SanitizeCache(max_size=2, cache_alias='default', timeout=60)
+        for i in range(3):
+            self.assertEqual(lru.sanitize(['test', i], lambda i=i: f'value {i}'), f'value {i}')
+        # The oldest entry was evicted from memory, but is still in the persistent cache.
+        self.assertEqual(lru.sanitize(['test', 0], lambda: 'recomputed'), 'value 0')
+        self.assertEqual(lru.sanitize(['test', 2], lambda: 'recomputed'), 'value 2')
+        self.assertEqual(lru.stats(), {'hits': 1, 'persistent_hits': 1, 'misses': 3, 'size': 2, 'chars': 14})
+
+        memory_only = SanitizeCache(max_size=2, cache_alias=None)
+        self.assertEqual(memory_only.sanitize(['test', 0], lambda: 'recomputed'), 'recomputed')
+
+    def test_sanitize_cache_is_bounded_by_length(self, mock):
+        lru = SanitizeCache(max_size=10, cache_alias=None, max_chars=10)
+        for i in range(3):
+            lru.sanitize(['test', i], lambda i=i: f'value {i}')
+        # Only the newest result fits.
+        self.assertEqual(lru.stats(), {'hits': 0, 'persistent_hits': 0, 'misses': 3, 'size': 1, 'chars': 7})
+        self.assertEqual(lru.sanitize(['test', 2], lambda: 'recomputed'), 'value 2')
+
+        # Results longer than the limit aren't kept at all.
+        lru.sanitize(['test', 'long'], lambda: 'x' * 11)
+        self.assertEqual(lru.sanitize(['test', 'long'], lambda: 'y' * 11), 'y' * 11)
+        self.assertEqual(lru.stats(), {'hits': 1, 'persistent_hits': 0, 'misses': 5, 'size': 1, 'chars': 7})
+
+    def test_sanitizer_engine(self, mock):
+        engine = get_engine()
+        self.assertIs(get_engine(), engine)
+        with self.settings(FEEDS_ALLOWED_TAGS=['em']):
+            self.assertEqual(get_engine().backend.tags, ['em'])
+        self.assertIsNot(get_engine(), engine)
+
+        engine = SanitizerEngine(cache=None)
+        with patch.object(engine.backend, 'clean', wraps=engine.backend.clean) as clean:
+            # Text without markup isn't parsed at all.
+            for text in ('', 'Plain text, "quoted" and \tindented.\n', 'Ünïcödé ✓'):
+                self.assertEqual(engine.sanitize(text), text)
+            self.assertEqual(clean.call_count, 0)
+            self.assertEqual(engine.sanitize('Tom & Jerry\r\n'), 'Tom &amp; Jerry\n')
+            self.assertEqual(engine.sanitize('<p align="left">Hi</p>'), '<p>Hi</p>')
+            self.assertEqual(clean.call_count, 2)
+
+    def test_sanitizer_engine_cache_key(self, mock):
+        cache = SanitizeCache(max_size=10, cache_alias='default')
+
+        # Named attribute filters are keyed the same way in every process.
+        engine = SanitizerEngine(tags=['a'], attributes=allow_href, cache=cache)
+        self.assertTrue(engine.persistent)
+        self.assertEqual(engine.cache_key, SanitizerEngine(tags=['a'], attributes=allow_href, cache=cache).cache_key)
+        self.assertNotEqual(engine.cache_key, SanitizerEngine(tags=['a'], attributes={'a': ['href']}, cache=cache).cache_key)
+
+        # A lambda isn't, so its results stay out of the persistent cache.
+        engine = SanitizerEngine(tags=['a'], attributes=lambda tag, name, value: name == 'href', cache=cache)
+        self.assertFalse(engine.persistent)
+        self.assertEqual(engine.sanitize('<a href="/x" title="x">x</a>'), '<a href="/x">x</a>')
+        self.assertEqual(engine.sanitize('<a href="/x" title="x">x</a>'), '<a href="/x">x</a>')
+        self.assertEqual(cache.stats()['hits'], 1)
+        cache.clear()
+        self.assertEqual(engine.sanitize('<a href="/x" title="x">x</a>'), '<a href="/x">x</a>')
+        self.assertEqual(cache.stats(), {'hits': 0, 'persistent_hits': 0, 'misses': 1, 'size': 1, 'chars': 18})
+
+    @skipUnless(nh3, 'nh3 is not installed')
+    def test_nh3_backend(self, mock):
+        engine = SanitizerEngine(backend='nh3', cache=None)
+        self.assertEqual(engine.sanitize('<p align="left" onclick="x()">Hi <a href="/x">there</a></p>'), '<p>Hi <a href="/x">there</a></p>')
+        self.assertEqual(engine.sanitize('&lt;p&gt;Double escaped&lt;/p&gt;'), '<p>Double escaped</p>')
+        self.assertNotIn('script', engine.sanitize('<script>alert(1)</script><a href="javascript:alert(1)">x</a>'))
+
+    def test_benchmark_sanitizer_command(self, mock):
+        out = StringIO()
+        call_command('benchmarksanitizer', repeat=1, stdout=out)
+        self.assertIn('bleach', out.getvalue())
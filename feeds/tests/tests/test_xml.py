@@ -1,9 +1,21 @@
 import logging
+import os
+from datetime import timedelta
+from io import StringIO
+
+import feedparser
+from mock import patch
 import requests_mock
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from feeds.models import Source
-from feeds.utils import read_feed
+from feeds.models import Enclosure, MediaContent, Post, Source, SourceStats
+from feeds import xmlparser
+from feeds.utils import (
+    assign_post_indexes, bulk_save_posts, get_xml_entry_record, import_feed, parse_feed_document, read_feed, reconcile_attachments, update_source_stats
+)
 
 from .base import BaseTests
 
@@ -41,6 +53,9 @@ class Tests(BaseTests):
 
         self.assertEqual(src.posts.all()[0].enclosures.count(), 1)
 
+        src.refresh_from_db()
+        self.assertEqual(src.last_created, src.posts.order_by('-created')[0].created)
+
     def test_sanitize_1(self, mock):
         """
             Make sure feedparser's sanitization is running
@@ -147,3 +162,358 @@ class Tests(BaseTests):
         post = src.posts.get()
         self.assertGreaterEqual(post.created, before)
         self.assertLessEqual(post.created, after)
+
+    def _get_records(self, count, body='Hello'):
+        return [{
+            'guid': f'guid-{i}',
+            'defaults': {
+                'title': f'Episode {i}',
+                'link': f'https://example.com/{i}',
+                'author': '',
+                'created': timezone.now(),
+                'found': timezone.now(),
+                'index': 0,
+            },
+            'updates': {
+                'body': body,
+                'created': timezone.now() - timedelta(days=count - i),
+            },
+            'enclosures': [],
+            'media_content': [],
+        } for i in range(count)]
+
+    def test_bulk_save_posts_query_count(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        other = Source.objects.create(name="test2", feed_url=self.BASE_URL, interval=0)
+
+        with CaptureQueriesContext(connection) as small:
+            bulk_save_posts(src, self._get_records(3))
+        with CaptureQueriesContext(connection) as large:
+            saved, changed = bulk_save_posts(other, self._get_records(30))
+
+        self.assertTrue(changed)
+        self.assertEqual(len(saved), 30)
+        self.assertEqual(other.posts.count(), 30)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+        # Created dates from the feed replace the ones set on insert.
+        post = other.posts.get(guid='guid-0')
+        self.assertLess(post.created, timezone.now() - timedelta(days=29))
+        self.assertEqual(post.body, 'Hello')
+
+    def test_bulk_save_posts_only_updates_changes(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        records = self._get_records(3)
+        bulk_save_posts(src, records)
+        Post.objects.filter(source=src).update(has_bad_body_escaping=True)
+        updated_on = dict(src.posts.values_list('guid', 'updated_on'))
+
+        records[1]['updates']['body'] = 'Changed'
+        with CaptureQueriesContext(connection) as queries:
+            _saved, changed = bulk_save_posts(src, records)
+
+        self.assertFalse(changed)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        for post in src.posts.all():
+            if post.guid == 'guid-1':
+                self.assertEqual(post.body, 'Changed')
+                self.assertIsNone(post.has_bad_body_escaping)
+                self.assertGreater(post.updated_on, updated_on[post.guid])
+            else:
+                self.assertTrue(post.has_bad_body_escaping)
+                self.assertEqual(post.updated_on, updated_on[post.guid])
+
+    def test_bulk_save_posts_suffixes_duplicate_slugs(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        records = self._get_records(3)
+        records[2]['defaults']['title'] = records[1]['defaults']['title']
+        records.append(dict(records[0], updates={'body': 'Repeated'}))
+
+        saved, _changed = bulk_save_posts(src, records)
+
+        self.assertEqual(sorted(src.posts.values_list('guid', flat=True)), ['guid-0', 'guid-1', 'guid-2'])
+        self.assertEqual(len(saved), 4)
+        self.assertEqual(src.posts.get(guid='guid-0').body, 'Repeated')
+        slug = src.posts.get(guid='guid-1').slug
+        self.assertEqual(src.posts.get(guid='guid-2').slug, slug + '-2')
+
+        # Later imports carry on from the suffixes already taken.
+        records = self._get_records(5)[3:]
+        for record in records:
+            record['defaults']['title'] = self._get_records(2)[1]['defaults']['title']
+        bulk_save_posts(src, records)
+        self.assertEqual([src.posts.get(guid=guid).slug for guid in ('guid-3', 'guid-4')], [slug + '-3', slug + '-4'])
+
+    def test_reconcile_attachments(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        bulk_save_posts(src, self._get_records(3))
+        p0, p1, p2 = src.posts.order_by('guid')
+        Enclosure.objects.create(post=p0, href='https://example.com/0.mp3', length=1, type='audio/mpeg')
+        mp3 = {'href': 'https://example.com/0.mp3', 'length': 100, 'type': 'audio/mpeg'}
+        video = {'url': 'https://example.com/1.mp4', 'content_type': 'video/mp4', 'duration': 60}
+
+        items = [
+            (p0, [mp3, dict(mp3, href='https://example.com/other.mp3')], []),
+            (p1, [], [video]),
+            (p2, [dict(mp3, href='https://example.com/2.mp3')], [video]),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            reconcile_attachments(items)
+        # One read each for enclosures and media, then an update and two inserts.
+        self.assertEqual(len(queries.captured_queries), 5)
+
+        self.assertEqual(list(p0.enclosures.values_list('href', 'length')), [('https://example.com/0.mp3', 100)])
+        self.assertEqual(list(p1.enclosures.values_list('href', 'type', 'length')), [('https://example.com/1.mp4', 'video/mp4', 60)])
+        self.assertEqual(list(p2.enclosures.values_list('href', flat=True)), ['https://example.com/2.mp3'])
+        self.assertEqual(MediaContent.objects.filter(post__source=src).count(), 2)
+
+        # Nothing left to write the second time around.
+        with CaptureQueriesContext(connection) as queries:
+            reconcile_attachments(items)
+        self.assertEqual(len(queries.captured_queries), 2)
+
+    def test_assign_post_indexes(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        stale = Source.objects.get(pk=src.pk)
+        bulk_save_posts(src, self._get_records(3))
+
+        with CaptureQueriesContext(connection) as small:
+            assign_post_indexes(src)
+        self.assertEqual(src.max_index, 3)
+        # Oldest first.
+        self.assertEqual(list(src.posts.order_by('index').values_list('guid', flat=True)), ['guid-0', 'guid-1', 'guid-2'])
+
+        # A second worker holding an outdated copy of the source continues from the stored max_index.
+        records = self._get_records(30)[3:]
+        bulk_save_posts(src, records)
+        with CaptureQueriesContext(connection) as large:
+            assign_post_indexes(stale)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(stale.max_index, 30)
+        self.assertEqual(sorted(src.posts.values_list('index', flat=True)), list(range(1, 31)))
+
+        # Saving the first copy doesn't roll max_index back.
+        src.save()
+        src.refresh_from_db()
+        self.assertEqual(src.max_index, 30)
+
+    def test_failed_import_is_rolled_back(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        with open(os.path.join(self.TEST_FILES_FOLDER, 'podcast.xml'), 'rb') as fin:
+            feed_body = fin.read()
+
+        with patch('feeds.utils.reconcile_attachments', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                import_feed(src, feed_body, 'application/rss+xml')
+
+        self.assertEqual(src.posts.count(), 0)
+
+        ok, changed = import_feed(src, feed_body, 'application/rss+xml')
+        self.assertTrue(ok and changed)
+        self.assertGreater(src.posts.count(), 0)
+
+    def test_unchanged_entries_are_not_rewritten(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        with open(os.path.join(self.TEST_FILES_FOLDER, 'podcast.xml'), 'rb') as fin:
+            feed_body = fin.read()
+        import_feed(src, feed_body, 'application/rss+xml')
+        self.assertFalse(src.posts.filter(fingerprint__isnull=True).exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            ok, changed = import_feed(src, feed_body, 'application/rss+xml')
+
+        self.assertTrue(ok)
+        self.assertFalse(changed)
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(writes, [])
+        # Nor are the bodies read.
+        self.assertFalse([q['sql'] for q in queries.captured_queries if '"feeds_post"."body"' in q['sql']])
+
+        # A changed entry is written again.
+        post = src.posts.order_by('index').last()
+        Post.objects.filter(pk=post.pk).update(body='Stale', fingerprint='stale')
+        import_feed(src, feed_body, 'application/rss+xml')
+        post.refresh_from_db()
+        self.assertNotEqual(post.body, 'Stale')
+        self.assertNotEqual(post.fingerprint, 'stale')
+
+    def test_undated_entries_are_not_rewritten(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        feed_body = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>Undated</title><link>https://example.com/</link>
+<item><title>No date</title><guid>undated-1</guid><description>Hello</description></item>
+<item><title>Far future</title><guid>undated-2</guid><description>Hello</description><pubDate>Sat, 01 Jan %d 00:00:00 GMT</pubDate></item>
+<item><title>Too old</title><guid>undated-3</guid><description>Hello</description><pubDate>Sun, 01 Jan 1995 00:00:00 GMT</pubDate></item>
+</channel></rss>""" % (timezone.now().year + 5)
+        import_feed(src, feed_body, 'application/rss+xml')
+        created = dict(src.posts.values_list('guid', 'created'))
+        self.assertEqual(len(created), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            ok, changed = import_feed(src, feed_body, 'application/rss+xml', full=True)
+
+        self.assertTrue(ok)
+        self.assertFalse(changed)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if q['sql'].split()[0] == 'UPDATE'])
+        self.assertEqual(dict(src.posts.values_list('guid', 'created')), created)
+
+    def test_source_stats_are_maintained(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        records = self._get_records(3)
+        with open(os.path.join(self.TEST_FILES_FOLDER, 'podcast.xml'), 'rb') as fin:
+            import_feed(src, fin.read(), 'application/rss+xml')
+        posts = src.posts.order_by('created')
+
+        stats = SourceStats.objects.get(source=src)
+        self.assertEqual(stats.post_count, posts.count())
+        self.assertEqual(stats.newest_created, posts.last().created)
+        self.assertEqual(stats.oldest_created, posts.first().created)
+        self.assertEqual(stats.recent_post_count, 0)
+
+        # Recent posts are counted, and repeated GUIDs only once.
+        records.append(dict(records[0], updates={'body': 'Repeated'}))
+        saved, _changed = bulk_save_posts(src, records)
+        update_source_stats(src, src.pop_pending_stats())
+        stats.refresh_from_db()
+        self.assertEqual(stats.post_count, posts.count())
+        self.assertEqual(stats.recent_post_count, 3)
+        self.assertEqual(stats.newest_created, posts.last().created)
+
+        # Stalled sources are found from the stats.
+        stats.newest_created = timezone.now() - timedelta(days=31)
+        stats.save()
+        self.assertTrue(Source.objects.exclude(stats__newest_created__gte=timezone.now() - timedelta(days=30)).filter(pk=src.pk).exists())
+
+        call_command('updatesourcestats', stdout=StringIO())
+        stats.refresh_from_db()
+        self.assertEqual(stats.newest_created, posts.last().created)
+
+    def test_fast_parser_matches_feedparser(self, mock):
+        atom = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:media="http://search.yahoo.com/mrss/" xml:lang="en">
+  <title type="html">Atom &amp;amp; Media</title>
+  <link href="https://example.com/" />
+  <subtitle>About things</subtitle>
+  <id>urn:feed</id>
+  <updated>2024-01-02T03:04:05Z</updated>
+  <entry>
+    <title>First</title>
+    <id>urn:entry:1</id>
+    <link rel="alternate" href="https://example.com/1" />
+    <link rel="enclosure" href="https://example.com/1.mp3" length="1234" type="audio/mpeg" />
+    <author><name>Jane</name><email>jane@example.com</email></author>
+    <published>2024-01-01T00:00:00+01:00</published>
+    <content type="html">&lt;p align="left" onclick="x()"&gt;Hello &lt;a href=" /rel "&gt;there&lt;/a&gt;&lt;script&gt;bad()&lt;/script&gt;&lt;/p&gt;</content>
+    <media:content url="https://example.com/1.jpg" type="image/jpeg" medium="image" width="10" height="20" />
+    <media:thumbnail url="https://example.com/1-thumb.jpg" />
+  </entry>
+  <entry>
+    <title>Second</title>
+    <id>urn:entry:2</id>
+    <updated>2024-01-02T00:00:00Z</updated>
+    <summary>Just a summary</summary>
+  </entry>
+</feed>"""
+        self._assert_parsers_match(atom)
+
+    def test_fast_parser_matches_feedparser_on_test_files(self, mock):
+        # Every test file the fast parser accepts must be read the way feedparser reads it. The rest are left to feedparser.
+        matched = []
+        for name in sorted(os.listdir(self.TEST_FILES_FOLDER)):
+            with open(os.path.join(self.TEST_FILES_FOLDER, name), 'rb') as fin:
+                content = fin.read()
+            try:
+                xmlparser.parse(content)
+            except (xmlparser.UnsupportedFeed, xmlparser.ParseError):
+                continue
+            with self.subTest(name=name):
+                self._assert_parsers_match(content)
+            matched.append(name)
+        self.assertTrue({'podcast.xml', 'podcast_sample1.rss', 'sanitizer_bad_comment.xml', 'sanitizer_img_attrs.xml'}.issubset(matched))
+
+    def _assert_parsers_match(self, content):
+        """
+        Checks that the fast parser reads everything the importer uses from a document the same way feedparser does.
+        """
+        src = Source(name="test1", feed_url=self.BASE_URL, interval=0)
+        now = timezone.now()
+        with patch('feeds.utils.timezone.now', return_value=now):
+            fast = parse_feed_document(src, content)
+            self.assertEqual(src.xml_parser, 'fast')
+            slow = feedparser.parse(content)
+            self.assertTrue(fast.entries)
+            for key in ('title', 'link', 'image', 'summary', 'description'):
+                self.assertEqual(fast.feed.get(key), slow.feed.get(key))
+            for key in ('id', 'link', 'published_parsed'):
+                self.assertEqual([e.get(key) for e in fast.entries], [e.get(key) for e in slow.entries])
+            self.assertEqual(
+                [get_xml_entry_record(src, e) for e in fast.entries],
+                [get_xml_entry_record(src, e) for e in slow.entries],
+            )
+
+    def test_fast_parser_falls_back_to_feedparser(self, mock):
+        self._populate_mock(mock, status=200, test_file="rss_xhtml_body.xml", content_type="application/rss+xml")
+
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        read_feed(src)
+        src.refresh_from_db()
+        self.assertEqual(src.xml_parser, 'feedparser')
+        self.assertEqual(src.posts.count(), 1)
+
+        # Once a source needed feedparser, the fast parser is only tried again on full imports, and is remembered when it succeeds.
+        with patch('feeds.utils.xmlparser.parse') as parse:
+            parse_feed_document(src, b'<rss version="2.0"><channel><item><title>Hello</title></item></channel></rss>')
+        parse.assert_not_called()
+        with open(os.path.join(self.TEST_FILES_FOLDER, 'podcast.xml'), 'rb') as fin:
+            import_feed(src, fin.read(), 'application/rss+xml', full=True)
+        self.assertEqual(src.xml_parser, 'fast')
+
+        src.xml_parser = None
+        with self.assertRaises(xmlparser.ParseError):
+            xmlparser.parse(b'<rss version="2.0"><channel><item><title>Hello</title></channel></rss>')
+        f = parse_feed_document(src, b'<rss version="2.0"><channel><item><title>Hello</title></channel></rss>')
+        self.assertEqual(src.xml_parser, 'feedparser')
+        self.assertTrue(f.bozo)
+
+    def _get_feed(self, items):
+        entries = ''.join(
+            f'<item><title>{title}</title><description>{title}</description><guid>{guid}</guid><pubDate>{date:%a, %d %b %Y %H:%M:%S} +0000</pubDate></item>'
+            for guid, title, date in items
+        )
+        return f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Feed</title>{entries}</channel></rss>'.encode('utf-8')
+
+    def test_incremental_import_stops_at_known_entries(self, mock):
+        src = Source.objects.create(name="test1", feed_url=self.BASE_URL, interval=0)
+        start = timezone.now().replace(microsecond=0) - timedelta(days=100)
+        items = [(f'guid-{i}', f'Episode {i}', start + timedelta(days=i)) for i in range(30)]
+        import_feed(src, self._get_feed(items[::-1]), 'application/rss+xml')
+        self.assertEqual(src.posts.count(), 30)
+        self.assertIsNotNone(src.last_full_import)
+
+        # A new entry at the top, and an edit to an old one further down than the known entries read.
+        items[0] = ('guid-0', 'Episode 0 edited', items[0][2])
+        items.append(('guid-30', 'Episode 30', start + timedelta(days=30)))
+        with self.settings(FEEDS_INCREMENTAL_KNOWN_ENTRIES=5), patch('feeds.utils.get_xml_entry_record', wraps=get_xml_entry_record) as get_record:
+            ok, changed = import_feed(src, self._get_feed(items[::-1]), 'application/rss+xml')
+        self.assertTrue(ok and changed)
+        self.assertEqual(get_record.call_count, 6)
+        self.assertEqual(src.posts.count(), 31)
+        self.assertEqual(Post.objects.with_body().get(source=src, guid='guid-0').body, 'Episode 0')
+        self.assertEqual(src.posts.get(guid='guid-30').index, 31)
+
+        # Feeds listing their entries oldest first are read from the end.
+        items.append(('guid-31', 'Episode 31', start + timedelta(days=31)))
+        with self.settings(FEEDS_INCREMENTAL_KNOWN_ENTRIES=5), patch('feeds.utils.get_xml_entry_record', wraps=get_xml_entry_record) as get_record:
+            import_feed(src, self._get_feed(items), 'application/rss+xml')
+        self.assertEqual(get_record.call_count, 6)
+        self.assertTrue(src.posts.filter(guid='guid-31').exists())
+
+        # Forced and periodic imports read every entry.
+        import_feed(src, self._get_feed(items), 'application/rss+xml', full=True)
+        self.assertEqual(Post.objects.with_body().get(source=src, guid='guid-0').body, 'Episode 0 edited')
+        self.assertFalse(src.needs_full_import())
+        src.last_full_import -= timedelta(hours=25)
+        self.assertTrue(src.needs_full_import())
+        with self.settings(FEEDS_INCREMENTAL_KNOWN_ENTRIES=0):
+            self.assertTrue(Source(name="test2", last_full_import=timezone.now()).needs_full_import())
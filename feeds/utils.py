@@ -1,4 +1,3 @@
-import html
 import time
 import datetime
 import hashlib
@@ -8,17 +7,22 @@ import json
 from datetime import timedelta
 from urllib.parse import urlparse, urlunparse, unquote, parse_qsl, urlencode
 
-import bleach
 from bs4 import BeautifulSoup
 from dateutil.parser import parse
 
-from django.db.models import Q, Max
+from django.db import transaction
+from django.db.models import Count, DateTimeField, F, Max, Min, Q, Value
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.utils import timezone
 from django.conf import settings
 from django.db.utils import IntegrityError
 
-from feeds.models import Source, Post, Enclosure, WebProxy, MediaContent
+from feeds.models import Source, Post, Enclosure, WebProxy, MediaContent, IndexTargetPropagation, SourceStats
 from feeds.constants import REAL_CDNS
+from feeds.fetch import FeedFetch, FetchLimitExceeded, SessionPool, fetch_feeds, http_get
+from feeds.parse import ParsePool
+from feeds.sanitizer import configure_feedparser, get_engine, sanitize_cache, unescape_double_escaped_html # pylint: disable=unused-import
+from feeds import xmlparser
 
 import feedparser
 from feedparser.sanitizer import _sanitize_html
@@ -33,6 +37,9 @@ utc = datetime.timezone.utc
 MIN_REASONABLE_POST_DATE = datetime.datetime(2000, 1, 1, tzinfo=utc)
 MAX_REASONABLE_POST_DATE_SKEW = datetime.timedelta(days=7)
 
+# Maximum number of rows read or written per query when importing posts in bulk.
+BULK_BATCH_SIZE = 500
+
 
 class NullOutput:
     # little class for when we have no outputter
@@ -53,13 +60,21 @@ def normalize_post_created(date_value, *, context=''):
     if timezone.is_naive(date_value):
         date_value = timezone.make_aware(date_value, utc)
 
-    if date_value < MIN_REASONABLE_POST_DATE or date_value > now + MAX_REASONABLE_POST_DATE_SKEW:
+    if not is_reasonable_post_created(date_value, now=now):
         logger.warning('Ignoring unreasonable post created date %s for %s; using now().', date_value, context or 'unknown entry')
         return now
 
     return date_value
 
 
+def is_reasonable_post_created(date_value, *, now=None):
+    """
+    Returns whether an aware feed-supplied publish date is one normalize_post_created() keeps.
+    """
+    now = now or timezone.now()
+    return MIN_REASONABLE_POST_DATE <= date_value <= now + MAX_REASONABLE_POST_DATE_SKEW
+
+
 def strip_podcast_trackers(url: str) -> str:
     decoded = unquote(url)
     parts = decoded.split('/')
@@ -69,53 +84,15 @@ def strip_podcast_trackers(url: str) -> str:
     return url
 
 
-def _customize_sanitizer(fp):
-
-    bad_attributes = ["align", "valign", "hspace"]
-
-    for item in bad_attributes:
-        try:
-            if item in fp._HTMLSanitizer.acceptable_attributes:
-                fp._HTMLSanitizer.acceptable_attributes.remove(item)
-        except Exception:
-            logging.debug("Could not remove %s", item)
+def sanitize_html(html_content):
+    return get_engine().sanitize(html_content)
 
 
-def unescape_double_escaped_html(html_content):
+def sanitize_feed_html(html_content):
     """
-    Detect and fix double-escaped HTML tags.
-
-    Some feeds send content with tags already escaped like '&lt;p&gt;' instead of '<p>'.
-    This function detects common escaped tag patterns and unescapes them.
+    Sanitizes HTML with feedparser's sanitizer, the way it sanitizes the HTML in XML feeds.
     """
-    if not html_content:
-        return html_content
-
-    # Check for common escaped tag patterns (opening AND closing tags)
-    escaped_patterns = [
-        '&lt;p', '&lt;a ', '&lt;br', '&lt;div', '&lt;span', '&lt;img', '&lt;em', '&lt;strong', '&lt;b&gt;', '&lt;i&gt;', '&lt;ul', '&lt;ol', '&lt;li',
-        '&lt;blockquote', '&lt;/'
-    ]
-
-    needs_unescape = any(pattern in html_content for pattern in escaped_patterns)
-
-    if needs_unescape:
-        logger.debug('Detected double-escaped HTML, unescaping')
-        return html.unescape(html_content)
-
-    return html_content
-
-
-def sanitize_html(html_content):
-    tags = settings.FEEDS_ALLOWED_TAGS
-    attributes = settings.FEEDS_ALLOWED_ATTRIBUTES
-    logger.debug('Allowed tags: %s', tags)
-    logger.debug('Allowed attributes: %s', attributes)
-
-    # Fix double-escaped HTML before sanitizing
-    html_content = unescape_double_escaped_html(html_content)
-
-    return bleach.clean(html_content, tags=tags, attributes=attributes)
+    return sanitize_cache.sanitize([configure_feedparser(), html_content], lambda: _sanitize_html(html_content, "utf-8", 'text/html'))
 
 
 def get_agent(source_feed):
@@ -162,7 +139,7 @@ def fix_relative(html, url):
     return html
 
 
-def update_feeds(max_feeds=3, output=NullOutput(), sources=None, force=False, only_stalled=True):
+def update_feeds(max_feeds=3, output=NullOutput(), sources=None, force=False, only_stalled=True, concurrency=None, parse_workers=None): # pylint: disable=too-many-positional-arguments
 
     if sources is None:
         todo = Source.objects.filter(Q(due_poll__lt=timezone.now()) & Q(live=True, update=True))
@@ -171,60 +148,140 @@ def update_feeds(max_feeds=3, output=NullOutput(), sources=None, force=False, on
 
     if only_stalled:
         cutoff = timezone.now() - timedelta(days=30)
-        todo = todo.exclude(id__in=Post.objects.filter(created__gte=cutoff).values_list('source_id', flat=True).distinct())
+        todo = todo.exclude(stats__newest_created__gte=cutoff)
 
     logger.info("Queue size is %i.", todo.count())
 
-    sources = todo.order_by("due_poll")[:max_feeds]
+    sources = list(todo.order_by("due_poll")[:max_feeds])
 
-    logger.info("Processing %d.", sources.count())
+    logger.info("Processing %d.", len(sources))
 
-    for src in sources:
-        try:
+    with SessionPool() as session_pool, ParsePool(parse_workers) as parse_pool:
+
+        # Prepare every request up front, so the network stage can run them all concurrently.
+        fetches = {}
+        for src in sources:
             if src.extract_from_raw_html and src.extract_from_raw_html_page_key:
                 max_page = max(src.extract_from_raw_html_page_max, 1)
-                for page in range(1, max_page + 1):
-                    logger.info('Reading page %s of %s.', page, max_page)
-                    read_feed(src, output, force=force, page=page, page_key=src.extract_from_raw_html_page_key)
+                fetches[src.pk] = [
+                    prepare_fetch(src, output, force=force, page=page, page_key=src.extract_from_raw_html_page_key) for page in range(1, max_page + 1)
+                ]
             else:
-                read_feed(src, output, force=force)
-        except Exception as exc:
-            logging.error('Unable to update source %s.', src)
-            src.last_polled = timezone.now()
-            src.due_poll = timezone.now() + datetime.timedelta(days=1000)
-            src.last_result = str(exc)[:255]
-
-        if only_stalled:
-            most_recent_date = src.posts.aggregate(Max('created'))['created__max']
-            logger.info('Source %s has a most recent post date of %s.', src.id, most_recent_date)
-            if not src.last_success or (src.last_success and
-                                        (timezone.now() - src.last_success).days >= 30) or ((timezone.now() - most_recent_date).days >= 30):
-                if src.is_cloudflare:
-                    logger.info("Disabling cloudflare for source %s due to lack of updates.", src.id)
-                    src.is_cloudflare = False
+                fetches[src.pk] = [prepare_fetch(src, output, force=force)]
+        fetch_feeds([fetch for src in sources for fetch in fetches[src.pk]], concurrency=concurrency, session_pool=session_pool)
+
+        # Start parsing every feed that will be imported, so the pool parses the rest while each is imported in turn.
+        for src in sources:
+            for fetch in fetches[src.pk]:
+                prepare_parse(parse_pool, fetch, force=force)
+
+        for src in sources:
+            try:
+                for fetch in fetches[src.pk]:
+                    if fetch.page:
+                        logger.info('Reading page %s of %s.', fetch.page, len(fetches[src.pk]))
+                    read_feed(src, output, force=force, page=fetch.page, page_key=fetch.page_key, fetch=fetch, session_pool=session_pool)
+            except Exception as exc:
+                logging.error('Unable to update source %s.', src)
+                src.last_polled = timezone.now()
+                src.due_poll = timezone.now() + datetime.timedelta(days=1000)
+                src.last_result = str(exc)[:255]
+
+            if only_stalled:
+                most_recent_date = src.last_created
+                logger.info('Source %s has a most recent post date of %s.', src.id, most_recent_date)
+                if not src.last_success or (src.last_success and
+                                            (timezone.now() - src.last_success).days >= 30) or ((timezone.now() - most_recent_date).days >= 30):
+                    if src.is_cloudflare:
+                        logger.info("Disabling cloudflare for source %s due to lack of updates.", src.id)
+                        src.is_cloudflare = False
+                    else:
+                        logger.info("Marking source %s as disabled due to lack of updates.", src.id)
+                        src.update = False
                 else:
-                    logger.info("Marking source %s as disabled due to lack of updates.", src.id)
-                    src.update = False
-            else:
-                logger.info("Source %s is still functional.", src.id)
+                    logger.info("Source %s is still functional.", src.id)
 
-        src.save()
+            src.save()
+
+        stats = session_pool.stats()
+        logger.info('HTTP sessions: %(requests)d requests to %(hosts)d hosts over %(connections)d connections, %(reused)d handshakes saved.', stats)
+        output.write('HTTP sessions: {requests} requests to {hosts} hosts over {connections} connections, {reused} handshakes saved.'.format(**stats))
+
+    # Only counts what this process sanitized, not what parse workers did.
+    stats = sanitize_cache.stats()
+    logger.info('Sanitize cache: %(hits)d hits, %(persistent_hits)d persistent hits, %(misses)d misses, %(size)d entries of %(chars)d characters.', stats)
 
     # Kill proxies.
     WebProxy.objects.filter(address='X').delete()
 
+    if settings.FEEDS_INDEX_PROPAGATION_CHUNKS_PER_RUN:
+        propagate_index_targets(max_chunks=settings.FEEDS_INDEX_PROPAGATION_CHUNKS_PER_RUN, output=output)
 
-def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key=None):
-    logger.info('-' * 80)
-    logger.info('Reading feed: %s', source_feed)
 
-    old_interval = source_feed.interval
-    source_feed.last_result = ""
+def propagate_index_targets(max_chunks=None, chunk_size=None, output=NullOutput()):
+    """
+    Copies the lucene_index_target of each source queued by Source.save() to its posts, one range of primary keys at a time.
 
-    was302 = False
+    Each chunk is committed along with its progress, so an interrupted run resumes where it stopped. Stops after `max_chunks` chunks, if given.
 
-    source_feed.last_polled = timezone.now()
+    Returns the number of posts updated.
+    """
+    chunk_size = chunk_size or settings.FEEDS_INDEX_PROPAGATION_CHUNK_SIZE
+    chunks = 0
+    total = 0
+    for job in IndexTargetPropagation.objects.order_by('created'):
+        while max_chunks is None or chunks < max_chunks:
+            with transaction.atomic():
+                # Carry on only while the job is still the one we read. If the target was toggled again meanwhile, the job was reset and is
+                # picked up again by the next run.
+                current = IndexTargetPropagation.objects.select_for_update().filter(pk=job.pk, target=job.target, last_post_id=job.last_post_id)
+                if not current.exists():
+                    break
+                post_ids = list(Post.objects.filter(source_id=job.source_id, pk__gt=job.last_post_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+                if not post_ids:
+                    current.delete()
+                    break
+                total += Post.objects.filter(source_id=job.source_id, pk__gte=post_ids[0],
+                                             pk__lte=post_ids[-1]).exclude(lucene_index_target=job.target).update(lucene_index_target=job.target)
+                current.update(last_post_id=post_ids[-1])
+                job.last_post_id = post_ids[-1]
+            chunks += 1
+
+    if total:
+        logger.info('Propagated index targets to %d posts.', total)
+        output.write(f'Propagated index targets to {total} posts.')
+    return total
+
+
+def compress_post_bodies(chunk_size=1000, recompress=False, output=NullOutput()):
+    """
+    Moves post bodies still stored in the old, uncompressed column into the compressed one, one range of primary keys at a time.
+
+    With `recompress`, every body is rewritten with the current compression settings, e.g. after training a dictionary.
 
+    Returns the number of posts updated.
+    """
+    posts = Post._base_manager.order_by('pk')
+    if not recompress:
+        posts = posts.filter(legacy_body__isnull=False)
+    last_id = 0
+    total = 0
+    while True:
+        rows = list(posts.filter(pk__gt=last_id).values_list('pk', 'body', 'legacy_body')[:chunk_size])
+        if not rows:
+            break
+        Post._base_manager.bulk_update([Post(pk=pk, body=legacy_body if body is None else body, legacy_body=None) for pk, body, legacy_body in rows],
+                                       ['body', 'legacy_body'])
+        last_id = rows[-1][0]
+        total += len(rows)
+        output.write(f'Compressed {total} posts.')
+    return total
+
+
+def prepare_fetch(source_feed, output=NullOutput(), force=False, page=None, page_key=None):
+    """
+    Builds the request for a source's feed, without sending it.
+    """
     agent = get_agent(source_feed)
 
     headers = {"User-Agent": agent}
@@ -248,25 +305,79 @@ def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key
         if source_feed.last_modified:
             headers["If-Modified-Since"] = str(source_feed.last_modified)
 
-    ret = None
-    try:
+    feed_url = source_feed.feed_url
+    if page and page_key:
+        url_parts = urlparse(feed_url)
+        query = dict(parse_qsl(url_parts.query))
+        query[page_key] = page
+        new_query = urlencode(query)
+        feed_url = urlunparse(url_parts._replace(query=new_query))
+
+    return FeedFetch(source_feed, feed_url, headers, proxies=proxies, proxy=proxy, page=page, page_key=page_key)
+
+
+def prepare_parse(parse_pool, fetch, force=False):
+    """
+    Starts parsing the response of a performed FeedFetch in the parse pool, if read_feed() will import it, and keeps the FeedParse on the fetch.
+    """
+    source_feed = fetch.source_feed
+    ret = fetch.response
+    if parse_pool.workers <= 1 or fetch.error is not None or ret is None or not 200 <= ret.status_code < 300:
+        return None
+    # The same check read_feed() skips unchanged feeds by.
+    if not force and not fetch.page and hashlib.sha256(ret.content).hexdigest() == source_feed.content_hash:
+        return None
+
+    feed_type = get_feed_type(source_feed, ret.content, ret.headers.get("Content-Type", "Not Set"))
+    if feed_type == 'html':
+        fetch.parsed = parse_pool.submit(get_raw_html_items, source_feed, ret.content)
+    elif feed_type == 'xml':
+        full = force or source_feed.needs_full_import()
+        known_guids = None
+        if not full:
+            # The worker can't look the entries up, so it's given the GUIDs of the source's newest posts, which the feed's known entries are
+            # usually among. parse_feed_xml() checks where the import should stop against the database.
+            known_guids = set(source_feed.posts.order_by('-created').values_list('guid', flat=True)[:settings.FEEDS_INCREMENTAL_KNOWN_ENTRIES * 4])
+        fetch.parsed = parse_pool.submit(get_feed_xml_records, source_feed, ret.content, full, known_guids)
+    return fetch.parsed
+
+
+def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key=None, fetch=None, session_pool=None): # pylint: disable=too-many-positional-arguments
+    """
+    Polls a source's feed and imports any new posts.
+
+    If `fetch` is given, it must be an already performed FeedFetch for this source, as prepared by update_feeds(), and no initial request is made.
+    Requests, including any redirects followed, go through `session_pool` when one is given.
+    """
+    logger.info('-' * 80)
+    logger.info('Reading feed: %s', source_feed)
+
+    old_interval = source_feed.interval
+    source_feed.last_result = ""
+
+    was302 = False
+
+    source_feed.last_polled = timezone.now()
+
+    if fetch is None:
+        fetch = prepare_fetch(source_feed, output, force=force, page=page, page_key=page_key).perform(session_pool)
 
-        feed_url = source_feed.feed_url
-        if page and page_key:
-            url_parts = urlparse(feed_url)
-            query = dict(parse_qsl(url_parts.query))
-            query[page_key] = page
-            new_query = urlencode(query)
-            feed_url = urlunparse(url_parts._replace(query=new_query))
+    headers = fetch.headers
+    proxies = fetch.proxies
+    proxy = fetch.proxy
 
-        logger.info("Fetching %s.", feed_url)
-        ret = requests.get(feed_url, headers=headers, allow_redirects=False, timeout=20, proxies=proxies)
+    ret = fetch.response
+    if fetch.error is None:
         source_feed.status_code = ret.status_code
         source_feed.last_result = "Unhandled Case"
         logger.info('Response: %s', str(ret))
-    except Exception as ex:
-        logging.exception("Fetch feed error from source %s url %s: %s", source_feed.id, source_feed.feed_url, ex)
-        source_feed.last_result = ("Fetch error:" + str(ex))[:255]
+    else:
+        ex = fetch.error
+        logging.error("Fetch feed error from source %s url %s: %s", source_feed.id, source_feed.feed_url, ex, exc_info=ex)
+        if isinstance(ex, FetchLimitExceeded):
+            source_feed.last_result = str(ex)[:255]
+        else:
+            source_feed.last_result = ("Fetch error:" + str(ex))[:255]
         source_feed.status_code = 0
 
         if proxy:
@@ -290,7 +401,8 @@ def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key
         source_feed.interval += 120
         source_feed.last_result = "The feed could not be found"
     elif ret.status_code in (403, 410): #Forbidden or gone
-        if "Cloudflare" in ret.text or ("Server" in ret.headers and "cloudflare" in ret.headers["Server"]):
+        # Only the start of error pages is downloaded, so this never scans more than FEEDS_SNIFF_BYTES.
+        if b"Cloudflare" in ret.content or ("Server" in ret.headers and "cloudflare" in ret.headers["Server"]):
             if source_feed.is_cloudflare and proxy is not None:
                 # we are already proxied - this proxy on cloudflare's shit list too?
                 proxy.delete()
@@ -335,10 +447,13 @@ def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key
 
                 # Follow the redirect and fetch the new URL
                 logger.info("Following permanent redirect to %s", new_url)
-                ret = requests.get(new_url, headers=headers, allow_redirects=True, timeout=20, proxies=proxies)
+                ret = http_get(new_url, session_pool, max_bytes=source_feed.max_body_size, headers=headers, allow_redirects=True, timeout=20, proxies=proxies)
                 source_feed.status_code = ret.status_code
             else:
                 source_feed.last_result = "Feed has moved but no location provided"
+        except FetchLimitExceeded as ex:
+            ret = None
+            source_feed.last_result = str(ex)[:255]
         except Exception as Ex:
             logger.info("\nError redirecting.")
             source_feed.last_result = "Error redirecting feed to " + new_url
@@ -357,7 +472,7 @@ def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key
 
                 new_url = start + end + new_url
 
-            ret = requests.get(new_url, headers=headers, allow_redirects=True, timeout=20)
+            ret = http_get(new_url, session_pool, max_bytes=source_feed.max_body_size, headers=headers, allow_redirects=True, timeout=20)
             source_feed.status_code = ret.status_code
             source_feed.last_result = "Temporary Redirect to " + new_url
 
@@ -378,6 +493,10 @@ def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key
 
                 source_feed.last_result = "Temporary Redirect to " + new_url + " since " + source_feed.last_302_start.strftime("%d %B")
 
+        except FetchLimitExceeded as ex:
+            ret = None
+            source_feed.last_result = str(ex)[:255]
+            source_feed.interval += 60
         except Exception as ex:
             source_feed.last_result = "Failed Redirection to " + new_url + " " + str(ex)
             source_feed.interval += 60
@@ -411,19 +530,30 @@ def read_feed(source_feed, output=NullOutput(), force=False, page=None, page_key
             content_type = ret.headers["Content-Type"]
         logger.info('content_type: %s', content_type)
 
-        (ok, changed) = import_feed(source_feed=source_feed, feed_body=ret.content, content_type=content_type, output=output)
-        if ok and changed:
-            logger.info('OK-changed')
-            source_feed.interval /= 2
-            source_feed.last_result = " OK (updated)" #and temporary redirects
-            source_feed.last_change = timezone.now()
-        elif ok:
-            logger.info('OK-unchanged')
-            source_feed.last_result = "OK"
-            source_feed.interval += 20 # we slow down feeds a little more that don't send headers we can use
+        # Many feeds send neither an etag nor a last-modified date, so compare the body itself with the one we last imported.
+        # Paged sources share a single digest between their pages, so they're always imported.
+        content_hash = hashlib.sha256(ret.content).hexdigest()
+        if not force and not page and content_hash == source_feed.content_hash:
+            logger.info('OK-unchanged (same content)')
+            source_feed.last_result = "OK (content unchanged)"
+            source_feed.last_success = timezone.now()
+            source_feed.interval += 20
         else:
-            logger.info('BAD')
-            source_feed.interval += 120
+            parsed = fetch.parsed if ret is fetch.response else None
+            (ok, changed) = import_feed(source_feed=source_feed, feed_body=ret.content, content_type=content_type, output=output, full=force, parsed=parsed)
+            source_feed.content_hash = content_hash if ok and not page else None
+            if ok and changed:
+                logger.info('OK-changed')
+                source_feed.interval /= 2
+                source_feed.last_result = " OK (updated)" #and temporary redirects
+                source_feed.last_change = timezone.now()
+            elif ok:
+                logger.info('OK-unchanged')
+                source_feed.last_result = "OK"
+                source_feed.interval += 20 # we slow down feeds a little more that don't send headers we can use
+            else:
+                logger.info('BAD')
+                source_feed.interval += 120
 
     source_feed.interval = max(source_feed.interval, 60) # no less than 1 hour
     source_feed.interval = min(source_feed.interval, 60 * 24) # no more than a day
@@ -454,90 +584,149 @@ def _get_value_from_html_parent(soup_item, css_selector):
     return value
 
 
-def parse_raw_html(source_feed, feed_body):
+def parse_raw_html(source_feed, feed_body, parsed=None):
+    """
+    Imports the items found in a web page by the source's html_item_* selectors.
+
+    If `parsed` is given, it's the FeedParse of get_raw_html_items() for the page, and the page isn't parsed again, unless the worker failed.
+    """
 
     ok = True
     changed = False
 
     try:
 
-        assert source_feed.html_item_class
-        assert source_feed.html_item_title_class
-        assert source_feed.html_item_link_class
-        assert source_feed.html_item_date_class
-
-        logger.info("Parsing raw HTML with BS.")
-        # print('feed_body:', feed_body)
-        soup = BeautifulSoup(feed_body, 'html.parser')
-        episodes = []
+        items = None
+        if parsed is not None:
+            items = parsed.get(source_feed, default=None)
+        if items is None:
+            items = get_raw_html_items(source_feed, feed_body)
 
-        # Find all episode containers using CSS selector
-        items = list(soup.select(source_feed.html_item_class))
-        logger.info(f'Found {len(items)} items.')
         for item in items:
-
-            # Extract link.
-            link = _get_value_from_html_parent(item, source_feed.html_item_link_class)
-            if link and link.startswith('/'):
-                link = link.strip()
-                link = get_base_url(source_feed.feed_url) + link
-
-            # Extract title.
-            title = _get_value_from_html_parent(item, source_feed.html_item_title_class)
-
-            # Extract date.
-            date = _get_value_from_html_parent(item, source_feed.html_item_date_class)
-            if date:
-                date = parse(date)
-                date = normalize_post_created(date, context=link or title or source_feed.feed_url)
-            logger.info('Publish date: %s', date)
-
-            if not link or not title or not date:
-                logger.info('Missing data.')
-                continue
-            logger.info('Found: %s %s %s', link, title, date)
-
-            m = hashlib.md5()
-            m.update(str((title, date)).encode('utf-8'))
-            guid = m.hexdigest()
+            title, link, date, guid = item['title'], item['link'], item['created'], item['guid']
 
             post_defaults = dict(title=title, link=link, created=date, found=timezone.now(), index=0, body='')
 
             logger.info('Getting or creating post %s %s for source %s...', title, guid, source_feed)
             try:
-                post, _changed = Post.objects.get_or_create(source=source_feed, guid=guid, defaults=post_defaults)
-                post.created = date
-                post.save()
-                if _changed:
-                    changed = True
+                # The import runs in one transaction, so roll back to a savepoint on a conflict instead of aborting the whole import.
+                with transaction.atomic():
+                    post = Post.objects.for_guid(source_feed, guid).first()
+                    _changed = post is None
+                    if _changed and source_feed.is_archived(date):
+                        continue
+                    if _changed:
+                        post = Post(source=source_feed, guid=guid, **post_defaults)
+                        Post.objects.allocate_slugs(source_feed, [post])
+                    post.created = date
+                    post.save()
 
-                Enclosure.objects.get_or_create(post=post, href=link, type='audio/mpeg')
+                    Enclosure.objects.get_or_create(post=post, href=link, type='audio/mpeg')
 
             except IntegrityError:
-                # If this happens, it usually means some idiot changed the non-editable permalink for their post after we initially parsed it,
-                # but left the title the same, resulting in a post with a duplicate slug but different GUID.
-                # Since we've already parsed this post, and have already loaded its enclosures, we'll ignore this revised post because the change
-                # is likely irrelevant.
+                # Another worker created the post, or took its slug, since we looked. It'll be picked up by the next import.
                 continue
 
+            source_feed.note_post_created(post.created, new=_changed)
+            if _changed:
+                changed = True
+
     except Exception as exc:
         logger.exception(f'Error parsing raw HTML for source {source_feed.id}.')
 
     return ok, changed
 
 
-def import_feed(source_feed, feed_body, content_type, output=NullOutput()):
+def get_raw_html_items(source_feed, feed_body):
+    """
+    Finds the items in a web page by the source's html_item_* selectors, and returns the title, link, created date and GUID of each.
+    """
+    assert source_feed.html_item_class
+    assert source_feed.html_item_title_class
+    assert source_feed.html_item_link_class
+    assert source_feed.html_item_date_class
+
+    logger.info("Parsing raw HTML with BS.")
+    # print('feed_body:', feed_body)
+    soup = BeautifulSoup(feed_body, 'html.parser')
+
+    # Find all episode containers using CSS selector
+    items = list(soup.select(source_feed.html_item_class))
+    logger.info(f'Found {len(items)} items.')
+    found = []
+    for item in items:
+
+        # Extract link.
+        link = _get_value_from_html_parent(item, source_feed.html_item_link_class)
+        if link and link.startswith('/'):
+            link = link.strip()
+            link = get_base_url(source_feed.feed_url) + link
+
+        # Extract title.
+        title = _get_value_from_html_parent(item, source_feed.html_item_title_class)
+
+        # Extract date.
+        date = _get_value_from_html_parent(item, source_feed.html_item_date_class)
+        if date:
+            date = parse(date)
+            date = normalize_post_created(date, context=link or title or source_feed.feed_url)
+        logger.info('Publish date: %s', date)
+
+        if not link or not title or not date:
+            logger.info('Missing data.')
+            continue
+        logger.info('Found: %s %s %s', link, title, date)
+
+        m = hashlib.md5()
+        m.update(str((title, date)).encode('utf-8'))
+        found.append({'title': title, 'link': link, 'created': date, 'guid': m.hexdigest()})
+
+    return found
+
+
+def import_feed(source_feed, feed_body, content_type, output=NullOutput(), full=False, parsed=None): # pylint: disable=too-many-positional-arguments
+    """
+    Parses a feed body and saves its posts.
+
+    Only the entries newer than those already imported are read, unless `full` is given or the source is due a full import. If `parsed` is
+    given, it's the FeedParse started for the body by prepare_parse(), and the body isn't parsed again.
+
+    Runs in a single transaction, so the import commits once and an error part way through leaves none of the feed's changes behind.
+    """
+    # Discard anything left over from an earlier import that failed.
+    source_feed.pop_pending_stats()
+    with transaction.atomic():
+        ret = _import_feed(source_feed, feed_body, content_type, output, full, parsed)
+        update_source_stats(source_feed, source_feed.pop_pending_stats())
+    return ret
+
+
+def get_feed_type(source_feed, feed_body, content_type):
+    """
+    Returns how a feed body is parsed: as a web page ("html"), an XML feed ("xml") or a JSON feed ("json"), or None if it's none of them.
+    """
+    if source_feed.extract_from_raw_html:
+        return 'html'
+    if "xml" in content_type or "html" in content_type or feed_body[0:1] == b"<":
+        return 'xml'
+    if "json" in content_type or feed_body[0:1] == b"{":
+        return 'json'
+    return None
+
+
+def _import_feed(source_feed, feed_body, content_type, output, full, parsed): # pylint: disable=too-many-positional-arguments
 
     ok = False
     changed = False
 
-    if source_feed.extract_from_raw_html:
+    feed_type = get_feed_type(source_feed, feed_body, content_type)
+    if feed_type == 'html':
         logger.info('Parsing raw HTML...')
-        (ok, changed) = parse_raw_html(source_feed, feed_body)
-    elif "xml" in content_type or "html" in content_type or feed_body[0:1] == b"<":
+        (ok, changed) = parse_raw_html(source_feed, feed_body, parsed=parsed)
+    elif feed_type == 'xml':
         logger.info('Parsing XML...')
-        (ok, changed) = parse_feed_xml(source_feed, feed_body, output)
-    elif "json" in content_type or feed_body[0:1] == b"{":
+        (ok, changed) = parse_feed_xml(source_feed, feed_body, output, full=full, parsed=parsed)
+    elif feed_type == 'json':
         logger.info('Parsing JSON...')
         (ok, changed) = parse_feed_json(source_feed, str(feed_body, "utf-8"), output) # pylint: disable=unbalanced-tuple-unpacking
     else:
@@ -549,17 +738,95 @@ def import_feed(source_feed, feed_body, content_type, output=NullOutput()):
         source_feed.last_result = " OK (updated)" #and temporary redirects
         source_feed.last_change = timezone.now()
 
-        idx = source_feed.max_index
+        assign_post_indexes(source_feed)
+
+    return (ok, changed)
+
+
+def update_source_stats(source_feed, pending=None):
+    """
+    Adds the changes collected by Source.note_post_created() during an import to the source's stats, and recounts its recent posts.
+
+    The recount only reads the source's posts from the last FEEDS_STATS_RECENT_DAYS days, and nothing is written if nothing changed.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.FEEDS_STATS_RECENT_DAYS)
+    recent_post_count = Post.objects.filter(source=source_feed, created__gte=cutoff).count()
+    stats, _created = SourceStats.objects.get_or_create(source=source_feed)
+    if not pending and stats.recent_post_count == recent_post_count:
+        return
+
+    updates = {'recent_post_count': recent_post_count, 'updated': timezone.now()}
+    if pending:
+        newest = Value(pending['newest_created'], output_field=DateTimeField())
+        oldest = Value(pending['oldest_created'], output_field=DateTimeField())
+        # Coalesce, because some databases return NULL from GREATEST and LEAST if any argument is NULL.
+        updates['post_count'] = F('post_count') + pending['new_posts']
+        updates['newest_created'] = Greatest(Coalesce('newest_created', newest), newest)
+        updates['oldest_created'] = Least(Coalesce('oldest_created', oldest), oldest)
+    SourceStats.objects.filter(pk=stats.pk).update(**updates)
+
+
+def rebuild_source_stats(sources=None):
+    """
+    Recomputes the stats of the given sources, or of all sources, from their posts.
+
+    Returns the number of sources updated.
+    """
+    if sources is None:
+        sources = Source.objects.all()
+    cutoff = timezone.now() - timedelta(days=settings.FEEDS_STATS_RECENT_DAYS)
+    count = 0
+    for source_ids in chunked(sources.values_list('pk', flat=True)):
+        aggregates = {
+            row['source']: row
+            for row in Post.objects.filter(source_id__in=source_ids).order_by().values('source').annotate(
+                post_count=Count('pk'),
+                newest_created=Max('created'),
+                oldest_created=Min('created'),
+                recent_post_count=Count('pk', filter=Q(created__gte=cutoff)),
+            )
+        }
+        stats = []
+        for source_id in source_ids:
+            row = aggregates.get(source_id, {})
+            stats.append(
+                SourceStats(
+                    source_id=source_id,
+                    post_count=row.get('post_count', 0),
+                    newest_created=row.get('newest_created'),
+                    oldest_created=row.get('oldest_created'),
+                    recent_post_count=row.get('recent_post_count', 0),
+                )
+            )
+        with transaction.atomic():
+            SourceStats.objects.filter(source_id__in=source_ids).delete()
+            SourceStats.objects.bulk_create(stats)
+        count += len(source_ids)
+    return count
+
+
+def assign_post_indexes(source_feed):
+    """
+    Gives the source's new posts, those with an index of 0, consecutive indices after its max_index, in order of their created date.
+
+    The source's row is locked while this runs and max_index is read from it afresh, so two workers importing the same source can't hand out
+    the same indices.
+    """
+    with transaction.atomic():
+        idx = Source.objects.select_for_update().filter(pk=source_feed.pk).values_list('max_index', flat=True).get()
         # give indices to posts based on created date
-        posts = Post.objects.filter(Q(source=source_feed) & Q(index=0)).order_by("created")
-        for p in posts:
+        post_ids = list(Post.objects.filter(Q(source=source_feed) & Q(index=0)).order_by("created", "pk").values_list('pk', flat=True))
+        posts = []
+        for pk in post_ids:
             idx += 1
-            p.index = idx
-            p.save()
-
-        source_feed.max_index = idx
+            posts.append(Post(pk=pk, index=idx))
+        Post.objects.bulk_update(posts, ['index'], batch_size=BULK_BATCH_SIZE)
+        Source.objects.filter(pk=source_feed.pk).update(max_index=idx)
 
-    return (ok, changed)
+    logger.info('Indexed %d new posts for source %s.', len(posts), source_feed)
+    source_feed.max_index = idx
+    # Already stored, so saving the source mustn't write it again over another worker's later value.
+    source_feed.take_snapshot(['max_index'])
 
 
 def clean_length(v):
@@ -578,204 +845,505 @@ def clean_length(v):
     return length
 
 
-def parse_feed_xml(source_feed, feed_content, output):
+def parse_feed_xml(source_feed, feed_content, output, full=False, parsed=None): # pylint: disable=too-many-positional-arguments
+    """
+    Imports the entries of an XML feed, or only its new ones unless `full` is given or the source is due a full import.
+
+    If `parsed` is given, it's the FeedParse of get_feed_xml_records() for the feed, and the feed isn't parsed again, unless the worker failed.
+    """
     logger.info('Parsing feed XML.')
 
-    ok = True
+    full = full or source_feed.needs_full_import()
+    result = None
+    if parsed is not None:
+        result = parsed.get(source_feed, default=None)
+    if result is not None and result[2] is not None:
+        # The worker only knew the GUIDs of the source's newest posts, so it may have read more entries than the database says are new, and
+        # they're dropped. Should it have read fewer, e.g. because posts were deleted since, the feed is parsed again here.
+        error, records, guids = result
+        count = count_new_entries(source_feed, guids)
+        result = (error, records[len(records) - count:], guids) if count <= len(records) else None
+    if result is None:
+        result = get_feed_xml_records(source_feed, feed_content, full=full)
+    error, records, _guids = result
+
+    ok = error is None
     changed = False
+    if ok:
+        source_feed.last_success = timezone.now() #in case we start auto unsubscribing long dead feeds
+
+        saved, changed = bulk_save_posts(source_feed, records)
+
+        reconcile_attachments([(p, record['enclosures'], record['media_content']) for record, p in saved])
+        if full:
+            source_feed.last_full_import = timezone.now()
+    else:
+        source_feed.last_result = error
+
+    return (ok, changed)
 
+
+def get_feed_xml_records(source_feed, feed_content, full=False, known_guids=None):
+    """
+    Parses an XML feed, updating the source's name, links and description from it, and returns an error message, or None if it could be read,
+    the records of its entries, or only of its new ones unless `full` is given, and, if `known_guids` is given, the GUIDs of all its entries,
+    newest first, or else None.
+
+    Nothing is written to the database. It's only read to tell new entries from known ones, and not at all if `known_guids` is given, in
+    which case only entries with those GUIDs count as known, and the caller is left to check the GUIDs returned against the database.
+    """
     try:
 
-        _customize_sanitizer(feedparser)
-        f = feedparser.parse(feed_content) #need to start checking feed parser errors here
+        # Sources that fell back to feedparser try the fast parser again on each full import.
+        f = parse_feed_document(source_feed, feed_content, retry_fast=full) #need to start checking feed parser errors here
         entries = f['entries']
-        if entries:
-            source_feed.last_success = timezone.now() #in case we start auto unsubscribing long dead feeds
-        else:
-            source_feed.last_result = "Feed is empty"
-            ok = False
+        if not entries:
+            return "Feed is empty", [], None
 
     except Exception as ex:
-        source_feed.last_result = "Feed Parse Error"
-        entries = []
-        ok = False
+        return "Feed Parse Error", [], None
 
-    if ok:
-        try:
-            if not source_feed.name:
-                source_feed.name = _sanitize_html(f.feed.title, "utf-8", 'text/html')
-        except Exception as ex:
-            pass
+    try:
+        if not source_feed.name:
+            source_feed.name = _sanitize_html(f.feed.title, "utf-8", 'text/html')
+    except Exception as ex:
+        pass
 
-        try:
-            source_feed.site_url = f.feed.link
-        except Exception as ex:
-            pass
+    try:
+        source_feed.site_url = f.feed.link
+    except Exception as ex:
+        pass
 
-        try:
-            source_feed.image_url = f.feed.image.href
-        except:
-            pass
+    try:
+        source_feed.image_url = f.feed.image.href
+    except:
+        pass
 
-        # either of these is fine, prefer description over summary
-        # also feedparser will give us itunes:summary etc if there
+    # either of these is fine, prefer description over summary
+    # also feedparser will give us itunes:summary etc if there
+    try:
+        source_feed.description = f.feed.summary
+    except:
+        pass
+
+    try:
+        source_feed.description = f.feed.description
+    except:
+        pass
+
+    guids = None
+    if full:
+        entries.reverse() # Entries are typically in reverse chronological order - put them in right order
+    else:
+        if known_guids is not None:
+            guids = [get_xml_entry_guid(e) for e in get_entries_newest_first(entries)]
+        entries = get_new_entries(source_feed, entries, known_guids=known_guids)
+    return None, [get_xml_entry_record(source_feed, e) for e in entries], guids
+
+
+def parse_feed_document(source_feed, feed_content, retry_fast=False):
+    """
+    Parses a feed document with the fast parser, or with feedparser if it can't be read with the fast parser, and remembers on the source
+    which of the two was used.
+
+    Sources that needed feedparser go straight to it afterwards, unless `retry_fast` is given, so that a single bad response doesn't keep a
+    source off the fast parser for good.
+    """
+    configure_feedparser()
+    if settings.FEEDS_FAST_XML_PARSER and (source_feed.xml_parser != 'feedparser' or retry_fast):
         try:
-            source_feed.description = f.feed.summary
-        except:
-            pass
+            f = xmlparser.parse(feed_content)
+        except (xmlparser.UnsupportedFeed, xmlparser.ParseError) as ex:
+            logger.info('Falling back to feedparser for %s: %s', source_feed, ex)
+        else:
+            source_feed.xml_parser = 'fast'
+            return f
+    f = feedparser.parse(feed_content)
+    if settings.FEEDS_FAST_XML_PARSER:
+        source_feed.xml_parser = 'feedparser'
+    return f
+
+
+def get_entries_newest_first(entries):
+    """
+    Returns the entries of a feed newest first. Feeds list their newest entries first, apart from the few in date order.
+    """
+    if entries and entries[0].get('published_parsed') and entries[-1].get('published_parsed'):
+        if entries[0]['published_parsed'] < entries[-1]['published_parsed']:
+            return entries[::-1]
+    return entries
+
+
+def get_new_entries(source_feed, entries, known_guids=None):
+    """
+    Returns the entries of a feed down to its already imported ones, oldest first, the order a full import saves them in.
+
+    Entries are read newest first, and reading stops after FEEDS_INCREMENTAL_KNOWN_ENTRIES consecutive entries whose posts exist. Those are
+    included, so edits to the newest entries are still picked up. Older ones are left to the source's next full import.
+
+    If `known_guids` is given, only entries with one of those GUIDs count as already imported, and the database isn't read.
+    """
+    entries = get_entries_newest_first(entries)
+    count = count_new_entries(source_feed, [get_xml_entry_guid(e) for e in entries], known_guids=known_guids)
+    logger.info('Reading %d of %d entries for source %s.', count, len(entries), source_feed)
+    return entries[:count][::-1]
+
+
+def count_new_entries(source_feed, guids, known_guids=None):
+    """
+    Returns how many of a feed's entries, given by their GUIDs newest first, get_new_entries() reads.
+
+    The GUIDs are looked up in batches of FEEDS_INCREMENTAL_KNOWN_ENTRIES, or in `known_guids` if it's given.
+    """
+    known_limit = settings.FEEDS_INCREMENTAL_KNOWN_ENTRIES
+    count = 0
+    known_run = 0
+    for batch in chunked(guids, known_limit):
+        if known_guids is None:
+            known = set(Post.objects.for_guids(source_feed, [guid for guid in batch if guid is not None]).values_list('guid', flat=True))
+        else:
+            known = known_guids
+        for guid in batch:
+            count += 1
+            known_run = known_run + 1 if guid in known else 0
+            if known_run >= known_limit:
+                return count
+    return count
+
 
+def get_xml_entry_guid(e):
+    """
+    Returns the GUID of a feedparser entry, or its link if it has none, or None if it has neither.
+    """
+    try:
+        return e.guid
+    except (AttributeError, KeyError):
         try:
-            source_feed.description = f.feed.description
-        except:
-            pass
+            return e.link
+        except (AttributeError, KeyError):
+            return None
 
-        entries.reverse() # Entries are typically in reverse chronological order - put them in right order
-        for e in entries:
 
-            # we are going to take the longest
-            body = ""
+def get_xml_entry_body(e):
+    """
+    Returns the longest of the content, summary and description of a feedparser entry, before it's sanitized for a post.
+    """
+    # we are going to take the longest
+    body = ""
 
-            if hasattr(e, "content"):
-                for c in e.content:
-                    if len(c.value) > len(body):
-                        body = c.value
+    if hasattr(e, "content"):
+        for c in e.content:
+            if len(c.value) > len(body):
+                body = c.value
 
-            if hasattr(e, "summary"):
-                if len(e.summary) > len(body):
-                    body = e.summary
+    if hasattr(e, "summary"):
+        if len(e.summary) > len(body):
+            body = e.summary
 
-            if hasattr(e, "summary_detail"):
-                if len(e.summary_detail.value) > len(body):
-                    body = e.summary_detail.value
+    if hasattr(e, "summary_detail"):
+        if len(e.summary_detail.value) > len(body):
+            body = e.summary_detail.value
 
-            if hasattr(e, "description"):
-                if len(e.description) > len(body):
-                    body = e.description
+    if hasattr(e, "description"):
+        if len(e.description) > len(body):
+            body = e.description
 
-            body = fix_relative(body, source_feed.site_url)
-            body = sanitize_html(body)
+    return body
 
-            guid = None
-            try:
-                guid = e.guid
-            except Exception as ex:
-                try:
-                    guid = e.link
-                except Exception as ex:
-                    m = hashlib.md5()
-                    m.update(body.encode("utf-8"))
-                    guid = m.hexdigest()
 
-            post_defaults = {}
+def get_xml_entry_record(source_feed, e):
+    """
+    Extracts everything we store about a feedparser entry into a plain dict, ready for bulk_save_posts().
+    """
 
-            try:
-                post_defaults['title'] = e.title
-            except (AttributeError, KeyError):
-                post_defaults['title'] = ""
+    body = get_xml_entry_body(e)
+    body = fix_relative(body, source_feed.site_url)
+    body = sanitize_html(body)
 
-            try:
-                post_defaults['link'] = e.link
-            except (AttributeError, KeyError):
-                post_defaults['link'] = ''
+    guid = get_xml_entry_guid(e)
+    if guid is None:
+        m = hashlib.md5()
+        m.update(body.encode("utf-8"))
+        guid = m.hexdigest()
 
-            try:
-                post_defaults['image_url'] = e.image.href
-            except (AttributeError, KeyError):
-                pass
+    post_defaults = {}
 
-            force_set_created = True
-            post_defaults['created'] = timezone.now()
-            if 'published_parsed' in e:
-                try:
-                    logger.info('Raw created date: %s', e.published_parsed)
-                    post_defaults['created'] = normalize_post_created(
-                        datetime.datetime.fromtimestamp(time.mktime(e.published_parsed)).replace(tzinfo=utc),
-                        context=guid or post_defaults.get('title') or source_feed.feed_url,
-                    )
-                    logger.info('Normalized created date: %s', post_defaults['created'])
-                except Exception as ex:
-                    force_set_created = False
-                    logging.warning(f"Unable to parse published timestamp: '{e.published_parsed}'")
+    try:
+        post_defaults['title'] = e.title
+    except (AttributeError, KeyError):
+        post_defaults['title'] = ""
 
-            try:
-                post_defaults['author'] = e.author
-            except (AttributeError, KeyError):
-                post_defaults['author'] = ""
+    try:
+        post_defaults['link'] = e.link
+    except (AttributeError, KeyError):
+        post_defaults['link'] = ''
 
-            post_defaults.setdefault('found', timezone.now())
-            post_defaults.setdefault('index', 0)
-            post_defaults.setdefault('body', ' ')
+    try:
+        post_defaults['image_url'] = e.image.href
+    except (AttributeError, KeyError):
+        pass
 
-            logger.info('Getting or creating post %s %s for source %s...', post_defaults['title'], guid, source_feed)
-            try:
-                p, changed = Post.objects.get_or_create(source=source_feed, guid=guid, defaults=post_defaults)
-                if force_set_created:
-                    p.created = post_defaults['created']
-                p.save()
-            except IntegrityError:
-                # If this happens, it usually means some idiot changed the non-editable permalink for their post after we initially parsed it,
-                # but left the title the same, resulting in a post with a duplicate slug but different GUID.
-                # Since we've already parsed this post, and have already loaded its enclosures, we'll ignore this revised post because the change
-                # is likely irrelevant.
-                continue
+    # The date the feed gives the entry, if it gives a usable one. Entries without one are dated when they're first found, and keep that date.
+    feed_created = None
+    post_defaults['created'] = timezone.now()
+    if 'published_parsed' in e:
+        try:
+            logger.info('Raw created date: %s', e.published_parsed)
+            published = datetime.datetime.fromtimestamp(time.mktime(e.published_parsed)).replace(tzinfo=utc)
+            post_defaults['created'] = normalize_post_created(published, context=guid or post_defaults.get('title') or source_feed.feed_url)
+            logger.info('Normalized created date: %s', post_defaults['created'])
+            if is_reasonable_post_created(published):
+                feed_created = published
+        except Exception as ex:
+            logging.warning(f"Unable to parse published timestamp: '{e.published_parsed}'")
 
-            seen_files = []
-            for ee in list(p.enclosures.all()):
-                # check existing enclosure is still there
-                found_enclosure = False
-                for pe in e["enclosures"]:
-                    enc_href = pe.get('href') or pe.get('url')
-                    if enc_href == ee.href and ee.href not in seen_files:
-                        found_enclosure = True
-                        ee.length = clean_length(pe.get("length"))
-                        typ = pe.get("type", None) or "audio/mpeg" # we are assuming podcasts here but that's probably not safe
-                        ee.type = typ
-                        ee.save()
-                        break
-
-                seen_files.append(ee.href)
-
-            if 'enclosures' in e:
-                for pe in e['enclosures']:
-                    enc_href = pe.get('href') or pe.get('url')
-                    if enc_href and enc_href not in seen_files and not p.enclosures.all().exists():
-                        length = clean_length(pe.get("length"))
-                        typ = pe.get("type") or "audio/mpeg"
-                        ee = Enclosure(post=p, href=enc_href[:2000], length=length, type=typ)
-                        ee.save()
-
-            if 'media_subtitle' in e:
-                p.subtitle_href = e['media_subtitle'].get('href')
-                p.subtitle_lang = e['media_subtitle'].get('lang')
-                p.subtitle_type = e['media_subtitle'].get('type')
+    try:
+        post_defaults['author'] = e.author
+    except (AttributeError, KeyError):
+        post_defaults['author'] = ""
+
+    post_defaults.setdefault('found', timezone.now())
+    post_defaults.setdefault('index', 0)
+
+    # Fields that are kept up to date on existing posts. Everything in post_defaults is only set when the post is created.
+    updates = {'body': body}
+    if feed_created is not None:
+        updates['created'] = feed_created
+    if 'media_subtitle' in e:
+        updates['subtitle_href'] = e['media_subtitle'].get('href')
+        updates['subtitle_lang'] = e['media_subtitle'].get('lang')
+        updates['subtitle_type'] = e['media_subtitle'].get('type')
+
+    enclosures = []
+    for pe in e.get('enclosures') or []:
+        enclosures.append({
+            'href': pe.get('href') or pe.get('url'),
+            'length': clean_length(pe.get("length")),
+            'type': pe.get("type") or "audio/mpeg", # we are assuming podcasts here but that's probably not safe
+        })
+
+    media_content = []
+    for media_dict in e.get('media_content') or []:
+        media_url = media_dict.get('url') or None
+        if not media_url:
+            continue
+        media_type = media_dict.get('type') or None
+        if not media_type:
+            continue
+        try:
+            media_duration = int(float(media_dict.get('duration') or None))
+        except (ValueError, TypeError):
+            media_duration = None
+        media_content.append({'url': media_url, 'content_type': media_type, 'duration': media_duration})
+
+    record = {
+        'guid': guid,
+        'defaults': post_defaults,
+        'updates': updates,
+        'enclosures': enclosures,
+        'media_content': media_content,
+    }
+    record['fingerprint'] = get_entry_fingerprint(record)
+    return record
+
+
+def get_entry_fingerprint(record):
+    """
+    Returns a short digest of everything we store about a feed entry, used to tell whether it has changed since it was last imported.
 
-            try:
-                p.body = body
-                p.save()
-            except Exception as ex:
-                logging.exception('Unable to save post body.')
+    Only what the feed supplied is included. Values filled in on import, like the date of an undated entry, would differ on every poll.
+    """
+    defaults = record['defaults']
+    data = [
+        defaults.get('title'),
+        defaults.get('link'),
+        defaults.get('image_url'),
+        defaults.get('author'),
+        record['updates'],
+        record['enclosures'],
+        record['media_content'],
+    ]
+    return hashlib.blake2b(json.dumps(data, sort_keys=True, default=str).encode('utf-8'), digest_size=16).hexdigest()
 
-            if 'media_content' in e:
-                for media_dict in e['media_content']:
-                    media_url = media_dict.get('url') or None
-                    if not media_url:
-                        continue
-                    media_type = media_dict.get('type') or None
-                    if not media_type:
-                        continue
-                    try:
-                        media_duration = int(float(media_dict.get('duration') or None))
-                    except (ValueError, TypeError):
-                        media_duration = None
-                    MediaContent.objects.get_or_create(post=p, url=media_url, content_type=media_type, defaults={'duration': media_duration})
-
-            # If no primary enclosure but media content contains an mp3 or mp4, then simulate one.
-            possible_enclosure_sources = p.media_content.filter(content_type__in=('video/mp4', 'audio/mpeg'))
-            if not p.enclosures.all().exists() and possible_enclosure_sources.exists():
-                media_source = possible_enclosure_sources.first()
-                Enclosure.objects.get_or_create(post=p, href=media_source.url, type=media_source.content_type, defaults={'length': media_source.duration})
 
-    return (ok, changed)
+def chunked(items, size=BULK_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_save_posts(source_feed, records):
+    """
+    Creates or updates a post for each entry record of a feed, using a fixed number of queries per batch of entries rather than several per entry.
+
+    Entries are applied in order, so when a GUID repeats, the first entry creates the post and later ones update it. A new post whose slug is
+    already taken by another post of the source gets a suffixed one. An entry whose fingerprint matches the one stored on its post is skipped,
+    so importing an unchanged feed writes nothing.
+
+    Returns a list of (record, post) pairs for the entries saved, and whether any new post was created.
+    """
+    records_by_guid = {}
+    for record in records:
+        records_by_guid.setdefault(record['guid'], []).append(record)
+
+    posts = {}
+    for guids in chunked(records_by_guid):
+        posts.update((p.guid, p) for p in Post.objects.for_guids(source_feed, guids) if p.guid in records_by_guid)
+    logger.info('Found %d existing and %d new posts for source %s.', len(posts), len(records_by_guid) - len(posts), source_feed)
+
+    # Create the new posts.
+    new_posts = []
+    for guid, guid_records in records_by_guid.items():
+        if guid in posts:
+            continue
+        p = Post(source=source_feed, guid=guid, body=' ', **guid_records[0]['defaults'])
+        for record in guid_records:
+            for name, value in record['updates'].items():
+                setattr(p, name, value)
+            p.fingerprint = record.get('fingerprint')
+        if source_feed.is_archived(p.created):
+            continue
+        p.apply_save_defaults()
+        new_posts.append(p)
+
+    # Posts whose titles repeat within the feed, e.g. several entries titled "Bonus episode", or entries whose GUID changed, get suffixed slugs.
+    Post.objects.allocate_slugs(source_feed, new_posts)
+    creatable_posts = new_posts
+
+    # Conflicts can still come from another worker importing the same feed. Ignoring them means no primary keys come back, so read the posts
+    # back instead, which also picks up any rows the other worker created.
+    Post.objects.bulk_create(creatable_posts, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    created_guids = set()
+    for guids in chunked(p.guid for p in creatable_posts):
+        for p in Post.objects.for_guids(source_feed, guids):
+            if p.guid not in records_by_guid:
+                continue
+            posts[p.guid] = p
+            created_guids.add(p.guid)
+    changed = bool(created_guids)
+
+    # Bodies aren't loaded by default. Only read those of the posts whose entries are about to be compared with them.
+    Post.objects.load_bodies([
+        p for guid, p in posts.items()
+        if guid in created_guids or any(not record.get('fingerprint') or record['fingerprint'] != p.fingerprint for record in records_by_guid[guid])
+    ])
+
+    # Apply each entry's updates, remembering which fields actually changed on which post. For the posts just created, that is only `created`,
+    # which bulk_create() overwrites because of auto_now_add.
+    saved = []
+    updated_posts = {}
+    for guid, guid_records in records_by_guid.items():
+        p = posts.get(guid)
+        if p is None:
+            continue
+        changed_fields = set()
+        for record in guid_records:
+            fingerprint = record.get('fingerprint')
+            if fingerprint and fingerprint == p.fingerprint and guid not in created_guids:
+                # Nothing about the entry has changed since it was last imported, so neither has the post or its attachments.
+                continue
+            saved.append((record, p))
+            if fingerprint != p.fingerprint:
+                p.fingerprint = fingerprint
+                changed_fields.add('fingerprint')
+            for name, value in record['updates'].items():
+                if getattr(p, name) != value:
+                    if name == 'body' and guid not in created_guids and p.has_bad_body_escaping is not None:
+                        p.has_bad_body_escaping = None
+                        changed_fields.add('has_bad_body_escaping')
+                    if name == 'body' and guid not in created_guids:
+                        p.legacy_body = None
+                        changed_fields.add('legacy_body')
+                    setattr(p, name, value)
+                    changed_fields.add(name)
+        if changed_fields:
+            p.updated_on = timezone.now()
+            changed_fields.add('updated_on')
+            updated_posts.setdefault(tuple(sorted(changed_fields)), []).append(p)
+
+    # Write only the changed fields, in one query per batch of posts sharing the same set of changes.
+    for fields, field_posts in updated_posts.items():
+        Post.objects.bulk_update(field_posts, fields, batch_size=BULK_BATCH_SIZE)
+
+    for p in {p.pk: p for _record, p in saved}.values():
+        source_feed.note_post_created(p.created, new=p.guid in created_guids)
+
+    return saved, changed
+
+
+def reconcile_attachments(items):
+    """
+    Brings the enclosures and media content of a feed's posts in line with its entries. All the existing rows are read up front and the
+    differences are written in bulk, so the number of queries doesn't grow with the number of entries.
+
+    `items` is a list of (post, enclosures, media_content) tuples, one per entry, where each enclosure is a dict of `href`, `length` and `type`,
+    and each media content a dict of `url`, `content_type` and `duration`. A post may appear more than once, in which case its entries are
+    applied in order.
+    """
+    post_ids = {p.pk for p, _enclosures, _media_content in items}
+    post_enclosures = {pk: [] for pk in post_ids}
+    post_media = {pk: [] for pk in post_ids}
+    for pks in chunked(post_ids):
+        for ee in Enclosure.objects.filter(post_id__in=pks).order_by('pk'):
+            post_enclosures[ee.post_id].append(ee)
+        for mc in MediaContent.objects.filter(post_id__in=pks).order_by('pk'):
+            post_media[mc.post_id].append(mc)
+
+    updated_enclosures = {}
+    new_enclosures = []
+    new_media = []
+    for p, enclosures, media_content in items:
+        current_enclosures = post_enclosures[p.pk]
+        seen_files = []
+        for ee in current_enclosures:
+            # check existing enclosure is still there
+            for pe in enclosures:
+                if pe['href'] == ee.href and ee.href not in seen_files:
+                    if (ee.length, ee.type) != (pe['length'], pe['type']):
+                        ee.length = pe['length']
+                        ee.type = pe['type']
+                        if ee.pk:
+                            updated_enclosures[ee.pk] = ee
+                    break
+            seen_files.append(ee.href)
+
+        for pe in enclosures:
+            # Since many RSS feeds embed trackers into their URL that constantly change, yet almost always only include a single enclosure,
+            # we'll only create a new enclosure when we see a new url if there are no enclosure records created yet.
+            # This is a most robust way of preventing logical duplicates due to tracker URL changes then by trying to predict and strip out
+            # all known tracker prefixes.
+            if pe['href'] and pe['href'] not in seen_files and not current_enclosures:
+                ee = Enclosure(post=p, href=pe['href'][:2000], length=pe['length'], type=pe['type'])
+                current_enclosures.append(ee)
+                new_enclosures.append(ee)
+
+        current_media = post_media[p.pk]
+        media_urls = {mc.url for mc in current_media}
+        for media in media_content:
+            if media['url'] in media_urls:
+                continue
+            mc = MediaContent(post=p, **media)
+            current_media.append(mc)
+            new_media.append(mc)
+            media_urls.add(mc.url)
+
+        # If no primary enclosure but media content contains an mp3 or mp4, then simulate one.
+        if not current_enclosures:
+            for mc in current_media:
+                if mc.content_type in ('video/mp4', 'audio/mpeg'):
+                    ee = Enclosure(post=p, href=mc.url, type=mc.content_type, length=mc.duration or 0)
+                    current_enclosures.append(ee)
+                    new_enclosures.append(ee)
+                    break
+
+    logger.info(
+        'Updating %d and creating %d enclosures, and creating %d media content for %d posts.', len(updated_enclosures), len(new_enclosures), len(new_media),
+        len(post_ids)
+    )
+    Enclosure.objects.bulk_update(list(updated_enclosures.values()), ['length', 'type'], batch_size=BULK_BATCH_SIZE)
+    Enclosure.objects.bulk_create(new_enclosures, batch_size=BULK_BATCH_SIZE)
+    # Another worker importing the same feed may have added the same media, which the unique_post_url constraint turns into a no-op.
+    MediaContent.objects.bulk_create(new_media, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
 
 
 def parse_size_in_bytes(s):
@@ -843,10 +1411,10 @@ def parse_feed_json(source_feed, feed_content, output):
             pass
 
         if "description" in f:
-            _customize_sanitizer(feedparser)
+            configure_feedparser()
             source_feed.description = _sanitize_html(f["description"], "utf-8", 'text/html')
 
-        _customize_sanitizer(feedparser)
+        configure_feedparser()
         if not source_feed.name:
             source_feed.name = _sanitize_html(source_feed.name, "utf-8", 'text/html')
 
@@ -854,6 +1422,7 @@ def parse_feed_json(source_feed, feed_content, output):
             source_feed.image_url = f["icon"]
 
         entries.reverse() # Entries are typically in reverse chronological order - put them in right order
+        attachments = []
         for e in entries:
             body = " "
             if "content_text" in e:
@@ -873,14 +1442,16 @@ def parse_feed_json(source_feed, feed_content, output):
                     m.update(body.encode("utf-8"))
                     guid = m.hexdigest()
 
+            is_new = False
             try:
-                p = Post.objects.get(source=source_feed, guid=guid)
+                p = Post.objects.with_body().for_guid(source_feed, guid).get()
                 logger.info("EXISTING: %s", guid)
             except Post.DoesNotExist:
                 logger.info("Creating new post %s.", guid)
                 p = Post(index=0, body=' ')
                 p.found = timezone.now()
                 changed = True
+                is_new = True
                 p.source = source_feed
 
             try:
@@ -889,12 +1460,10 @@ def parse_feed_json(source_feed, feed_content, output):
                 title = ""
 
             # borrow the RSS parser's sanitizer
-            _customize_sanitizer(feedparser)
-            body = _sanitize_html(body, "utf-8", 'text/html') # TODO: validate charset ??
+            body = sanitize_feed_html(body) # TODO: validate charset ??
             # Also apply our custom sanitize_html which handles double-escaped HTML
             body = sanitize_html(body)
-            _customize_sanitizer(feedparser)
-            title = _sanitize_html(title, "utf-8", 'text/html') # TODO: validate charset ??
+            title = sanitize_feed_html(title) # TODO: validate charset ??
             # no other fields are ever marked as |safe in the templates
 
             if "banner_image" in e:
@@ -925,49 +1494,41 @@ def parse_feed_json(source_feed, feed_content, output):
             except Exception as ex:
                 p.author = ""
 
+            if is_new and source_feed.is_archived(p.created):
+                continue
+
+            if is_new:
+                Post.objects.allocate_slugs(source_feed, [p])
             p.save()
+            source_feed.note_post_created(p.created, new=is_new)
 
-            seen_files = []
-            for ee in list(p.enclosures.all()):
-                # check existing enclosure is still there
-                found_enclosure = False
-                if "attachments" in e:
-                    for pe in e["attachments"]:
-                        if pe["url"] == ee.href and ee.href not in seen_files:
-                            found_enclosure = True
-                            ee.length = parse_size_in_bytes(pe.get("size_in_bytes", None))
-                            typ = pe.get("mime_type", None) or "audio/mpeg"
-                            ee.type = typ
-                            ee.save()
-                            break
-                seen_files.append(ee.href)
-
-            if "attachments" in e:
-                logger.debug('Found %s attachments.', len(e["attachments"]))
-                for pe in e["attachments"]:
-                    try:
-                        # Since many RSS feeds embed trackers into their URL that constantly change, yet almost always only include a single enclosure,
-                        # we'll only create a new enclosure when we see a new url if there are no enclosure records created yet.
-                        # This is a most robust way of preventing logical duplicates due to tracker URL changes then by trying to predict and strip out
-                        # all known tracker prefixes.
-                        if pe["url"] not in seen_files and not p.enclosures.all().exists():
-                            length = parse_size_in_bytes(pe.get("size_in_bytes", None))
-                            typ = pe.get("mime_type", None) or "audio/mpeg"
-                            ee = Enclosure(post=p, href=pe["url"], length=length, type=typ)
-                            ee.save()
-                    except Exception as ex:
-                        logger.exception('Unable to load attachment!')
+            enclosures = []
+            for pe in e.get("attachments") or []:
+                if not pe.get("url"):
+                    continue
+                try:
+                    enclosures.append({
+                        'href': pe["url"],
+                        'length': parse_size_in_bytes(pe.get("size_in_bytes", None)),
+                        'type': pe.get("mime_type", None) or "audio/mpeg",
+                    })
+                except Exception as ex:
+                    logger.exception('Unable to load attachment!')
+            attachments.append((p, enclosures, []))
 
             try:
-                p.body = body
-                p.save()
+                with transaction.atomic():
+                    p.body = body
+                    p.save()
             except Exception as ex:
                 logging.exception('Unable to save body!')
 
+        reconcile_attachments(attachments)
+
     return (ok, changed)
 
 
-def test_feed(source, cache=False, output=NullOutput()):
+def test_feed(source, cache=False, output=NullOutput(), session_pool=None):
 
     user_agent = get_agent(source)
     headers = {"User-Agent": user_agent} #identify ourselves and also stop our requests getting picked up by any cache
@@ -983,7 +1544,7 @@ def test_feed(source, cache=False, output=NullOutput()):
 
     output.write("\n" + str(headers))
 
-    ret = requests.get(source.feed_url, headers=headers, allow_redirects=False, verify=False, timeout=20)
+    ret = http_get(source.feed_url, session_pool, max_bytes=source.max_body_size, headers=headers, allow_redirects=False, verify=False, timeout=20)
 
     output.write("\n\n")
 
@@ -0,0 +1,1049 @@
+"""
+A streaming parser for well-formed RSS 2.0 and Atom 1.0 feeds that builds the same entries as feedparser, without its overhead.
+
+feedparser sniffs the encoding of every document, and then walks it with a SAX handler written in pure Python. For a well-formed UTF-8
+document, this module walks it with ElementTree's iterparse instead and applies the same rules to the same elements, reusing feedparser's
+own helpers for dates, URIs and sanitizing. The handlers below mirror feedparser's and are named after them, but only keep track of what
+the importer reads: entry content, links, enclosures, media content, images, authors and published dates, and the feed's title, link,
+image and description.
+
+Documents this parser can't guarantee to read the way feedparser would raise UnsupportedFeed, and malformed ones raise ParseError, so the
+caller can fall back to feedparser.
+
+Much of this builds on feedparser's private modules, so requirements.txt only allows the 6.0 releases it has been checked against.
+"""
+import codecs
+import copy
+import html.entities
+import io
+import re
+from xml.etree.ElementTree import ParseError, iterparse
+
+from feedparser.api import StrictFeedParser
+from feedparser.datetimes import _parse_date
+from feedparser.encodings import RE_XML_PI_ENCODING
+from feedparser.html import _cp1252
+from feedparser.mixin import _FeedParserMixin
+from feedparser.namespaces.psc import _parse_psc_chapter_start
+from feedparser.sanitizer import _HTMLSanitizer, _sanitize_html
+from feedparser.urls import RelativeURIResolver, _urljoin, resolve_relative_uris
+from feedparser.util import FeedParserDict
+
+from .sanitizer import get_feedparser_config, sanitize_cache
+
+__all__ = ['ParseError', 'UnsupportedFeed', 'parse']
+
+MATCH_NAMESPACES = {uri.lower(): prefix for uri, prefix in _FeedParserMixin.namespaces.items()}
+
+# Every element feedparser has a handler for. Those without a handler here make a document unsupported.
+FEEDPARSER_HANDLERS = {name for name in dir(StrictFeedParser) if name.startswith(('_start_', '_end_'))}
+
+UNSUPPORTED_BOMS = (codecs.BOM_UTF32_BE, codecs.BOM_UTF32_LE, codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE)
+
+XLINK_NAMESPACE = 'http://www.w3.org/1999/xlink'
+
+# Comments and marked sections, which the first of feedparser's two passes can leave for the second to read differently.
+TWO_PASS_MARKUP = re.compile(r'<!(--|\[)')
+
+
+class UnsupportedFeed(Exception):
+    """
+    Raised for a document the fast parser can't guarantee to read the way feedparser would.
+    """
+
+
+class ResolvingSanitizer(_HTMLSanitizer):
+    """
+    Resolves relative URIs and sanitizes markup in a single pass, with the same output as feedparser's two.
+
+    Without a base URI, resolving only strips the whitespace around URI attributes and writes the markup back out, so each tag's
+    attributes are given to the sanitizer the way it would read them back.
+    """
+
+    def unknown_starttag(self, tag, attrs):
+        attrs = [(key, self.escape_attribute(((tag, key) in RelativeURIResolver.relative_uris) and value.strip() or value))
+                 for key, value in self.normalize_attrs(attrs)]
+        super().unknown_starttag(tag, attrs)
+
+    def handle_entityref(self, ref):
+        if ref in html.entities.name2codepoint or ref == 'apos':
+            super().handle_entityref(ref)
+        else:
+            # Written out as "&amp;" and then the name as text, which the sanitizer drops inside e.g. scripts.
+            super().handle_entityref('amp')
+            self.handle_data(ref)
+
+    def escape_attribute(self, value):
+        value = value.replace('>', '&gt;').replace('<', '&lt;').replace('"', '&quot;')
+        return self.bare_ampersand.sub('&amp;', value)
+
+
+def resolve_and_sanitize(output, content_type):
+    """
+    Returns the same as feedparser's resolve_relative_uris() followed by _sanitize_html(), for a document without a base URI.
+    """
+    if '<' not in output and '&' not in output:
+        return output.strip().replace('\r\n', '\n')
+    if TWO_PASS_MARKUP.search(output):
+        return _sanitize_html(resolve_relative_uris(output, '', 'utf-8', content_type), 'utf-8', content_type)
+    sanitizer = ResolvingSanitizer('utf-8', content_type)
+    sanitizer.feed(output)
+    return sanitizer.output().strip().replace('\r\n', '\n')
+
+
+def check_document(data):
+    """
+    Raises UnsupportedFeed unless the document is one feedparser would read as UTF-8, without a DOCTYPE.
+    """
+    if not isinstance(data, bytes):
+        raise UnsupportedFeed('Only byte strings are supported.')
+    if data.startswith(UNSUPPORTED_BOMS):
+        raise UnsupportedFeed('Only UTF-8 documents are supported.')
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8):]
+    if not re.match(rb'\s*<[?!\w]', data):
+        raise UnsupportedFeed('Only UTF-8 documents are supported.')
+    match = RE_XML_PI_ENCODING.match(data)
+    if match and match.group(1).lower() != b'utf-8':
+        raise UnsupportedFeed(f'Unsupported encoding: {match.group(1)!r}')
+    # feedparser rewrites DOCTYPE and ENTITY declarations found before the root element.
+    start = re.search(rb'<\w', data)
+    head = data[:start.start()] if start else data
+    if b'<!' in head.replace(b'<!--', b''):
+        raise UnsupportedFeed('Documents with a DOCTYPE are not supported.')
+
+
+def parse(data):
+    """
+    Parses a feed document into the same FeedParserDict as feedparser.parse().
+    """
+    check_document(data)
+    parser = FastFeedParser()
+    parser.feed(data)
+    return FeedParserDict(
+        bozo=False,
+        entries=parser.entries,
+        feed=parser.feeddata,
+        headers={},
+        encoding='utf-8',
+        version=parser.version,
+        namespaces=parser.namespaces_in_use,
+    )
+
+
+class FastFeedParser:
+    """
+    Reproduces the state machine of feedparser's strict parser, for the subset of documents check_document() and the handlers accept.
+
+    Like feedparser's, it runs with no base URI, since it is only given the document.
+    """
+
+    can_be_relative_uri = _FeedParserMixin.can_be_relative_uri
+    can_contain_relative_uris = _FeedParserMixin.can_contain_relative_uris
+    can_contain_dangerous_markup = _FeedParserMixin.can_contain_dangerous_markup
+    html_types = _FeedParserMixin.html_types
+    map_content_type = staticmethod(_FeedParserMixin.map_content_type)
+    looks_like_html = staticmethod(_FeedParserMixin.looks_like_html)
+    _enforce_href = staticmethod(_FeedParserMixin._enforce_href)
+
+    def __init__(self):
+        self.feeddata = FeedParserDict()
+        self.entries = []
+        self.version = ''
+        self.namespaces_in_use = {}
+        self.namespacemap = {}
+        self.decls = {}
+
+        self.infeed = 0
+        self.inentry = 0
+        self.incontent = 0
+        self.intextinput = 0
+        self.inimage = 0
+        self.inauthor = 0
+        self.incontributor = 0
+        self.inpublisher = 0
+        self.insource = 0
+
+        self.sourcedata = FeedParserDict()
+        self.contentparams = FeedParserDict()
+        self._summary_key = None
+        self.elementstack = []
+        self.tagstack = []
+        self.lang = None
+        self.langstack = []
+        self.title_depth = -1
+        self.depth = 0
+        self.has_content = 0
+        self.guidislink = 0
+        self.psc_chapters_flag = False
+        self.property_depth_map = {}
+        self.sanitizer_config = get_feedparser_config()
+
+    def feed(self, data):
+        last_event = last_elem = None
+        for event, elem in iterparse(io.BytesIO(data), events=('start', 'end', 'start-ns')):
+            if event == 'start-ns':
+                self.start_prefix_mapping(*elem)
+                continue
+            # The text before this event, which feedparser would have been handed before it, belongs to the element of the previous one.
+            if last_event == 'start':
+                text = last_elem.text
+            elif last_event == 'end':
+                text = last_elem.tail
+                last_elem.clear()
+            else:
+                text = None
+            if text:
+                self.handle_data(text)
+            if event == 'start':
+                self.start_element(elem)
+            else:
+                self.end_element(elem)
+            last_event, last_elem = event, elem
+
+    def start_prefix_mapping(self, prefix, uri):
+        if not uri:
+            return
+        prefix = prefix or None
+        self.track_namespace(prefix, uri)
+        if prefix and uri == XLINK_NAMESPACE:
+            self.decls['xmlns:' + prefix] = uri
+
+    def track_namespace(self, prefix, uri):
+        loweruri = uri.lower()
+        if not self.version:
+            if (prefix, loweruri) == (None, 'http://my.netscape.com/rdf/simple/0.9/'):
+                self.version = 'rss090'
+            elif loweruri == 'http://purl.org/rss/1.0/':
+                self.version = 'rss10'
+            elif loweruri == 'http://www.w3.org/2005/atom':
+                self.version = 'atom10'
+        if loweruri.find('backend.userland.com/rss') != -1:
+            uri = 'http://backend.userland.com/rss'
+            loweruri = uri
+        if loweruri in MATCH_NAMESPACES:
+            self.namespacemap[prefix] = MATCH_NAMESPACES[loweruri]
+            self.namespaces_in_use[MATCH_NAMESPACES[loweruri]] = uri
+        else:
+            self.namespaces_in_use[prefix or ''] = uri
+
+    def get_tag(self, name):
+        """
+        Returns the name feedparser gives an element, its namespace's usual prefix and its lowercased local name.
+        """
+        if name[0] == '{':
+            namespace, localname = name[1:].split('}', 1)
+        else:
+            namespace, localname = None, name
+        lowernamespace = (namespace or '').lower()
+        if lowernamespace.find('backend.userland.com/rss') != -1:
+            namespace = lowernamespace = 'http://backend.userland.com/rss'
+        prefix = MATCH_NAMESPACES.get(lowernamespace)
+        localname = localname.lower()
+        if prefix:
+            localname = prefix.lower() + ':' + localname
+        elif namespace:
+            for name_, value in self.namespaces_in_use.items():
+                if name_ and value == namespace:
+                    localname = name_ + ':' + localname
+                    break
+        return localname.lower()
+
+    def get_attributes(self, attrib):
+        attrs_d, self.decls = self.decls, {}
+        for name, value in attrib.items():
+            if name[0] == '{':
+                namespace, localname = name[1:].split('}', 1)
+                prefix = MATCH_NAMESPACES.get(namespace.lower(), '')
+                if prefix:
+                    localname = prefix + ':' + localname
+            else:
+                localname = name
+            attrs_d[localname.lower()] = value
+        # The SAX driver also reports each attribute under its bare local name.
+        for name, value in attrib.items():
+            attrs_d[name.rsplit('}', 1)[-1].lower()] = value
+        return {k: v.lower() if k in ('rel', 'type') else v for k, v in attrs_d.items()}
+
+    def get_method(self, kind, tag):
+        if tag.find(':') != -1:
+            prefix, suffix = tag.split(':', 1)
+        else:
+            prefix, suffix = '', tag
+        prefix = self.namespacemap.get(prefix, prefix)
+        if prefix:
+            prefix = prefix + '_'
+        methodname = kind + prefix + suffix
+        method = getattr(self, methodname, None)
+        if method is None and methodname in FEEDPARSER_HANDLERS:
+            raise UnsupportedFeed(f'Unsupported element: {tag}')
+        return prefix, suffix, method
+
+    def start_element(self, elem):
+        self.depth += 1
+        tag = self.get_tag(elem.tag)
+        self.tagstack.append(tag)
+        attrs_d = self.get_attributes(elem.attrib)
+
+        if self.depth == 1 and not (tag == 'rss' or (tag == 'feed' and self.version == 'atom10')):
+            raise UnsupportedFeed(f'Unsupported feed format: {tag}')
+        if attrs_d.get('xml:base', attrs_d.get('base')):
+            raise UnsupportedFeed('Base URIs are not supported.')
+        if self.incontent:
+            raise UnsupportedFeed('Markup inside text elements is not supported.')
+        lang = attrs_d.get('xml:lang', attrs_d.get('lang'))
+        if lang == '':
+            lang = None
+        elif lang is None:
+            lang = self.lang
+        if lang and tag in ('feed', 'rss'):
+            self.feeddata['language'] = lang.replace('_', '-')
+        self.lang = lang
+        self.langstack.append(lang)
+
+        prefix, suffix, method = self.get_method('_start_', tag)
+
+        # Special hack for better tracking of empty textinput/image elements in illformed feeds.
+        if (not prefix) and tag not in ('title', 'link', 'description', 'name'):
+            self.intextinput = 0
+        if (not prefix) and tag not in ('title', 'link', 'description', 'url', 'href', 'width', 'height'):
+            self.inimage = 0
+
+        if method is not None:
+            method(attrs_d)
+        elif not attrs_d:
+            self.push(prefix + suffix, 1)
+        else:
+            self._get_context()[prefix + suffix] = attrs_d
+
+    def end_element(self, elem):
+        tag = self.tagstack.pop()
+        prefix, suffix, method = self.get_method('_end_', tag)
+        if method is not None:
+            method()
+        else:
+            self.pop(prefix + suffix)
+        self.langstack.pop()
+        if self.langstack:
+            self.lang = self.langstack[-1]
+        self.depth -= 1
+
+    def handle_data(self, text):
+        if not self.elementstack:
+            return
+        self.elementstack[-1][2].append(text)
+
+    def push(self, element, expecting_text):
+        self.elementstack.append([element, expecting_text, []])
+
+    def pop(self, element, strip_whitespace=1):
+        if not self.elementstack:
+            return None
+        if self.elementstack[-1][0] != element:
+            return None
+
+        element, expecting_text, pieces = self.elementstack.pop()
+        output = ''.join(pieces)
+        if strip_whitespace:
+            output = output.strip()
+        if not expecting_text:
+            return output
+
+        # resolve relative URIs
+        if (element in self.can_be_relative_uri) and output:
+            # do not resolve guid elements with isPermalink="false"
+            if not element == 'id' or self.guidislink:
+                output = _urljoin('', output)
+
+        # some feed formats require consumers to guess whether the content is html or plain text
+        if not self.version.startswith('atom') and self.contentparams.get('type') == 'text/plain':
+            if self.looks_like_html(output):
+                self.contentparams['type'] = 'text/html'
+
+        self.contentparams.pop('mode', None)
+        self.contentparams.pop('base64', None)
+
+        content_type = self.contentparams.get('type', 'text/html')
+        if self.map_content_type(content_type) in self.html_types:
+            if element in self.can_contain_relative_uris and element in self.can_contain_dangerous_markup:
+                if '<' in output:
+                    output = sanitize_cache.sanitize([self.sanitizer_config, content_type, output], lambda: resolve_and_sanitize(output, content_type))
+                else:
+                    # Text without markup is quicker to sanitize again than to look up.
+                    output = resolve_and_sanitize(output, content_type)
+            elif element in self.can_contain_relative_uris:
+                output = resolve_relative_uris(output, '', 'utf-8', content_type)
+            elif element in self.can_contain_dangerous_markup:
+                output = _sanitize_html(output, 'utf-8', content_type)
+
+        # address common error where people take data that is already utf-8, presume that it is iso-8859-1, and re-encode it.
+        try:
+            output = output.encode('iso-8859-1').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+
+        # map win-1252 extensions to the proper code points
+        output = output.translate(_cp1252)
+
+        if element in ('category', 'tags', 'itunes_keywords'):
+            return output
+
+        if element == 'title' and -1 < self.title_depth <= self.depth:
+            return output
+
+        # store output in appropriate place(s)
+        if self.inentry and not self.insource:
+            entry = self.entries[-1]
+            if element == 'content':
+                entry.setdefault(element, [])
+                contentparams = copy.deepcopy(self.contentparams)
+                contentparams['value'] = output
+                entry[element].append(contentparams)
+            elif element == 'link':
+                if not self.inimage:
+                    # query variables in urls in link elements are improperly converted from `?a=1&b=2` to `?a=1&b;=2`. fix this special case.
+                    output = output.replace('&amp;', '&')
+                    output = re.sub("&([A-Za-z0-9_]+);", r"&\g<1>", output)
+                    entry[element] = output
+                    if output:
+                        entry['links'][-1]['href'] = output
+            else:
+                if element == 'description':
+                    element = 'summary'
+                old_value_depth = self.property_depth_map.setdefault(entry, {}).get(element)
+                if old_value_depth is None or self.depth <= old_value_depth:
+                    self.property_depth_map[entry][element] = self.depth
+                    entry[element] = output
+                if self.incontent:
+                    contentparams = copy.deepcopy(self.contentparams)
+                    contentparams['value'] = output
+                    entry[element + '_detail'] = contentparams
+        elif self.infeed or self.insource:
+            context = self._get_context()
+            if element == 'description':
+                element = 'subtitle'
+            context[element] = output
+            if element == 'link':
+                output = re.sub("&([A-Za-z0-9_]+);", r"&\g<1>", output)
+                context[element] = output
+                context['links'][-1]['href'] = output
+            elif self.incontent:
+                contentparams = copy.deepcopy(self.contentparams)
+                contentparams['value'] = output
+                context[element + '_detail'] = contentparams
+        return output
+
+    def push_content(self, tag, attrs_d, default_content_type, expecting_text):
+        content_type = self.map_content_type(attrs_d.get('type', default_content_type))
+        if attrs_d.get('mode', '') == 'base64' or not (content_type.startswith('text/') or content_type.endswith(('+xml', '/xml'))):
+            raise UnsupportedFeed('Base64 encoded content is not supported.')
+        if content_type == 'application/xhtml+xml':
+            raise UnsupportedFeed('XHTML content is not supported.')
+        self.incontent += 1
+        if self.lang:
+            self.lang = self.lang.replace('_', '-')
+        self.contentparams = FeedParserDict({'type': content_type, 'language': self.lang, 'base': ''})
+        self.contentparams['base64'] = 0
+        self.push(tag, expecting_text)
+
+    def pop_content(self, tag):
+        value = self.pop(tag)
+        self.incontent -= 1
+        self.contentparams.clear()
+        return value
+
+    def _get_attribute(self, attrs_d, name):
+        if ':' in name:
+            prefix, suffix = name.split(':', 1)
+            name = self.namespacemap.get(prefix, prefix) + ':' + suffix
+        return attrs_d.get(name)
+
+    def _save(self, key, value, overwrite=False):
+        context = self._get_context()
+        if overwrite:
+            context[key] = value
+        else:
+            context.setdefault(key, value)
+
+    def _get_context(self):
+        if self.insource:
+            context = self.sourcedata
+        elif self.inimage and 'image' in self.feeddata:
+            context = self.feeddata['image']
+        elif self.intextinput:
+            context = self.feeddata['textinput']
+        elif self.inentry:
+            context = self.entries[-1]
+        else:
+            context = self.feeddata
+        return context
+
+    _save_author = _FeedParserMixin._save_author
+    _save_contributor = _FeedParserMixin._save_contributor
+    _sync_author_detail = _FeedParserMixin._sync_author_detail
+
+    def _cdf_common(self, attrs_d):
+        if 'lastmod' in attrs_d or 'href' in attrs_d:
+            raise UnsupportedFeed('CDF attributes are not supported.')
+
+    # Feed and entry structure.
+
+    def _start_rss(self, attrs_d):
+        versionmap = {'0.91': 'rss091u', '0.92': 'rss092', '0.93': 'rss093', '0.94': 'rss094'}
+        if not self.version or not self.version.startswith('rss'):
+            attr_version = attrs_d.get('version', '')
+            version = versionmap.get(attr_version)
+            if version:
+                self.version = version
+            elif attr_version.startswith('2.'):
+                self.version = 'rss20'
+            else:
+                self.version = 'rss'
+
+    def _start_channel(self, attrs_d):
+        self.infeed = 1
+        self._cdf_common(attrs_d)
+
+    def _start_feed(self, attrs_d):
+        self.infeed = 1
+
+    def _end_channel(self):
+        self.infeed = 0
+
+    _end_feed = _end_channel
+
+    def _start_item(self, attrs_d):
+        self.entries.append(FeedParserDict())
+        self.push('item', 0)
+        self.inentry = 1
+        self.guidislink = 0
+        self.title_depth = -1
+        id_ = self._get_attribute(attrs_d, 'rdf:about')
+        if id_:
+            self._get_context()['id'] = id_
+        self._cdf_common(attrs_d)
+
+    _start_entry = _start_item
+
+    def _end_item(self):
+        self.pop('item')
+        self.inentry = 0
+        self.has_content = 0
+
+    _end_entry = _end_item
+
+    def _start_image(self, attrs_d):
+        context = self._get_context()
+        if not self.inentry:
+            context.setdefault('image', FeedParserDict())
+        self.inimage = 1
+        self.title_depth = -1
+        self.push('image', 0)
+
+    def _end_image(self):
+        self.pop('image')
+        self.inimage = 0
+
+    def _start_textinput(self, attrs_d):
+        context = self._get_context()
+        context.setdefault('textinput', FeedParserDict())
+        self.intextinput = 1
+        self.title_depth = -1
+        self.push('textinput', 0)
+
+    def _end_textinput(self):
+        self.pop('textinput')
+        self.intextinput = 0
+
+    def _start_source(self, attrs_d):
+        if 'url' in attrs_d:
+            self.sourcedata['href'] = attrs_d['url']
+        self.push('source', 1)
+        self.insource = 1
+        self.title_depth = -1
+
+    def _end_source(self):
+        self.insource = 0
+        value = self.pop('source')
+        if value:
+            self.sourcedata['title'] = value
+        self._get_context()['source'] = copy.deepcopy(self.sourcedata)
+        self.sourcedata.clear()
+
+    # People.
+
+    def _start_author(self, attrs_d):
+        self.inauthor = 1
+        self.push('author', 1)
+        context = self._get_context()
+        context.setdefault('authors', [])
+        context['authors'].append(FeedParserDict())
+
+    _start_managingeditor = _start_itunes_author = _start_dc_author = _start_dc_creator = _start_author
+
+    def _end_author(self):
+        self.pop('author')
+        self.inauthor = 0
+        self._sync_author_detail()
+
+    _end_managingeditor = _end_itunes_author = _end_dc_author = _end_dc_creator = _end_author
+
+    def _start_contributor(self, attrs_d):
+        self.incontributor = 1
+        context = self._get_context()
+        context.setdefault('contributors', [])
+        context['contributors'].append(FeedParserDict())
+        self.push('contributor', 0)
+
+    def _end_contributor(self):
+        self.pop('contributor')
+        self.incontributor = 0
+
+    def _start_dc_contributor(self, attrs_d):
+        self.incontributor = 1
+        context = self._get_context()
+        context.setdefault('contributors', [])
+        context['contributors'].append(FeedParserDict())
+        self.push('name', 0)
+
+    def _end_dc_contributor(self):
+        self._end_name()
+        self.incontributor = 0
+
+    def _start_name(self, attrs_d):
+        self.push('name', 0)
+
+    _start_itunes_name = _start_name
+
+    def _end_name(self):
+        value = self.pop('name')
+        if self.inpublisher:
+            self._save_author('name', value, 'publisher')
+        elif self.inauthor:
+            self._save_author('name', value)
+        elif self.incontributor:
+            self._save_contributor('name', value)
+        elif self.intextinput:
+            self._get_context()['name'] = value
+
+    _end_itunes_name = _end_name
+
+    def _start_email(self, attrs_d):
+        self.push('email', 0)
+
+    _start_itunes_email = _start_email
+
+    def _end_email(self):
+        value = self.pop('email')
+        if self.inpublisher:
+            self._save_author('email', value, 'publisher')
+        elif self.inauthor:
+            self._save_author('email', value)
+        elif self.incontributor:
+            self._save_contributor('email', value)
+
+    _end_itunes_email = _end_email
+
+    def _start_url(self, attrs_d):
+        self.push('href', 1)
+
+    _start_homepage = _start_uri = _start_url
+
+    def _end_url(self):
+        value = self.pop('href')
+        if self.inauthor:
+            self._save_author('href', value)
+        elif self.incontributor:
+            self._save_contributor('href', value)
+
+    _end_homepage = _end_uri = _end_url
+
+    def _start_webmaster(self, attrs_d):
+        self.push('publisher', 1)
+
+    _start_dc_publisher = _start_webmaster
+
+    def _end_webmaster(self):
+        self.pop('publisher')
+        self._sync_author_detail('publisher')
+
+    _end_dc_publisher = _end_webmaster
+
+    def _start_itunes_owner(self, attrs_d):
+        self.inpublisher = 1
+        self.push('publisher', 0)
+
+    def _end_itunes_owner(self):
+        self.pop('publisher')
+        self.inpublisher = 0
+        self._sync_author_detail('publisher')
+
+    # Text.
+
+    def _start_title(self, attrs_d):
+        self.push_content('title', attrs_d, 'text/plain', self.infeed or self.inentry or self.insource)
+
+    _start_dc_title = _start_media_title = _start_title
+
+    def _end_title(self):
+        value = self.pop_content('title')
+        if not value:
+            return
+        self.title_depth = self.depth
+
+    _end_dc_title = _end_title
+
+    def _end_media_title(self):
+        title_depth = self.title_depth
+        self._end_title()
+        self.title_depth = title_depth
+
+    def _start_subtitle(self, attrs_d):
+        self.push_content('subtitle', attrs_d, 'text/plain', 1)
+
+    _start_tagline = _start_itunes_subtitle = _start_subtitle
+
+    def _end_subtitle(self):
+        self.pop_content('subtitle')
+
+    _end_tagline = _end_itunes_subtitle = _end_subtitle
+
+    def _start_rights(self, attrs_d):
+        self.push_content('rights', attrs_d, 'text/plain', 1)
+
+    _start_copyright = _start_dc_rights = _start_rights
+
+    def _end_rights(self):
+        self.pop_content('rights')
+
+    _end_copyright = _end_dc_rights = _end_rights
+
+    def _start_info(self, attrs_d):
+        self.push_content('info', attrs_d, 'text/plain', 1)
+
+    _start_feedburner_browserfriendly = _start_info
+
+    def _end_info(self):
+        self.pop_content('info')
+
+    _end_feedburner_browserfriendly = _end_info
+
+    def _start_description(self, attrs_d):
+        context = self._get_context()
+        if 'summary' in context and not self.has_content:
+            self._summary_key = 'content'
+            self._start_content(attrs_d)
+        else:
+            self.push_content('description', attrs_d, 'text/html', self.infeed or self.inentry or self.insource)
+
+    _start_dc_description = _start_media_description = _start_description
+
+    def _start_abstract(self, attrs_d):
+        self.push_content('description', attrs_d, 'text/plain', self.infeed or self.inentry or self.insource)
+
+    def _end_description(self):
+        if self._summary_key == 'content':
+            self._end_content()
+        else:
+            self.pop_content('description')
+        self._summary_key = None
+
+    _end_abstract = _end_dc_description = _end_media_description = _end_description
+
+    def _start_summary(self, attrs_d):
+        context = self._get_context()
+        if 'summary' in context and not self.has_content:
+            self._summary_key = 'content'
+            self._start_content(attrs_d)
+        else:
+            self._summary_key = 'summary'
+            self.push_content(self._summary_key, attrs_d, 'text/plain', 1)
+
+    _start_itunes_summary = _start_summary
+
+    def _end_summary(self):
+        if self._summary_key == 'content':
+            self._end_content()
+        else:
+            self.pop_content(self._summary_key or 'summary')
+        self._summary_key = None
+
+    _end_itunes_summary = _end_summary
+
+    def _start_content(self, attrs_d):
+        self.has_content = 1
+        self.push_content('content', attrs_d, 'text/plain', 1)
+        src = attrs_d.get('src')
+        if src:
+            self.contentparams['src'] = src
+        self.push('content', 1)
+
+    def _start_content_encoded(self, attrs_d):
+        self.has_content = 1
+        self.push_content('content', attrs_d, 'text/html', 1)
+
+    _start_fullitem = _start_content_encoded
+
+    def _end_content(self):
+        copy_to_summary = self.map_content_type(self.contentparams.get('type')) in ({'text/plain'} | self.html_types)
+        value = self.pop_content('content')
+        if copy_to_summary:
+            self._save('summary', value)
+
+    _end_content_encoded = _end_fullitem = _end_content
+
+    # Links and identifiers.
+
+    def _start_link(self, attrs_d):
+        attrs_d.setdefault('rel', 'alternate')
+        if attrs_d['rel'] == 'self':
+            attrs_d.setdefault('type', 'application/atom+xml')
+        else:
+            attrs_d.setdefault('type', 'text/html')
+        context = self._get_context()
+        attrs_d = self._enforce_href(attrs_d)
+        if 'href' in attrs_d:
+            attrs_d['href'] = _urljoin('', attrs_d['href'])
+        expecting_text = self.infeed or self.inentry or self.insource
+        context.setdefault('links', [])
+        if not (self.inentry and self.inimage):
+            context['links'].append(FeedParserDict(attrs_d))
+        if 'href' in attrs_d:
+            if attrs_d.get('rel') == 'alternate' and self.map_content_type(attrs_d.get('type')) in self.html_types:
+                context['link'] = attrs_d['href']
+        else:
+            self.push('link', expecting_text)
+
+    def _end_link(self):
+        self.pop('link')
+
+    def _start_guid(self, attrs_d):
+        self.guidislink = attrs_d.get('ispermalink', 'true') == 'true'
+        self.push('id', 1)
+
+    _start_id = _start_guid
+
+    def _end_guid(self):
+        value = self.pop('id')
+        self._save('guidislink', self.guidislink and 'link' not in self._get_context())
+        if self.guidislink:
+            self._save('link', value)
+
+    _end_id = _end_guid
+
+    def _start_enclosure(self, attrs_d):
+        attrs_d = self._enforce_href(attrs_d)
+        context = self._get_context()
+        attrs_d['rel'] = 'enclosure'
+        context.setdefault('links', []).append(FeedParserDict(attrs_d))
+
+    def _start_cc_license(self, attrs_d):
+        value = self._get_attribute(attrs_d, 'rdf:resource')
+        link = FeedParserDict(rel='license')
+        if value:
+            link['href'] = value
+        self._get_context().setdefault('links', []).append(link)
+
+    def _start_newlocation(self, attrs_d):
+        self.push('newlocation', 1)
+
+    def _end_newlocation(self):
+        # Where the feed says it has moved to isn't used.
+        self.pop('newlocation')
+
+    # Dates. Only the published date is parsed, since it's the only one read.
+
+    def _start_published(self, attrs_d):
+        self.push('published', 1)
+
+    _start_issued = _start_pubdate = _start_dcterms_issued = _start_published
+
+    def _end_published(self):
+        value = self.pop('published')
+        self._save('published_parsed', _parse_date(value), overwrite=True)
+
+    _end_issued = _end_pubdate = _end_dcterms_issued = _end_published
+
+    def _start_updated(self, attrs_d):
+        self.push('updated', 1)
+
+    _start_modified = _start_lastbuilddate = _start_dc_date = _start_dcterms_modified = _start_updated
+
+    def _end_updated(self):
+        self.pop('updated')
+
+    _end_modified = _end_lastbuilddate = _end_dc_date = _end_dcterms_modified = _end_updated
+
+    def _start_created(self, attrs_d):
+        self.push('created', 1)
+
+    _start_dcterms_created = _start_created
+
+    def _end_created(self):
+        self.pop('created')
+
+    _end_dcterms_created = _end_created
+
+    def _start_expirationdate(self, attrs_d):
+        self.push('expired', 1)
+
+    def _end_expirationdate(self):
+        self.pop('expired')
+
+    def _start_dcterms_valid(self, attrs_d):
+        self.push('validity', 1)
+
+    def _end_dcterms_valid(self):
+        self.pop('validity')
+
+    # Metadata that isn't read, but still has to be consumed the way feedparser does.
+
+    def _start_language(self, attrs_d):
+        self.push('language', 1)
+
+    _start_dc_language = _start_language
+
+    def _end_language(self):
+        self.lang = self.pop('language')
+
+    _end_dc_language = _end_language
+
+    def _start_width(self, attrs_d):
+        self.push('width', 0)
+
+    def _end_width(self):
+        self._end_dimension('width')
+
+    def _start_height(self, attrs_d):
+        self.push('height', 0)
+
+    def _end_height(self):
+        self._end_dimension('height')
+
+    def _end_dimension(self, key):
+        value = self.pop(key)
+        if value is None:
+            raise UnsupportedFeed(f'Misplaced {key} element.')
+        try:
+            value = int(value)
+        except ValueError:
+            value = 0
+        if self.inimage:
+            self._get_context()[key] = value
+
+    def _start_category(self, attrs_d):
+        self.push('category', 1)
+
+    _start_keywords = _start_dc_subject = _start_itunes_category = _start_media_category = _start_category
+
+    def _end_category(self):
+        self.pop('category')
+
+    _end_keywords = _end_dc_subject = _end_itunes_category = _end_media_category = _end_category
+
+    def _start_tags(self, attrs_d):
+        self.push('tags', 1)
+
+    def _end_tags(self):
+        self.pop('tags')
+
+    def _end_itunes_keywords(self):
+        self.pop('itunes_keywords')
+
+    def _end_media_keywords(self):
+        self.pop('media_keywords')
+
+    def _end_itunes_block(self):
+        self.pop('itunes_block', 0)
+
+    def _end_itunes_explicit(self):
+        self.pop('itunes_explicit', 0)
+
+    def _start_cloud(self, attrs_d):
+        self._get_context()['cloud'] = FeedParserDict(attrs_d)
+
+    def _start_generator(self, attrs_d):
+        self._get_context()['generator_detail'] = FeedParserDict()
+        self.push('generator', 1)
+
+    def _end_generator(self):
+        self.pop('generator')
+
+    def _start_itunes_image(self, attrs_d):
+        self.push('itunes_image', 0)
+        if attrs_d.get('href'):
+            self._get_context()['image'] = FeedParserDict({'href': attrs_d.get('href')})
+        elif attrs_d.get('url'):
+            self._get_context()['image'] = FeedParserDict({'href': attrs_d.get('url')})
+
+    _start_itunes_link = _start_itunes_image
+
+    # Media RSS.
+
+    def _start_media_group(self, attrs_d):
+        pass
+
+    def _start_media_content(self, attrs_d):
+        context = self._get_context()
+        context.setdefault('media_content', [])
+        context['media_content'].append(attrs_d)
+
+    def _start_media_thumbnail(self, attrs_d):
+        context = self._get_context()
+        context.setdefault('media_thumbnail', [])
+        self.push('url', 1)
+        context['media_thumbnail'].append(attrs_d)
+
+    def _end_media_thumbnail(self):
+        self.pop('url')
+
+    def _start_media_player(self, attrs_d):
+        self.push('media_player', 0)
+        self._get_context()['media_player'] = FeedParserDict(attrs_d)
+
+    def _end_media_player(self):
+        self.pop('media_player')
+
+    def _start_media_rating(self, attrs_d):
+        self.push('rating', 1)
+
+    def _end_media_rating(self):
+        self.pop('rating')
+
+    def _start_media_credit(self, attrs_d):
+        self.push('credit', 1)
+
+    def _end_media_credit(self):
+        self.pop('credit')
+
+    def _start_media_restriction(self, attrs_d):
+        self.push('restriction', 1)
+
+    def _end_media_restriction(self):
+        self.pop('restriction')
+
+    def _start_media_license(self, attrs_d):
+        self.push('license', 1)
+
+    def _end_media_license(self):
+        self.pop('license')
+
+    # Podlove chapters.
+
+    def _start_psc_chapters(self, attrs_d):
+        context = self._get_context()
+        if 'psc_chapters' not in context:
+            self.psc_chapters_flag = True
+            attrs_d['chapters'] = []
+            context['psc_chapters'] = FeedParserDict(attrs_d)
+
+    def _end_psc_chapters(self):
+        self.psc_chapters_flag = False
+
+    def _start_psc_chapter(self, attrs_d):
+        if self.psc_chapters_flag:
+            start = self._get_attribute(attrs_d, 'start')
+            if start is None:
+                raise UnsupportedFeed('Chapter without a start time.')
+            attrs_d['start_parsed'] = _parse_psc_chapter_start(start)
+            self._get_context()['psc_chapters']['chapters'].append(FeedParserDict(attrs_d))